@@ -0,0 +1,188 @@
+# align_utils.py
+
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+IDENTIFIER_KEY = 'Sr_No'
+MIN_ROW_SIMILARITY = 0.5
+# Largest rows1 x rows2 region aligned with the DP (the score table is float64)
+MAX_ALIGNMENT_CELLS = 4_000_000
+
+def _is_record_list(value):
+    """True for a list whose items are all dicts (line items, table rows, ...)."""
+    return isinstance(value, list) and all(isinstance(item, dict) for item in value)
+
+def _row_fields(row, separator='__', prefix=''):
+    """
+    Flatten a single record into {field: normalized value} for similarity scoring.
+    Nested lists are keyed by position; this is only used to score rows, not to compare them.
+    """
+    fields = {}
+    items = row.items() if isinstance(row, dict) else enumerate(row)
+    for key, value in items:
+        new_key = f"{prefix}{separator}{key}" if prefix else str(key)
+        if isinstance(value, (dict, list)):
+            fields.update(_row_fields(value, separator, new_key))
+        else:
+            fields[new_key] = str(value).strip().lower() if value is not None else ""
+    return fields
+
+def _scoring_fields(row, ignore_keys=(IDENTIFIER_KEY,)):
+    return {k: v for k, v in _row_fields(row).items() if k not in ignore_keys}
+
+def _pair_similarity(fields1, fields2):
+    """Similarity of a single pair of rows, on the same scale as row_similarity_matrix."""
+    if not fields1 and not fields2:
+        return 1.0
+    matches = sum(1 for key, value in fields1.items() if key in fields2 and fields2[key] == value)
+    union = len(fields1) + len(fields2) - len(fields1.keys() & fields2.keys())
+    return matches / union
+
+def _similarity_matrix(fields1, fields2):
+    n, m = len(fields1), len(fields2)
+    if n == 0 or m == 0:
+        return np.zeros((n, m))
+    all_fields = set().union(*fields1, *fields2)
+
+    matches = np.zeros((n, m), dtype=np.int32)
+    both_present = np.zeros((n, m), dtype=np.int32)
+    count1 = np.array([len(f) for f in fields1], dtype=np.int32)
+    count2 = np.array([len(f) for f in fields2], dtype=np.int32)
+
+    for field in all_fields:
+        codes = {}
+        # -1 marks a missing field; present values get a non-negative code
+        codes1 = np.array([codes.setdefault(f[field], len(codes)) if field in f else -1 for f in fields1])
+        codes2 = np.array([codes.setdefault(f[field], len(codes)) if field in f else -1 for f in fields2])
+        present = (codes1[:, None] >= 0) & (codes2[None, :] >= 0)
+        both_present += present
+        matches += present & (codes1[:, None] == codes2[None, :])
+
+    union = count1[:, None] + count2[None, :] - both_present
+    with np.errstate(divide='ignore', invalid='ignore'):
+        similarity = np.where(union > 0, matches / union, 1.0)
+    return similarity
+
+def row_similarity_matrix(rows1, rows2, ignore_keys=(IDENTIFIER_KEY,)):
+    """
+    Score every pair of rows as (#fields with equal values) / (#fields present in either row).
+    Values are interned to integer codes per field so each field is compared for all
+    pairs at once with NumPy broadcasting, instead of a Python loop over pairs.
+    """
+    return _similarity_matrix([_scoring_fields(row, ignore_keys) for row in rows1], [_scoring_fields(row, ignore_keys) for row in rows2])
+
+def _align_dp(similarity, min_similarity):
+    """Weighted LCS over a similarity matrix; returns pairs of local indices."""
+    n, m = similarity.shape
+    weights = np.where(similarity >= min_similarity, similarity, 0.0)
+
+    # score[i, j] = best alignment of rows1[:i] with rows2[:j]. Each DP row depends on the
+    # previous one elementwise plus a running max along j, so it is computed with NumPy.
+    score = np.zeros((n + 1, m + 1))
+    for i in range(1, n + 1):
+        candidates = np.maximum(score[i - 1, 1:], score[i - 1, :-1] + weights[i - 1])
+        score[i, 1:] = np.maximum.accumulate(candidates)
+
+    pairs = []
+    i, j = n, m
+    while i > 0 or j > 0:
+        if j > 0 and score[i, j] == score[i, j - 1]:
+            pairs.append((None, j - 1))
+            j -= 1
+        elif i > 0 and (j == 0 or score[i, j] == score[i - 1, j]):
+            pairs.append((i - 1, None))
+            i -= 1
+        else:
+            pairs.append((i - 1, j - 1))
+            i -= 1
+            j -= 1
+    pairs.reverse()
+    return pairs
+
+def align_records(rows1, rows2, min_similarity=MIN_ROW_SIMILARITY):
+    """
+    Align two lists of records, preserving order, so that inserted or dropped rows don't
+    shift every following row. This is a weighted LCS: it maximizes the summed similarity
+    of paired rows, and only pairs rows at least `min_similarity` alike.
+
+    Rows that already line up at the start and the end are paired directly, so only the
+    region around the insertions/deletions goes through the O(n*m) alignment. If that
+    region is still larger than MAX_ALIGNMENT_CELLS it is paired by position.
+
+    Returns a list of (index1, index2) pairs in document order, where either index is
+    None for a row present on one side only.
+    """
+    n, m = len(rows1), len(rows2)
+    fields1 = [_scoring_fields(row) for row in rows1]
+    fields2 = [_scoring_fields(row) for row in rows2]
+
+    prefix = 0
+    while prefix < min(n, m) and _pair_similarity(fields1[prefix], fields2[prefix]) >= min_similarity:
+        prefix += 1
+    suffix = 0
+    while suffix < min(n, m) - prefix and _pair_similarity(fields1[n - 1 - suffix], fields2[m - 1 - suffix]) >= min_similarity:
+        suffix += 1
+
+    pairs = [(i, i) for i in range(prefix)]
+    middle1 = fields1[prefix:n - suffix]
+    middle2 = fields2[prefix:m - suffix]
+    if len(middle1) * len(middle2) <= MAX_ALIGNMENT_CELLS:
+        for i, j in _align_dp(_similarity_matrix(middle1, middle2), min_similarity):
+            pairs.append((prefix + i if i is not None else None, prefix + j if j is not None else None))
+    else:
+        logger.warning("Record lists too different to align (%d x %d rows); pairing by position.", len(middle1), len(middle2))
+        for k in range(max(len(middle1), len(middle2))):
+            pairs.append((prefix + k if k < len(middle1) else None, prefix + k if k < len(middle2) else None))
+    pairs.extend((n - suffix + k, m - suffix + k) for k in range(suffix))
+    return pairs
+
+def _aligned_identifiers(rows1, rows2, pairs):
+    """
+    Pick one identifier per aligned position: the row's 'Sr_No' when present (left side first),
+    otherwise the aligned position. Duplicates are disambiguated with the position.
+    """
+    identifiers = []
+    seen = set()
+    for position, (i, j) in enumerate(pairs):
+        identifier = position
+        for row in (rows1[i] if i is not None else None, rows2[j] if j is not None else None):
+            if row is not None and IDENTIFIER_KEY in row:
+                identifier = row[IDENTIFIER_KEY]
+                break
+        identifier = str(identifier)
+        if identifier in seen:
+            identifier = f"{identifier}~{position}"
+        seen.add(identifier)
+        identifiers.append(identifier)
+    return identifiers
+
+def align_json(json1, json2):
+    """
+    Return copies of two JSON documents in which every pair of record lists has been aligned
+    and re-keyed by a shared identifier. A row missing on one side becomes an empty record,
+    so `flatten_json` reports its fields as missing instead of shifting the rows after it.
+    """
+    if isinstance(json1, dict) and isinstance(json2, dict):
+        aligned1, aligned2 = {}, {}
+        for key in list(json1) + [key for key in json2 if key not in json1]:
+            if key in json1 and key in json2:
+                aligned1[key], aligned2[key] = align_json(json1[key], json2[key])
+            elif key in json1:
+                aligned1[key] = json1[key]
+            else:
+                aligned2[key] = json2[key]
+        return aligned1, aligned2
+
+    if _is_record_list(json1) and _is_record_list(json2) and (json1 or json2):
+        pairs = align_records(json1, json2)
+        identifiers = _aligned_identifiers(json1, json2, pairs)
+        aligned1, aligned2 = {}, {}
+        for identifier, (i, j) in zip(identifiers, pairs):
+            row1 = json1[i] if i is not None else {}
+            row2 = json2[j] if j is not None else {}
+            aligned1[identifier], aligned2[identifier] = align_json(row1, row2)
+        return aligned1, aligned2
+
+    return json1, json2
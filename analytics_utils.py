@@ -0,0 +1,393 @@
+# analytics_utils.py
+#
+# Corpus-level analytics over many extra-accuracy vs standard comparisons.
+# Every comparison is appended to a columnar history (Parquet part files): one row per
+# compared field and one row per run. Summaries are grouped, vectorized pandas operations
+# over that history.
+#
+#   python analytics_utils.py --parser "Kores Cheque Front" --export summary.zip
+
+import io
+import os
+import time
+import uuid
+import atexit
+import zipfile
+import logging
+import argparse
+import tempfile
+import threading
+import pandas as pd
+import streamlit as st
+from filelock import FileLock
+from schema_utils import generalize_key, NULL_EQUIVALENTS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HISTORY_DIR = os.environ.get("OCR_HISTORY_DIR", os.path.join(tempfile.gettempdir(), 'ocr_comparison_history'))
+# Comparisons older than this many days are dropped when the history is compacted (0 keeps them all)
+RETENTION_DAYS = float(os.environ.get("OCR_HISTORY_RETENTION_DAYS", "90"))
+# The history is compacted (and old comparisons dropped) at least this often
+COMPACT_INTERVAL_SECONDS = 24 * 60 * 60
+# Reads retried when another process compacts the part files being read
+READ_ATTEMPTS = 3
+# Buffered field rows are written out as a new part file once this many accumulate
+FLUSH_ROWS = 50_000
+# Part files are merged into one once there are more than this many
+MAX_PARTS = 64
+# Parquet codec for new part files; zstd stores the repetitive field values in far less
+# space than the default snappy, and parts written with either codec read back the same
+PARQUET_COMPRESSION = os.environ.get("OCR_HISTORY_COMPRESSION", "zstd")
+TOP_CONFUSIONS = 5
+
+FIELD_COLUMNS = ['run_id', 'parser', 'ts', 'field', 'field_pattern', 'value_extra', 'value_standard', 'match']
+RUN_COLUMNS = ['run_id', 'parser', 'ts', 'source', 'time_extra', 'time_standard', 'fields', 'mismatches']
+
+MISSING_IN_STANDARD = "missing in standard"
+MISSING_IN_EXTRA = "missing in extra accuracy"
+VALUE_DIFFERS = "value differs"
+
+class ComparisonHistory:
+    """
+    Append-only columnar history of comparisons, shared by all sessions of a process.
+    Several processes (Streamlit, gateway) may write to the same directory: each flush
+    writes its own uniquely named part file, compaction is serialized by a lock file, and
+    reads that lose a race with another process's compaction list the parts again.
+    """
+
+    def __init__(self, directory=DEFAULT_HISTORY_DIR, flush_rows=FLUSH_ROWS):
+        self.directory = directory
+        self.flush_rows = flush_rows
+        self._fields = []
+        self._runs = []
+        self._buffered_rows = 0
+        self._lock = threading.Lock()
+        # (part files, runs DataFrame) of the last runs-table read; part files never change once written
+        self._runs_cache = ((), pd.DataFrame(columns=RUN_COLUMNS))
+        # Never compacted by this process yet: the first record or load does it
+        self._compacted_at = 0.0
+        atexit.register(self.flush)
+
+    def record(self, parser, comparison_df, time_extra=None, time_standard=None, source="runner"):
+        """Append one run's comparison table (Attribute / both results / Comparison columns)."""
+        run_id = uuid.uuid4().hex
+        ts = pd.Timestamp.now(tz='UTC')
+        fields = comparison_df['Attribute'].astype(str)
+        patterns = {key: generalize_key(key) for key in fields.unique()}
+        # Near matches ("≈") count as mismatches: the history tracks exact agreement
+        match = comparison_df['Comparison'] == "✔"
+        field_rows = pd.DataFrame({
+            'run_id': run_id,
+            'parser': parser,
+            'ts': ts,
+            'field': fields.values,
+            'field_pattern': fields.map(patterns).values,
+            'value_extra': comparison_df['Result with Extra Accuracy'].astype(str).values,
+            'value_standard': comparison_df['Result without Extra Accuracy'].astype(str).values,
+            'match': match.values,
+        }, columns=FIELD_COLUMNS)
+        run_row = {
+            'run_id': run_id, 'parser': parser, 'ts': ts, 'source': source,
+            'time_extra': time_extra, 'time_standard': time_standard,
+            'fields': len(field_rows), 'mismatches': int((~match).sum()),
+        }
+        with self._lock:
+            self._fields.append(field_rows)
+            self._runs.append(run_row)
+            self._buffered_rows += len(field_rows)
+            if self._buffered_rows >= self.flush_rows:
+                self._flush_locked()
+            compact_due = time.time() - self._compacted_at > COMPACT_INTERVAL_SECONDS
+            if compact_due:
+                self._compacted_at = time.time()
+        if compact_due:
+            # Drops expired comparisons off the request path
+            threading.Thread(target=self._compact_quietly, name="history-compact", daemon=True).start()
+        return run_id
+
+    def flush(self):
+        """Write buffered rows to new part files."""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._runs:
+            return
+        part = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet"
+        fields = pd.concat(self._fields, ignore_index=True) if self._fields else pd.DataFrame(columns=FIELD_COLUMNS)
+        runs = pd.DataFrame(self._runs, columns=RUN_COLUMNS)
+        for table, df in (('fields', fields), ('runs', runs)):
+            table_dir = os.path.join(self.directory, table)
+            os.makedirs(table_dir, exist_ok=True)
+            # Written under a temporary name so readers never see a partial file
+            path = os.path.join(table_dir, part)
+            df.to_parquet(path + '.tmp', index=False, compression=PARQUET_COMPRESSION)
+            os.replace(path + '.tmp', path)
+        logger.info("Flushed %d runs (%d field rows) to the comparison history.", len(runs), len(fields))
+        self._fields, self._runs, self._buffered_rows = [], [], 0
+
+    def _parts(self, table):
+        table_dir = os.path.join(self.directory, table)
+        if not os.path.isdir(table_dir):
+            return []
+        return sorted(os.path.join(table_dir, name) for name in os.listdir(table_dir) if name.endswith('.parquet'))
+
+    def _read(self, table, **kwargs):
+        """(part files, DataFrame) of a table, or ((), None) if it has no parts yet."""
+        for attempt in range(READ_ATTEMPTS):
+            parts = tuple(self._parts(table))
+            if not parts:
+                return (), None
+            try:
+                return parts, pd.read_parquet(list(parts), **kwargs)
+            except FileNotFoundError:
+                # Compacted by another process since they were listed; the merged part replaces them
+                logger.info("History parts of '%s' changed during a read (attempt %d).", table, attempt + 1)
+        # Still racing: read whatever parts remain, one at a time
+        frames = []
+        for part in parts:
+            try:
+                frames.append(pd.read_parquet(part, **kwargs))
+            except FileNotFoundError:
+                continue
+        return parts, pd.concat(frames, ignore_index=True) if frames else None
+
+    def _compact_quietly(self):
+        try:
+            self.compact()
+        except Exception:
+            logger.exception("Compacting the comparison history failed.")
+
+    def compact(self):
+        """
+        Merge each table's part files into one, so loads stay fast as the corpus grows, and
+        drop comparisons older than RETENTION_DAYS.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        cutoff = pd.Timestamp.now(tz='UTC') - pd.Timedelta(days=RETENTION_DAYS) if RETENTION_DAYS > 0 else None
+        with self._lock, FileLock(os.path.join(self.directory, '.compact.lock')):
+            self._flush_locked()
+            for table in ('fields', 'runs'):
+                # Listed under the lock: another process may have compacted them meanwhile
+                parts = self._parts(table)
+                if not parts:
+                    continue
+                merged = pd.concat((pd.read_parquet(path) for path in parts), ignore_index=True)
+                rows = len(merged)
+                if cutoff is not None:
+                    merged = merged[merged['ts'] >= cutoff]
+                if len(parts) == 1 and len(merged) == rows:
+                    continue
+                path = os.path.join(self.directory, table, f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet")
+                merged.to_parquet(path + '.tmp', index=False, compression=PARQUET_COMPRESSION)
+                os.replace(path + '.tmp', path)
+                for part in parts:
+                    try:
+                        os.remove(part)
+                    except FileNotFoundError:
+                        pass
+            self._compacted_at = time.time()
+
+    def load(self, parsers=None, since=None, columns=None):
+        """
+        Return (fields_df, runs_df) for the given parsers (all if None) recorded at or after `since`.
+        String columns are categorical to keep grouping over large corpora fast.
+        """
+        self.flush()
+        if len(self._parts('fields')) > MAX_PARTS or time.time() - self._compacted_at > COMPACT_INTERVAL_SECONDS:
+            self.compact()
+        filters = []
+        if parsers:
+            filters.append(('parser', 'in', list(parsers)))
+        if since is not None:
+            since = pd.Timestamp(since)
+            filters.append(('ts', '>=', since.tz_localize('UTC') if since.tzinfo is None else since))
+        frames = []
+        for table, table_columns in (('fields', FIELD_COLUMNS), ('runs', RUN_COLUMNS)):
+            _, df = self._read(table, filters=filters or None, columns=columns if table == 'fields' else None)
+            if df is None:
+                frames.append(pd.DataFrame(columns=table_columns))
+                continue
+            for column in ('parser', 'field', 'field_pattern', 'source'):
+                if column in df.columns:
+                    df[column] = df[column].astype('category')
+            frames.append(df)
+        return frames[0], frames[1]
+
+    def recent_runs(self, parser, limit):
+        """
+        The parser's most recent `limit` runs (runs table only), including runs not yet flushed.
+        Cheap enough to call on every OCR run: parsed part files are cached until new ones appear.
+        """
+        cached_parts, runs = self._runs_cache
+        if tuple(self._parts('runs')) != cached_parts:
+            parts, runs = self._read('runs')
+            runs = runs if runs is not None else pd.DataFrame(columns=RUN_COLUMNS)
+            self._runs_cache = (parts, runs)
+        with self._lock:
+            buffered = [run for run in self._runs if run['parser'] == parser]
+        runs = runs[runs['parser'] == parser]
+        if buffered:
+            buffered = pd.DataFrame(buffered, columns=RUN_COLUMNS)
+            runs = pd.concat([runs, buffered], ignore_index=True) if len(runs) else buffered
+        return runs.sort_values('ts').tail(limit)
+
+    def parsers(self):
+        """Names of all parsers with recorded runs."""
+        self.flush()
+        _, runs = self._read('runs', columns=['parser'])
+        return [] if runs is None else sorted(runs['parser'].unique())
+
+def field_mismatch_rates(fields_df, by='field_pattern', min_documents=1):
+    """Per parser and field: documents seen, mismatches and mismatch rate, worst first."""
+    grouped = fields_df.groupby(['parser', by], observed=True)
+    summary = grouped.agg(documents=('run_id', 'nunique'), observations=('match', 'size'), matches=('match', 'sum'))
+    summary['mismatches'] = summary['observations'] - summary['matches']
+    summary['mismatch_rate'] = summary['mismatches'] / summary['observations']
+    summary = summary[summary['documents'] >= min_documents].drop(columns='matches')
+    return summary.sort_values(['mismatch_rate', 'mismatches'], ascending=False).reset_index()
+
+def _null_mask(values):
+    return values.str.strip().str.lower().isin(NULL_EQUIVALENTS | {"none"})
+
+def confusion_summary(fields_df, by='field_pattern', top=TOP_CONFUSIONS):
+    """
+    How fields disagree: per parser and field, the number of mismatches where the value is
+    missing in one mode vs present with a different value, plus the most frequent
+    (extra accuracy, standard) value pairs.
+    """
+    mismatches = fields_df.loc[~fields_df['match'], ['parser', by, 'value_extra', 'value_standard']]
+    if mismatches.empty:
+        return (pd.DataFrame(columns=['parser', by, MISSING_IN_STANDARD, MISSING_IN_EXTRA, VALUE_DIFFERS]),
+                pd.DataFrame(columns=['parser', by, 'value_extra', 'value_standard', 'count']))
+    null_extra = _null_mask(mismatches['value_extra'].astype(str))
+    null_standard = _null_mask(mismatches['value_standard'].astype(str))
+    kind = pd.Series(VALUE_DIFFERS, index=mismatches.index)
+    kind[null_standard & ~null_extra] = MISSING_IN_STANDARD
+    kind[null_extra & ~null_standard] = MISSING_IN_EXTRA
+    kinds = (
+        mismatches.assign(kind=kind).groupby(['parser', by, 'kind'], observed=True).size()
+        .unstack('kind', fill_value=0)
+        .reindex(columns=[MISSING_IN_STANDARD, MISSING_IN_EXTRA, VALUE_DIFFERS], fill_value=0)
+        .reset_index()
+    )
+    kinds.columns.name = None
+    pairs = (
+        mismatches.groupby(['parser', by, 'value_extra', 'value_standard'], observed=True).size()
+        .rename('count').reset_index()
+        .sort_values(['parser', by, 'count'], ascending=[True, True, False])
+        .groupby(['parser', by], observed=True).head(top)
+        .reset_index(drop=True)
+    )
+    return kinds, pairs
+
+def parser_summary(runs_df):
+    """
+    Per parser: documents, agreement (all fields / share of fields) and latency for each mode,
+    including the extra accuracy - standard latency delta.
+    """
+    runs = runs_df.assign(
+        delta=runs_df['time_extra'] - runs_df['time_standard'],
+        agreed=runs_df['mismatches'] == 0,
+    )
+    grouped = runs.groupby('parser', observed=True)
+    summary = grouped.agg(
+        documents=('run_id', 'size'),
+        fields=('fields', 'sum'),
+        mismatches=('mismatches', 'sum'),
+        full_agreement_rate=('agreed', 'mean'),
+        extra_mean=('time_extra', 'mean'),
+        extra_p50=('time_extra', 'median'),
+        standard_mean=('time_standard', 'mean'),
+        standard_p50=('time_standard', 'median'),
+        delta_mean=('delta', 'mean'),
+        delta_p50=('delta', 'median'),
+    )
+    summary['field_agreement_rate'] = 1 - summary['mismatches'] / summary['fields'].where(summary['fields'] > 0)
+    quantiles = grouped[['time_extra', 'time_standard', 'delta']].quantile(0.9)
+    summary[['extra_p90', 'standard_p90', 'delta_p90']] = quantiles.values
+    return summary.reset_index()
+
+def summarize(fields_df, runs_df, by='field_pattern', min_documents=1):
+    """All corpus summaries as {name: DataFrame}."""
+    kinds, pairs = confusion_summary(fields_df, by=by)
+    return {
+        'parsers': parser_summary(runs_df),
+        'field_mismatch_rates': field_mismatch_rates(fields_df, by=by, min_documents=min_documents),
+        'confusion': kinds,
+        'top_value_pairs': pairs,
+    }
+
+def export_summary(summary):
+    """Zip of one CSV per summary table."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, df in summary.items():
+            archive.writestr(f"{name}.csv", df.to_csv(index=False))
+    return buffer.getvalue()
+
+HISTORY = ComparisonHistory()
+
+def corpus_analytics():
+    """Streamlit page: corpus-level mismatch rates, confusions and latency per parser."""
+    st.title("Corpus Analytics")
+    all_parsers = HISTORY.parsers()
+    if not all_parsers:
+        st.info("No comparisons recorded yet. Run some parsers first.")
+        return
+
+    selected = st.multiselect("Parsers", all_parsers, default=all_parsers)
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        since = st.date_input("Since", value=None)
+    with col2:
+        by = st.radio("Group fields", ['field_pattern', 'field'], format_func=lambda value: "By pattern" if value == 'field_pattern' else "Exact field")
+    with col3:
+        min_documents = st.number_input("Minimum documents per field", min_value=1, value=1)
+    if not selected:
+        return
+
+    with st.spinner("Aggregating comparison history..."):
+        fields_df, runs_df = HISTORY.load(parsers=selected, since=since)
+        summary = summarize(fields_df, runs_df, by=by, min_documents=min_documents)
+
+    st.subheader("Parsers")
+    st.dataframe(summary['parsers'], use_container_width=True)
+    st.subheader("Fields that disagree most")
+    rates = summary['field_mismatch_rates']
+    st.dataframe(rates, use_container_width=True)
+    if not rates.empty:
+        st.bar_chart(rates.head(20).set_index(by)['mismatch_rate'])
+    st.subheader("How fields disagree")
+    st.dataframe(summary['confusion'], use_container_width=True)
+    st.dataframe(summary['top_value_pairs'], use_container_width=True)
+
+    st.download_button("Download Summary (CSV)", data=export_summary(summary), file_name="ocr_corpus_summary.zip", mime="application/zip")
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Summarize the recorded comparison history.")
+    arg_parser.add_argument('--history-dir', default=DEFAULT_HISTORY_DIR)
+    arg_parser.add_argument('--parser', action='append', help="Only this parser (repeatable)")
+    arg_parser.add_argument('--since', help="Only runs on or after this date (YYYY-MM-DD)")
+    arg_parser.add_argument('--exact-fields', action='store_true', help="Group by exact field instead of field pattern")
+    arg_parser.add_argument('--min-documents', type=int, default=1)
+    arg_parser.add_argument('--export', help="Write the summary tables to this zip file")
+    arg_parser.add_argument('--compact', action='store_true', help="Merge part files before summarizing")
+    args = arg_parser.parse_args()
+
+    history = ComparisonHistory(args.history_dir)
+    if args.compact:
+        history.compact()
+    fields_df, runs_df = history.load(parsers=args.parser, since=args.since)
+    summary = summarize(fields_df, runs_df, by='field' if args.exact_fields else 'field_pattern', min_documents=args.min_documents)
+    with pd.option_context('display.width', 200, 'display.max_columns', 20):
+        print(summary['parsers'].to_string(index=False))
+        print()
+        print(summary['field_mismatch_rates'].head(30).to_string(index=False))
+    if args.export:
+        with open(args.export, 'wb') as f:
+            f.write(export_summary(summary))
+        print(f"\nSummary written to {args.export}")
+
+if __name__ == "__main__":
+    main()
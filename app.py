@@ -1,7 +1,9 @@
 import streamlit as st
 from github_utils import download_parsers_from_github, upload_parsers_to_github
-from parser_utils import add_new_parser, list_parsers
+from parser_utils import add_new_parser, list_parsers, sync_parsers
 from ocr_runner import run_parser
+from analytics_utils import corpus_analytics
+from dashboard_utils import jobs_dashboard
 
 # Ensure session state is initialized
 if 'parsers' not in st.session_state:
@@ -54,17 +56,24 @@ def main():
             <li>Add OCR parsers</li>
             <li>List existing parsers</li>
             <li>Run parsers on images</li>
+            <li>Analyze comparison history</li>
+            <li>Monitor batch jobs</li>
         </ul>
     """, unsafe_allow_html=True)
 
     # Radio button menu
-    menu = ["List Parsers", "Run Parser", "Add Parser"]
+    menu = ["List Parsers", "Run Parser", "Add Parser", "Analytics", "Batch Jobs"]
     choice = st.sidebar.radio("Menu", menu)
 
-    # Ensure parsers are loaded once when the app starts
+    # Ensure parsers are loaded once when the app starts; a registry already shared by
+    # another session or replica is used instead of downloading it again
     if 'loaded' not in st.session_state:
-        download_parsers_from_github()  # This will also call load_parsers internally
+        if not sync_parsers():
+            download_parsers_from_github()  # This will also call load_parsers internally
         st.session_state.loaded = True
+    else:
+        # Pick up parsers added or deleted in other sessions and replicas
+        sync_parsers()
 
     # Menu options
     if choice == "Add Parser":
@@ -73,6 +82,10 @@ def main():
         list_parsers()
     elif choice == "Run Parser":
         run_parser(st.session_state['parsers'])
+    elif choice == "Analytics":
+        corpus_analytics()
+    elif choice == "Batch Jobs":
+        jobs_dashboard()
 
     st.sidebar.header("GitHub Actions")
     if st.sidebar.button("Download Parsers"):
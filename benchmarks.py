@@ -0,0 +1,278 @@
+# benchmarks.py
+#
+# Performance regression benchmarks for the comparison pipeline, the parser registry and
+# send_request (against a local stub OCR server), on synthetic payloads of 10 to 50k
+# flattened keys. Each case records its median wall time and its tracemalloc peak; results
+# are checked against the baseline stored in benchmarks_baseline.json, and a case that looks
+# slower is measured again before it is reported.
+#
+#   python benchmarks.py                      # compare with the baseline, exit 1 on regression
+#   python benchmarks.py --update-baseline    # re-record the baseline (after an intended change)
+#   python benchmarks.py --cases flatten_json comparison_df --sizes 10 1000
+#
+# Timings depend on the machine: re-record the baseline when moving to a different one.
+
+import os
+import sys
+import json
+import time
+import logging
+import statistics
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import tracemalloc
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Benchmarks never touch recordings, the shared state or the history of a real deployment
+os.environ["OCR_CASSETTE_MODE"] = "off"
+os.environ.setdefault("OCR_SHARED_STATE", "memory")
+os.environ.setdefault("OCR_HISTORY_DIR", tempfile.mkdtemp(prefix="ocr-bench-history-"))
+
+import requests
+from ocr_utils import flatten_json, generate_comparison_results, generate_comparison_df, generate_mismatch_df, send_request
+from gateway import ParserRegistry
+from search_utils import ParserIndex
+
+# ParserRegistry logs every (re)load at INFO, which would interleave with the results
+logging.getLogger('gateway').setLevel(logging.WARNING)
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks_baseline.json')
+SIZES = [10, 100, 1000, 10000, 50000]
+# A case fails when it is this much slower (or uses this much more peak memory) than the baseline
+TIME_THRESHOLD = 0.5
+MEMORY_THRESHOLD = 0.2
+# Differences below these are noise, whatever the ratio
+MIN_TIME_DELTA = 0.005
+MIN_MEMORY_DELTA = 64 * 1024
+# Each case runs at least MIN_REPEATS times and until it has run MIN_TOTAL_TIME (at most
+# MAX_REPEATS times); the median time counts
+MIN_REPEATS = 5
+MIN_TOTAL_TIME = 1.0
+MAX_REPEATS = 30
+# A case that looks slower than the baseline is measured again up to this many times and
+# only reported if it stays slower (a busy machine slows down a whole stretch of runs)
+RECHECKS = 2
+# Size of the fake document uploaded by the send_request case
+UPLOAD_BYTES = 256 * 1024
+# Flattened keys per line item of the synthetic payloads
+ITEM_FIELDS = 6
+
+def make_payload(keys, seed=0):
+    """A synthetic OCR response with about `keys` flattened keys: header fields plus line items."""
+    rng = random.Random(seed)
+    payload = {
+        'header': {'invoice_number': f"INV-{seed:05d}", 'vendor': "Kores India Ltd", 'date': "2024-03-31"},
+    }
+    payload['items'] = [
+        {
+            'Sr_No': i + 1,
+            'description': f"Item {i} {rng.choice(['stapler', 'toner cartridge', 'A4 paper ream', 'marker set'])}",
+            'qty': rng.randint(1, 50),
+            'amount': round(rng.uniform(1, 5000), 2),
+            'meta': {'page': i // 40 + 1, 'confidence': round(rng.random(), 3)},
+        }
+        for i in range(max((keys - 3) // ITEM_FIELDS, 0))
+    ]
+    return payload
+
+def make_variant(payload, seed=1, change_rate=0.1):
+    """A second response for the same document with about `change_rate` of the values differing."""
+    rng = random.Random(seed)
+    variant = json.loads(json.dumps(payload))
+    for item in variant['items']:
+        if rng.random() < change_rate:
+            item['description'] = item['description'].upper() + "."
+        if rng.random() < change_rate:
+            item['amount'] = round(item['amount'] + 1, 2)
+    return variant
+
+def make_registry(count):
+    return {
+        f"Parser {i:05d} {random.Random(i).choice(['Cheque', 'Invoice', 'Receipt'])}": {
+            'api_key': f"{i:08x}deadbeef", 'parser_app_id': f"App{i % 97:03d}", 'extra_accuracy': i % 2 == 0,
+        }
+        for i in range(count)
+    }
+
+class _StubOCRHandler(BaseHTTPRequestHandler):
+    """Answers every upload with the prepared JSON body of the size in the URL (/ocr/<keys>)."""
+
+    bodies = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        while length > 0:
+            length -= len(self.rfile.read(min(length, 65536)))
+        body = self.bodies[int(self.path.rsplit('/', 1)[-1])]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def start_stub_server(sizes):
+    # Response bodies are encoded up front so the server adds little to the measured peak
+    _StubOCRHandler.bodies = {size: json.dumps(make_payload(size)).encode('utf-8') for size in sizes}
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _StubOCRHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def build_cases(sizes, workdir):
+    """{case name: {size: zero-argument callable}}; inputs are prepared outside the measurement."""
+    cases = {name: {} for name in ('flatten_json', 'comparison_results', 'comparison_df', 'mismatch_df',
+                                   'registry_load', 'parser_index', 'send_request')}
+    upload = os.urandom(UPLOAD_BYTES)
+    for size in sizes:
+        json1 = make_payload(size)
+        json2 = make_variant(json1)
+        results = generate_comparison_results(json1, json2)
+        cases['flatten_json'][size] = lambda json1=json1: flatten_json(json1)
+        cases['comparison_results'][size] = lambda json1=json1, json2=json2: generate_comparison_results(json1, json2)
+        cases['comparison_df'][size] = lambda json1=json1, json2=json2, results=results: generate_comparison_df(json1, json2, results)
+        cases['mismatch_df'][size] = lambda json1=json1, json2=json2, results=results: generate_mismatch_df(json1, json2, results)
+
+        # A registry of `size` parsers, reloaded from disk as the gateway does when the file changes
+        registry_path = os.path.join(workdir, f"parsers_{size}.json")
+        registry = make_registry(size)
+        with open(registry_path, 'w') as f:
+            json.dump(registry, f)
+        cases['registry_load'][size] = lambda path=registry_path: ParserRegistry(path).get_all()
+        cases['parser_index'][size] = lambda registry=registry: ParserIndex(registry)
+
+    server = start_stub_server(sizes)
+    session = requests.Session()
+    endpoint = f"http://127.0.0.1:{server.server_address[1]}/ocr"
+    for size in sizes:
+        def call(size=size):
+            response, _ = send_request([("document.png", upload)], {'x-api-key': 'bench'}, {'parserApp': 'bench'},
+                                       False, f"{endpoint}/{size}", stream=True, session=session)
+            if response is None or response.status_code != 200:
+                raise RuntimeError("Stub OCR server request failed")
+            return response
+        cases['send_request'][size] = call
+    return cases, server
+
+def measure(fn):
+    """{'seconds': median wall time, 'repeats', 'peak_bytes': tracemalloc peak of one more run}."""
+    fn()  # warm-up (imports, caches, connection pool)
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < MIN_REPEATS or (len(timings) < MAX_REPEATS and time.perf_counter() - started < MIN_TOTAL_TIME):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': statistics.median(timings), 'repeats': len(timings), 'peak_bytes': peak}
+
+def run_benchmarks(case_names=None, sizes=SIZES, log=print, baseline=None, time_threshold=TIME_THRESHOLD):
+    """
+    Run the selected cases; returns {case: {str(size): measurement}}. With a `baseline`, a
+    case slower than it is measured again (up to RECHECKS times) and its fastest run is kept.
+    """
+    with tempfile.TemporaryDirectory(prefix="ocr-bench-") as workdir:
+        cases, server = build_cases(sizes, workdir)
+        try:
+            results = {}
+            for name, by_size in cases.items():
+                if case_names and name not in case_names:
+                    continue
+                results[name] = {}
+                for size, fn in by_size.items():
+                    measurement = measure(fn)
+                    previous = (baseline or {}).get('results', {}).get(name, {}).get(str(size))
+                    for _ in range(RECHECKS):
+                        if previous is None or not _is_slower(measurement, previous, time_threshold):
+                            break
+                        log(f"{name:<20} {size:>6}  {measurement['seconds'] * 1000:10.2f} ms  (slower than the baseline, measuring again)")
+                        measurement = min(measurement, measure(fn), key=lambda m: m['seconds'])
+                    results[name][str(size)] = measurement
+                    log(f"{name:<20} {size:>6}  {measurement['seconds'] * 1000:10.2f} ms  "
+                        f"{measurement['peak_bytes'] / 2**20:8.2f} MB peak  ({measurement['repeats']} runs)")
+            return results
+        finally:
+            server.shutdown()
+            server.server_close()
+
+def environment():
+    return {'python': platform.python_version(), 'machine': platform.machine(), 'processor': platform.processor(),
+            'system': platform.system()}
+
+def _is_slower(current, previous, time_threshold):
+    slower = current['seconds'] - previous['seconds']
+    return slower > MIN_TIME_DELTA and current['seconds'] > previous['seconds'] * (1 + time_threshold)
+
+def compare_with_baseline(results, baseline, time_threshold=TIME_THRESHOLD, memory_threshold=MEMORY_THRESHOLD):
+    """Regressions of `results` against a baseline's results, as readable messages."""
+    regressions = []
+    for name, by_size in results.items():
+        for size, current in by_size.items():
+            previous = baseline.get('results', {}).get(name, {}).get(size)
+            if previous is None:
+                continue
+            if _is_slower(current, previous, time_threshold):
+                slower = current['seconds'] - previous['seconds']
+                regressions.append(f"{name} [{size}]: {current['seconds'] * 1000:.2f} ms vs baseline "
+                                   f"{previous['seconds'] * 1000:.2f} ms (+{slower / previous['seconds']:.0%})")
+            grown = current['peak_bytes'] - previous['peak_bytes']
+            if grown > MIN_MEMORY_DELTA and current['peak_bytes'] > previous['peak_bytes'] * (1 + memory_threshold):
+                regressions.append(f"{name} [{size}]: peak {current['peak_bytes'] / 2**20:.2f} MB vs baseline "
+                                   f"{previous['peak_bytes'] / 2**20:.2f} MB (+{grown / max(previous['peak_bytes'], 1):.0%})")
+    return regressions
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="Performance regression benchmarks with stored baselines.")
+    arg_parser.add_argument('--cases', nargs='+', help="Only run these cases")
+    arg_parser.add_argument('--sizes', nargs='+', type=int, default=SIZES, help="Payload sizes in flattened keys")
+    arg_parser.add_argument('--baseline', default=BASELINE_FILE)
+    arg_parser.add_argument('--update-baseline', action='store_true', help="Record the results as the new baseline")
+    arg_parser.add_argument('--time-threshold', type=float, default=TIME_THRESHOLD, help="Allowed slowdown (0.5 = 50%%)")
+    arg_parser.add_argument('--memory-threshold', type=float, default=MEMORY_THRESHOLD, help="Allowed peak memory growth")
+    args = arg_parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    if args.update_baseline:
+        results = run_benchmarks(args.cases, args.sizes)
+        # Cases and sizes that were not run keep their previous baseline
+        merged = baseline.get('results', {})
+        for name, by_size in results.items():
+            merged.setdefault(name, {}).update(by_size)
+        with open(args.baseline, 'w') as f:
+            json.dump({'environment': environment(), 'recorded': time.strftime('%Y-%m-%d'), 'results': merged}, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not baseline:
+        print(f"No baseline at {args.baseline}; run with --update-baseline to record one.")
+        return 1
+    if baseline.get('environment') != environment():
+        print(f"Warning: the baseline was recorded on a different environment ({baseline.get('environment')}).")
+
+    results = run_benchmarks(args.cases, args.sizes, baseline=baseline, time_threshold=args.time_threshold)
+    regressions = compare_with_baseline(results, baseline, args.time_threshold, args.memory_threshold)
+    if regressions:
+        print(f"{len(regressions)} regression(s) against {args.baseline}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print("No regressions against the baseline.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+# cancel_utils.py
+
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+DEADLINE_EXCEEDED = "deadline exceeded"
+# Default overall deadline for one OCR run (all of its requests), in seconds
+DEFAULT_RUN_DEADLINE = int(os.environ.get("OCR_RUN_DEADLINE", "1200"))
+# How often a waiting Streamlit script checks back in (and so notices a rerun)
+POLL_INTERVAL = 0.25
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=32, thread_name_prefix="ocr-request")
+
+class RequestCancelled(Exception):
+    """Raised while sending or reading a request whose cancel token has been set."""
+
+class CancelToken:
+    """
+    Cancellation signal with an optional deadline, shared by everything working on one run.
+    Child tokens are cancelled with their parent but can also be cancelled on their own
+    (e.g. the losing copy of a hedged request). `is_set()` makes it usable wherever a
+    threading.Event is checked.
+    """
+
+    def __init__(self, deadline=None, parent=None):
+        self.deadline = deadline
+        self.parent = parent
+        self._event = threading.Event()
+        self._reason = None
+
+    @classmethod
+    def with_timeout(cls, seconds, parent=None):
+        return cls(deadline=time.monotonic() + seconds if seconds else None, parent=parent)
+
+    def child(self):
+        return CancelToken(parent=self)
+
+    def cancel(self, reason="cancelled"):
+        if not self._event.is_set():
+            self._reason = reason
+            self._event.set()
+
+    def is_set(self):
+        if self._event.is_set():
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel(DEADLINE_EXCEEDED)
+            return True
+        return self.parent is not None and self.parent.is_set()
+
+    @property
+    def reason(self):
+        if self._event.is_set():
+            return self._reason
+        return self.parent.reason if self.parent is not None else None
+
+    def remaining(self):
+        """Seconds until the nearest deadline of this token or its parents (None if there is none)."""
+        remaining = None if self.deadline is None else max(self.deadline - time.monotonic(), 0.0)
+        if self.parent is not None:
+            parent_remaining = self.parent.remaining()
+            if parent_remaining is not None:
+                remaining = parent_remaining if remaining is None else min(remaining, parent_remaining)
+        return remaining
+
+    def timeout(self, default):
+        """A request timeout bounded by the remaining time."""
+        remaining = self.remaining()
+        return default if remaining is None else min(default, max(remaining, 0.001))
+
+def run_with_ctx(ctx, fn):
+    """Call fn() on a worker thread attached to a Streamlit script context (from get_script_run_ctx)."""
+    # Lets st.error calls inside fn reach the caller's Streamlit session
+    if ctx is not None:
+        add_script_run_ctx(threading.current_thread(), ctx)
+    return fn()
+
+def submit_with_ctx(fn, *args, **kwargs):
+    """Submit fn(*args, **kwargs) to the request pool, attached to the caller's Streamlit session."""
+    return _EXECUTOR.submit(run_with_ctx, get_script_run_ctx(suppress_warning=True), lambda: fn(*args, **kwargs))
+
+def run_cancellable(fn, token, on_tick=None, interval=POLL_INTERVAL):
+    """
+    Run fn() on a worker thread while the calling (Streamlit script) thread polls it.
+    `on_tick(elapsed)` is called on every poll; Streamlit raises its rerun/stop exception
+    from such UI updates when the user changes an input, and the token is then cancelled
+    so the abandoned request stops instead of running to completion.
+    """
+    start = time.monotonic()
+    future = submit_with_ctx(fn)
+    try:
+        while True:
+            try:
+                return future.result(timeout=interval)
+            except FutureTimeoutError:
+                if on_tick is not None:
+                    on_tick(time.monotonic() - start)
+    except BaseException:
+        token.cancel("superseded")
+        raise
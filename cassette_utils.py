@@ -0,0 +1,166 @@
+# cassette_utils.py
+
+import os
+import json
+import gzip
+import time
+import base64
+import hashlib
+import tempfile
+import threading
+import logging
+import requests
+from requests.structures import CaseInsensitiveDict
+from stream_utils import source_digest
+
+logger = logging.getLogger(__name__)
+
+MODE_OFF = "off"
+MODE_RECORD = "record"
+MODE_REPLAY = "replay"
+
+LATENCY_INSTANT = "instant"
+LATENCY_RECORDED = "recorded"
+
+DEFAULT_CASSETTE_PATH = os.path.join(tempfile.gettempdir(), 'ocr_cassette.jsonl.gz')
+
+# Form fields that describe the caller rather than the document, left out of fingerprints
+VOLATILE_FORM_FIELDS = frozenset(["user_ip", "location", "user_agent"])
+
+def request_fingerprint(endpoint, form_data, image_paths):
+    """
+    Identify an OCR request by endpoint, form fields and file contents.
+    Headers (the API key) and caller-specific form fields are not part of the fingerprint.
+    """
+    files = []
+    for image_path in image_paths:
+        if isinstance(image_path, tuple):
+            file_name, source = image_path
+        else:
+            file_name, source = os.path.basename(image_path), image_path
+        files.append([file_name, source_digest(source)])
+    fields = {key: str(value) for key, value in form_data.items() if key not in VOLATILE_FORM_FIELDS}
+    payload = json.dumps({'endpoint': endpoint, 'form': fields, 'files': files}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def credential_digest(headers):
+    """
+    Short digest of a request's API key. Result caches add it to the request fingerprint,
+    so responses are never shared between credentials (parsers may share an app id).
+    """
+    api_key = CaseInsensitiveDict(headers or {}).get('x-api-key', '')
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+class Cassette:
+    """
+    A gzip-compressed JSON-lines file of recorded OCR exchanges.
+
+    Each line holds the request fingerprint and the full response: status, headers,
+    body and observed latency. Recording appends a gzip member per exchange, so a
+    cassette can be extended across runs. Replay serves recordings by fingerprint,
+    cycling through them when the same request was recorded more than once.
+    """
+
+    def __init__(self, path, mode, latency=LATENCY_INSTANT):
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self._entries = None
+        self._cursors = {}
+        self._lock = threading.Lock()
+
+    def _load(self):
+        entries = {}
+        if os.path.exists(self.path):
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        entries.setdefault(entry['fingerprint'], []).append(entry)
+        logger.info("Loaded %d recorded OCR responses from %s", sum(len(v) for v in entries.values()), self.path)
+        return entries
+
+    def record(self, fingerprint, response, time_taken):
+        """Append one exchange to the cassette."""
+        json_data = getattr(response, 'json_data', None)
+        if json_data is not None:
+            body = json.dumps(json_data).encode('utf-8')
+        elif isinstance(response._content, bytes):
+            body = response._content
+        else:
+            body = b''  # Streamed body that was not read (non-200 response)
+        try:
+            encoded_body, encoding = body.decode('utf-8'), 'utf-8'
+        except UnicodeDecodeError:
+            encoded_body, encoding = base64.b64encode(body).decode('ascii'), 'base64'
+        entry = {
+            'fingerprint': fingerprint,
+            'status': response.status_code,
+            'headers': dict(response.headers),
+            'body': encoded_body,
+            'body_encoding': encoding,
+            'latency': time_taken,
+            'recorded_at': time.time(),
+        }
+        with self._lock:
+            with gzip.open(self.path, 'at', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + "\n")
+            if self._entries is not None:
+                self._entries.setdefault(fingerprint, []).append(entry)
+
+    def lookup(self, fingerprint):
+        """Return the next recorded entry for a fingerprint, or None."""
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            recordings = self._entries.get(fingerprint)
+            if not recordings:
+                return None
+            cursor = self._cursors.get(fingerprint, 0)
+            self._cursors[fingerprint] = cursor + 1
+            return recordings[cursor % len(recordings)]
+
+    def replay(self, fingerprint, url=None):
+        """
+        Serve a recorded response as (requests.Response, time_taken), or (None, 0) on a miss.
+        The recorded latency is always reported; with latency='recorded' it is also waited out.
+        """
+        entry = self.lookup(fingerprint)
+        if entry is None:
+            logger.error("No recorded OCR response for request %s in %s", fingerprint[:12], self.path)
+            return None, 0
+        if self.latency == LATENCY_RECORDED:
+            time.sleep(entry['latency'])
+        body = entry['body'].encode('utf-8') if entry['body_encoding'] == 'utf-8' else base64.b64decode(entry['body'])
+        response = requests.Response()
+        response.status_code = entry['status']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        # The body is stored decoded, so drop transport headers that no longer apply
+        response.headers.pop('Content-Encoding', None)
+        response.headers.pop('Transfer-Encoding', None)
+        response._content = body
+        response.encoding = 'utf-8'
+        response.url = url
+        return response, entry['latency']
+
+_CASSETTES = {}
+_CASSETTES_LOCK = threading.Lock()
+
+def active_cassette():
+    """
+    Return the cassette selected by the environment, or None when recording/replay is off.
+
+    OCR_CASSETTE_MODE      off (default), record or replay
+    OCR_CASSETTE_PATH      cassette file (default: ocr_cassette.jsonl.gz in the temp dir)
+    OCR_REPLAY_LATENCY     instant (default) or recorded
+    """
+    mode = os.environ.get("OCR_CASSETTE_MODE", MODE_OFF).lower()
+    if mode not in (MODE_RECORD, MODE_REPLAY):
+        return None
+    path = os.environ.get("OCR_CASSETTE_PATH", DEFAULT_CASSETTE_PATH)
+    latency = os.environ.get("OCR_REPLAY_LATENCY", LATENCY_INSTANT).lower()
+    key = (path, mode, latency)
+    with _CASSETTES_LOCK:
+        if key not in _CASSETTES:
+            _CASSETTES[key] = Cassette(path, mode, latency)
+        return _CASSETTES[key]
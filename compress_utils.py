@@ -0,0 +1,54 @@
+# compress_utils.py
+#
+# gzip for what the apps keep on disk (the local parsers.json, shared-state values) and
+# the encodings requested from HTTP APIs. Readers detect the gzip magic bytes, so files
+# and values written before compression was enabled keep loading unchanged.
+
+import os
+import gzip
+import json
+
+GZIP_MAGIC = b'\x1f\x8b'
+COMPRESSION_LEVEL = 6
+# Values smaller than this are stored as they are; compressing them does not pay off
+MIN_COMPRESS_BYTES = 512
+# Response encodings requested from the OCR endpoint and GitHub (decoded by requests)
+ACCEPT_ENCODING = "gzip, deflate"
+
+def is_compressed(data):
+    return bytes(data[:2]) == GZIP_MAGIC
+
+def compress(data, level=COMPRESSION_LEVEL):
+    # mtime=0 keeps the output identical for identical input
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+def decompress(data):
+    """The original bytes of gzip data; anything else is returned unchanged."""
+    return gzip.decompress(data) if is_compressed(data) else bytes(data)
+
+def write_file(path, data):
+    """Write bytes gzip-compressed, replacing the file atomically."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(compress(data))
+    os.replace(tmp_path, path)
+
+def read_file(path):
+    """Contents of a file written by write_file, or of a plain (uncompressed) file."""
+    with open(path, 'rb') as f:
+        return decompress(f.read())
+
+def dump_json(obj, path, **kwargs):
+    write_file(path, json.dumps(obj, **kwargs).encode('utf-8'))
+
+def load_json(path):
+    return json.loads(read_file(path))
+
+def pack_text(text):
+    """A JSON/text value for storage: gzip bytes when it is large enough to gain, else the text."""
+    data = text.encode('utf-8')
+    return compress(data) if len(data) >= MIN_COMPRESS_BYTES else text
+
+def unpack_text(value):
+    """Inverse of pack_text."""
+    return decompress(value).decode('utf-8') if isinstance(value, (bytes, bytearray, memoryview)) else value
@@ -0,0 +1,119 @@
+# dashboard_utils.py
+#
+# Live view of batch OCR jobs from the shared job store (state_utils.JOBS). Each refresh
+# fetches only the jobs written since the previous one and merges them into the session's
+# copy; the metrics come from the aggregates the job store keeps up to date as documents
+# finish, so a refresh costs the same however many documents a job has processed.
+
+import time
+import pandas as pd
+import streamlit as st
+from state_utils import JOBS, latency_percentile
+
+# Seconds between refreshes of the dashboard
+REFRESH_SECONDS = 2
+# Jobs changed this long before the previous refresh are fetched again, covering clock
+# differences between replicas
+SYNC_OVERLAP_SECONDS = 5
+# A running job without updates for this long is shown as stalled (e.g. its replica restarted)
+STALLED_AFTER_SECONDS = 10 * 60
+# Finished jobs listed below the active ones
+RECENT_JOBS = 20
+
+def job_metrics(job, now=None):
+    """Throughput, in-flight count, latency percentiles and ETA of a job record."""
+    now = now if now is not None else time.time()
+    finished = job['done'] + job['failed']
+    running = job['status'] == 'running'
+    elapsed = max((now if running else job['updated']) - job['started'], 1e-6)
+    rate = finished / elapsed
+    remaining = max(job['total'] - finished, 0)
+    measured = sum(job['latency_histogram'])
+    return {
+        'finished': finished,
+        'remaining': remaining,
+        'elapsed': elapsed,
+        'documents_per_second': rate,
+        'in_flight': job['in_flight'],
+        'errors': job['failed'],
+        'retries': job['retries'],
+        'p50': latency_percentile(job['latency_histogram'], 50),
+        'p95': latency_percentile(job['latency_histogram'], 95),
+        'p99': latency_percentile(job['latency_histogram'], 99),
+        'mean_latency': job['latency_total'] / measured if measured else None,
+        'eta': remaining / rate if running and rate > 0 else None,
+        'stalled': running and now - job['updated'] > STALLED_AFTER_SECONDS,
+    }
+
+def sync_jobs(session_state):
+    """Merge the jobs written since the last refresh into the session's copy and return it."""
+    jobs = session_state.setdefault('dashboard_jobs', {})
+    since = session_state.get('dashboard_jobs_since')
+    polled = time.time()
+    changed = JOBS.changed_since(since - SYNC_OVERLAP_SECONDS if since is not None else None)
+    # Jobs recorded before the job store kept aggregates have nothing to show
+    jobs.update({job_id: job for job_id, job in changed.items() if 'latency_histogram' in job})
+    session_state['dashboard_jobs_since'] = polled
+    return jobs
+
+def _seconds(value):
+    if value is None:
+        return "–"
+    if value == float('inf'):
+        return "> 10 min"
+    if value >= 60:
+        return f"{value // 60:.0f}m {value % 60:.0f}s"
+    return f"{value:.1f}s"
+
+def _render_active_job(job, metrics):
+    with st.container(border=True):
+        st.markdown(f"**{job['parser']}** · job `{job['job_id']}` · started {time.strftime('%H:%M:%S', time.localtime(job['started']))}")
+        if metrics['stalled']:
+            st.warning(f"No progress for {_seconds(time.time() - job['updated'])}; the replica running it may have stopped.")
+        st.progress(metrics['finished'] / job['total'] if job['total'] else 0.0,
+                    text=f"{metrics['finished']} of {job['total']} documents")
+        columns = st.columns(6)
+        columns[0].metric("Documents / s", f"{metrics['documents_per_second']:.2f}")
+        columns[1].metric("In flight", metrics['in_flight'])
+        columns[2].metric("Latency p50 / p95", f"{_seconds(metrics['p50'])} / {_seconds(metrics['p95'])}",
+                          help=f"p99 {_seconds(metrics['p99'])}; percentiles are histogram bucket bounds.")
+        columns[3].metric("Errors", metrics['errors'])
+        columns[4].metric("Retries", metrics['retries'], help="Requests hedged with a second copy.")
+        columns[5].metric("ETA", _seconds(metrics['eta']))
+        if job['stage_seconds']:
+            # Where the documents' time went so far
+            stages = pd.Series(job['stage_seconds'], name="seconds").sort_values(ascending=False)
+            st.bar_chart(stages, horizontal=True, height=160)
+
+@st.fragment(run_every=REFRESH_SECONDS)
+def _render_jobs():
+    jobs = sync_jobs(st.session_state)
+    now = time.time()
+    ordered = sorted(jobs.values(), key=lambda job: job['started'], reverse=True)
+    active = [job for job in ordered if job['status'] == 'running']
+    if active:
+        for job in active:
+            _render_active_job(job, job_metrics(job, now))
+    else:
+        st.info("No batch jobs are running. Upload several documents in Run Parser to start one.")
+
+    recent = [job for job in ordered if job['status'] != 'running'][:RECENT_JOBS]
+    if recent:
+        st.subheader("Recent jobs")
+        rows = []
+        for job in recent:
+            metrics = job_metrics(job, now)
+            rows.append({
+                'Job': job['job_id'], 'Parser': job['parser'], 'Status': job['status'],
+                'Documents': f"{metrics['finished']} / {job['total']}", 'Errors': metrics['errors'],
+                'Retries': metrics['retries'], 'Documents / s': round(metrics['documents_per_second'], 2),
+                'p50 (s)': metrics['p50'], 'p95 (s)': metrics['p95'], 'p99 (s)': metrics['p99'],
+                'Duration': _seconds(metrics['elapsed']),
+            })
+        st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+    st.caption(f"Updated {time.strftime('%H:%M:%S', time.localtime(now))}; refreshes every {REFRESH_SECONDS}s.")
+
+def jobs_dashboard():
+    """Streamlit page: progress, throughput, latency and ETA of batch OCR jobs on every replica."""
+    st.title("Batch Jobs")
+    _render_jobs()
@@ -0,0 +1,326 @@
+# gateway.py
+#
+# Standalone (non-Streamlit) HTTP gateway in front of the OCR endpoint.
+# It resolves parsers from parsers.json, forwards uploads over a shared connection
+# pool with a bounded number of concurrent OCR calls, caches results, and can return
+# the extra-accuracy vs standard comparison.
+#
+#   python gateway.py --endpoint https://.../upload-file-smart-ocr --port 8080
+#
+#   curl -F parser="Kores Cheque Front" -F compare=true -F file=@cheque.jpg http://localhost:8080/ocr
+#
+# An optional `timeout` field (seconds) sets a deadline for the whole request; OCR calls
+# still running when it passes are cancelled and the gateway answers 504.
+
+import os
+import json
+import time
+import argparse
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from email.parser import BytesParser
+from email.policy import default as default_policy
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from cachetools import TTLCache
+from compress_utils import MIN_COMPRESS_BYTES, compress, load_json
+from ocr_utils import send_request, response_json, generate_comparison_results, generate_comparison_df
+from schema_utils import get_parser_comparator
+from cassette_utils import active_cassette, credential_digest, request_fingerprint
+from analytics_utils import HISTORY
+from hedge_utils import HEDGE_POLICY
+from cancel_utils import CancelToken, DEADLINE_EXCEEDED
+from similarity_utils import DEFAULT_SIMILARITY_THRESHOLD
+from log_utils import configure_logging, log_event
+from state_utils import OCR_CACHE
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARSERS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parsers.json')
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+CACHE_TTL_SECONDS = 24 * 60 * 60
+CACHE_MAX_ENTRIES = 1024
+
+# Same caller fields run_parser sends
+DEFAULT_FORM_FIELDS = {
+    'user_ip': '127.0.0.1',
+    'location': 'delhi',
+    'user_agent': 'Dummy-device-testing11',
+}
+
+class GatewayError(Exception):
+    """An error reported to the client with an HTTP status code."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class ParserRegistry:
+    """parsers.json, reloaded whenever the file changes on disk."""
+
+    def __init__(self, path):
+        self.path = path
+        self._parsers = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def get_all(self):
+        with self._lock:
+            mtime = os.path.getmtime(self.path)
+            if mtime != self._mtime:
+                # Plain or gzip-compressed (as the apps now store it)
+                self._parsers = load_json(self.path)
+                self._mtime = mtime
+                logger.info("Loaded %d parsers from %s", len(self._parsers), self.path)
+            return self._parsers
+
+    def get(self, name):
+        parser_info = self.get_all().get(name)
+        if parser_info is None:
+            raise GatewayError(404, f"Unknown parser '{name}'.")
+        return parser_info
+
+class OCRGateway:
+    """
+    Forwards OCR requests for registered parsers.
+    All calls share one pooled `requests.Session`; at most `workers` OCR calls are in
+    flight at once and at most `max_pending` requests may wait for a worker before the
+    gateway answers 503. Successful results are cached by request fingerprint and API key
+    digest, locally and in `shared_cache` (shared with the apps and other gateway replicas, see state_utils).
+    """
+
+    def __init__(self, endpoint, registry, workers=8, max_pending=64, cache_ttl=CACHE_TTL_SECONDS, hedge=None,
+                 shared_cache=OCR_CACHE):
+        self.endpoint = endpoint
+        self.shared_cache = shared_cache
+        self.hedge = hedge
+        self.registry = registry
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ocr-worker")
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=workers, max_retries=Retry(total=2, connect=2, read=0, backoff_factor=0.5, allowed_methods=None))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.cache = TTLCache(maxsize=CACHE_MAX_ENTRIES, ttl=cache_ttl)
+        self.cache_lock = threading.Lock()
+
+    def _call(self, parser_info, files, extra_accuracy, cancel=None):
+        """One OCR call (cached); returns {'status_code', 'json', 'time_taken', 'cached'}."""
+        headers = {'x-api-key': parser_info['api_key']}
+        form_data = dict(DEFAULT_FORM_FIELDS, parserApp=parser_info['parser_app_id'])
+        if extra_accuracy:
+            form_data['extra_accuracy'] = 'true'
+        # Same key as the apps use (ocr_runner.send_variant); results never cross API keys
+        cache_key = f"{request_fingerprint(self.endpoint, form_data, files)}:{credential_digest(headers)}"
+        if active_cassette() is not None:
+            # Recording/replaying: every call reaches the cassette and nothing is cached
+            return self._send(files, headers, form_data, None, cancel)
+        with self.cache_lock:
+            cached = self.cache.get(cache_key)
+        if cached is not None:
+            return dict(cached, cached=True)
+        if self.shared_cache is None:
+            return self._send(files, headers, form_data, cache_key, cancel)
+
+        with self.shared_cache.request(cache_key, cancel=cancel) as shared:
+            if shared.entry is not None:
+                result = {'status_code': 200, 'json': shared.entry['json'], 'time_taken': shared.entry['time_taken'], 'cached': False}
+                with self.cache_lock:
+                    self.cache[cache_key] = result
+                return dict(result, cached=True)
+            result = self._send(files, headers, form_data, cache_key, cancel)
+            if result['json'] is not None:
+                shared.put(result['json'], result['time_taken'])
+            return result
+
+    def _send(self, files, headers, form_data, cache_key, cancel):
+        errors = []
+        response, time_taken = send_request(files, headers, form_data, False, self.endpoint, stream=True,
+                                            session=self.session, hedge=self.hedge, cancel=cancel, errors=errors)
+        if response is None:
+            if cancel is not None and cancel.is_set():
+                raise GatewayError(504, f"OCR request stopped: {cancel.reason}.")
+            raise GatewayError(502, errors[-1] if errors else "OCR request failed.")
+        result = {'status_code': response.status_code, 'json': None, 'time_taken': time_taken, 'cached': False}
+        if response.status_code == 200:
+            try:
+                result['json'] = response_json(response)
+            except json.JSONDecodeError:
+                raise GatewayError(502, "OCR endpoint returned invalid JSON.")
+            if cache_key is not None:
+                with self.cache_lock:
+                    self.cache[cache_key] = result
+        return result
+
+    def _wait(self, future, cancel):
+        """Result of a submitted call, cancelling it if the request's deadline passes first."""
+        try:
+            return future.result(timeout=cancel.remaining() if cancel is not None else None)
+        except FutureTimeoutError:
+            cancel.cancel(DEADLINE_EXCEEDED)
+            raise GatewayError(504, "OCR request stopped: deadline exceeded.")
+
+    def process(self, parser_name, files, compare=False, extra_accuracy=None, timeout=None):
+        """
+        Run OCR for an upload. With `compare`, both variants run concurrently and the
+        comparison is returned as well; otherwise the parser's extra_accuracy setting
+        (or the explicit `extra_accuracy`) decides which variant runs. With `timeout`
+        (seconds), calls still running after it are cancelled.
+        """
+        cancel = CancelToken.with_timeout(timeout) if timeout else None
+        parser_info = self.registry.get(parser_name)
+        if not files:
+            raise GatewayError(400, "At least one file is required.")
+        if not self.pending.acquire(blocking=False):
+            raise GatewayError(503, "Gateway is at capacity, please retry.")
+        try:
+            if compare:
+                future_extra = self.executor.submit(self._call, parser_info, files, True, cancel)
+                future_no_extra = self.executor.submit(self._call, parser_info, files, False, cancel)
+                try:
+                    extra, no_extra = self._wait(future_extra, cancel), self._wait(future_no_extra, cancel)
+                except GatewayError:
+                    if cancel is not None:
+                        cancel.cancel("request failed")
+                    raise
+                payload = {'parser': parser_name, 'result_extra_accuracy': extra, 'result_standard': no_extra}
+                if extra['json'] is not None and no_extra['json'] is not None:
+                    comparator = get_parser_comparator(parser_info)
+                    comparison_results = generate_comparison_results(extra['json'], no_extra['json'], comparator)
+                    comparison_df = generate_comparison_df(extra['json'], no_extra['json'], comparison_results,
+                                                           similarity_threshold=parser_info.get('similarity_threshold', DEFAULT_SIMILARITY_THRESHOLD),
+                                                           comparator=comparator)
+                    if not (extra['cached'] and no_extra['cached']):
+                        HISTORY.record(parser_name, comparison_df, extra['time_taken'], no_extra['time_taken'], source="gateway")
+                    # Near matches ("≈") are still reported as mismatches, with their similarity score
+                    mismatch_df = comparison_df[comparison_df['Comparison'] != "✔"].rename(columns={'Attribute': 'Field'})
+                    payload['comparison'] = {
+                        'results': comparison_results,
+                        'mismatches': json.loads(mismatch_df.to_json(orient='records', force_ascii=False)),
+                    }
+                return payload
+            if extra_accuracy is None:
+                extra_accuracy = bool(parser_info.get('extra_accuracy'))
+            result = self._wait(self.executor.submit(self._call, parser_info, files, extra_accuracy, cancel), cancel)
+            return {'parser': parser_name, 'extra_accuracy': extra_accuracy, 'result': result}
+        finally:
+            self.pending.release()
+
+def _parse_multipart(content_type, body):
+    """Split a multipart/form-data body into ({field: value}, [(filename, bytes)])."""
+    message = BytesParser(policy=default_policy).parsebytes(
+        b"Content-Type: " + content_type.encode('latin-1') + b"\r\n\r\n" + body
+    )
+    if not message.is_multipart():
+        raise GatewayError(400, "Expected a multipart/form-data request.")
+    fields, files = {}, []
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        payload = part.get_payload(decode=True) or b''
+        if part.get_filename():
+            files.append((part.get_filename(), payload))
+        elif name:
+            fields[name] = payload.decode('utf-8').strip()
+    return fields, files
+
+def _is_true(value):
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
+def make_handler(gateway):
+    class GatewayHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+            # Comparison results are large and repetitive; gzip them for clients that accept it
+            gzipped = len(body) >= MIN_COMPRESS_BYTES and 'gzip' in self.headers.get('Accept-Encoding', '')
+            if gzipped:
+                body = compress(body)
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            if gzipped:
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Vary', 'Accept-Encoding')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.info("%s - " + format, self.address_string(), *args)
+
+        def do_GET(self):
+            if self.path == '/health':
+                payload = {'status': 'ok'}
+                if gateway.hedge is not None:
+                    payload['hedging'] = gateway.hedge.stats()
+                self._send_json(200, payload)
+            elif self.path == '/parsers':
+                self._send_json(200, {'parsers': sorted(gateway.registry.get_all().keys())})
+            else:
+                self._send_json(404, {'error': 'Not found.'})
+
+        def do_POST(self):
+            start_time = time.time()
+            try:
+                if self.path != '/ocr':
+                    raise GatewayError(404, "Not found.")
+                length = int(self.headers.get('Content-Length') or 0)
+                if length <= 0:
+                    raise GatewayError(411, "Content-Length is required.")
+                if length > MAX_UPLOAD_BYTES + 64 * 1024:
+                    raise GatewayError(413, "Upload exceeds the 20 MB limit.")
+                fields, files = _parse_multipart(self.headers.get('Content-Type', ''), self.rfile.read(length))
+                if 'parser' not in fields:
+                    raise GatewayError(400, "The 'parser' field is required.")
+                extra_accuracy = _is_true(fields['extra_accuracy']) if 'extra_accuracy' in fields else None
+                try:
+                    timeout = float(fields['timeout']) if fields.get('timeout') else None
+                except ValueError:
+                    raise GatewayError(400, "The 'timeout' field must be a number of seconds.")
+                payload = gateway.process(fields['parser'], files, compare=_is_true(fields.get('compare', '')),
+                                          extra_accuracy=extra_accuracy, timeout=timeout)
+                payload['gateway_time'] = time.time() - start_time
+                log_event(logger, "gateway_request", parser=fields['parser'], files=len(files), compare='comparison' in payload,
+                          mismatches=sum(1 for value in payload.get('comparison', {}).get('results', {}).values() if value == "✘"),
+                          duration_ms=round(payload['gateway_time'] * 1000, 1))
+                self._send_json(200, payload)
+            except GatewayError as e:
+                self._send_json(e.status, {'error': str(e)})
+            except Exception as e:
+                logger.exception("Unexpected gateway error")
+                self._send_json(500, {'error': f"Unexpected error: {e}"})
+
+    return GatewayHandler
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="OCR gateway with caching, pooling and comparison.")
+    arg_parser.add_argument('--host', default='127.0.0.1')
+    arg_parser.add_argument('--port', type=int, default=8080)
+    arg_parser.add_argument('--endpoint', default=os.environ.get('OCR_API_ENDPOINT'), help="OCR API endpoint (default: $OCR_API_ENDPOINT)")
+    arg_parser.add_argument('--parsers-file', default=os.environ.get('OCR_PARSERS_FILE', DEFAULT_PARSERS_FILE))
+    arg_parser.add_argument('--workers', type=int, default=8, help="Maximum concurrent OCR calls")
+    arg_parser.add_argument('--max-pending', type=int, default=64, help="Maximum requests waiting for a worker")
+    arg_parser.add_argument('--hedge', action='store_true', help="Hedge OCR calls slower than $OCR_HEDGE_PERCENTILE (default p95)")
+    args = arg_parser.parse_args()
+
+    if not args.endpoint:
+        arg_parser.error("--endpoint or OCR_API_ENDPOINT is required")
+
+    configure_logging()
+    gateway = OCRGateway(args.endpoint, ParserRegistry(args.parsers_file), workers=args.workers, max_pending=args.max_pending,
+                         hedge=HEDGE_POLICY if args.hedge else None)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(gateway))
+    logger.info("OCR gateway listening on http://%s:%s", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        gateway.executor.shutdown(wait=False)
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,9 @@ import tempfile
 import logging
 import json
 import streamlit as st
+from schema_utils import fields_equal_text
+from state_utils import SHARED_STATE, publish_parsers
+from compress_utils import ACCEPT_ENCODING, load_json, read_file, write_file
 
 GITHUB_REPO = 'ankuraeren/ocr'
 GITHUB_BRANCH = 'main'
@@ -13,13 +16,16 @@ GITHUB_API_URL = f'https://api.github.com/repos/{GITHUB_REPO}/contents/{GITHUB_F
 
 LOCAL_PARSERS_FILE = os.path.join(tempfile.gettempdir(), 'parsers.json')
 GITHUB_ACCESS_TOKEN = st.secrets["github"]["access_token"]
+# Returns the file itself instead of a JSON envelope with it base64-encoded (a third larger)
+GITHUB_RAW_MEDIA_TYPE = 'application/vnd.github.raw+json'
 
 def load_parsers():
     """Load parsers from the local file and store them in session state."""
     if os.path.exists(LOCAL_PARSERS_FILE):
         try:
-            with open(LOCAL_PARSERS_FILE, 'r') as f:
-                st.session_state['parsers'] = json.load(f)
+            st.session_state['parsers'] = load_json(LOCAL_PARSERS_FILE)
+            # Share the registry with other sessions and replicas
+            st.session_state['parsers_version'] = publish_parsers(st.session_state['parsers'], SHARED_STATE)
             st.success("`parsers.json` loaded into session state.")
         except json.JSONDecodeError:
             st.error("`parsers.json` is corrupted or not in valid JSON format.")
@@ -29,26 +35,29 @@ def load_parsers():
         st.error("`parsers.json` does not exist locally. Please download it from GitHub.")
 
 def download_parsers_from_github():
-    """Download the `parsers.json` from GitHub and save it locally."""
-    headers = {'Authorization': f'token {GITHUB_ACCESS_TOKEN}'}
+    """Download the `parsers.json` from GitHub and save it locally (gzip-compressed)."""
+    headers = {
+        'Authorization': f'token {GITHUB_ACCESS_TOKEN}',
+        'Accept': GITHUB_RAW_MEDIA_TYPE,
+        'Accept-Encoding': ACCEPT_ENCODING
+    }
     try:
         response = requests.get(GITHUB_API_URL, headers=headers, timeout=10)
         response.raise_for_status()
 
-        content = response.json().get('content')
+        content = response.content
         if content:
-            with open(LOCAL_PARSERS_FILE, 'wb') as f:
-                f.write(base64.b64decode(content))
+            write_file(LOCAL_PARSERS_FILE, content)
             load_parsers()  # After downloading, load it into session state
             st.success("`parsers.json` downloaded successfully from GitHub.")
         else:
             st.error("`parsers.json` content is empty.")
     except requests.exceptions.RequestException as req_err:
         st.error(f"An error occurred while downloading `parsers.json`: {req_err}")
-        logging.error(f"An error occurred while downloading `parsers.json`: {req_err}")
+        logging.error("An error occurred while downloading `parsers.json`: %s", req_err)
     except Exception as e:
         st.error(f"Unexpected error: {e}")
-        logging.error(f"Unexpected error: {e}")
+        logging.error("Unexpected error: %s", e)
 
 def upload_parsers_to_github():
     """Upload the updated `parsers.json` to GitHub."""
@@ -57,8 +66,8 @@ def upload_parsers_to_github():
         return
 
     try:
-        with open(LOCAL_PARSERS_FILE, 'rb') as f:
-            content = base64.b64encode(f.read()).decode('utf-8')
+        # The contents API takes the plain file, base64-encoded
+        content = base64.b64encode(read_file(LOCAL_PARSERS_FILE)).decode('utf-8')
 
         current_sha = get_current_sha()
         if not current_sha:
@@ -84,7 +93,7 @@ def upload_parsers_to_github():
 
 def get_current_sha():
     """Retrieve the current SHA for the `parsers.json` file on GitHub."""
-    headers = {'Authorization': f'token {GITHUB_ACCESS_TOKEN}'}
+    headers = {'Authorization': f'token {GITHUB_ACCESS_TOKEN}', 'Accept-Encoding': ACCEPT_ENCODING}
     try:
         response = requests.get(GITHUB_API_URL, headers=headers, timeout=10)
         response.raise_for_status()
@@ -96,9 +105,7 @@ def get_current_sha():
 
 def are_fields_equal(field1, field2):
     """Custom logic to determine if two fields are equal, treating 'N/A', 'null', and empty fields as equal."""
-    normalized_field1 = str(field1).strip().lower() if field1 is not None else ""
-    normalized_field2 = str(field2).strip().lower() if field2 is not None else ""
-    return normalized_field1 in ["", "n/a", "null"] and normalized_field2 in ["", "n/a", "null"] or normalized_field1 == normalized_field2
+    return fields_equal_text(field1, field2)
 
 # Example usage in comparison logic
 # Assume we are comparing two OCR outputs (response1, response2) for mismatches
@@ -0,0 +1,87 @@
+# grid_utils.py
+
+import math
+import streamlit as st
+from st_aggrid import AgGrid, GridOptionsBuilder
+
+VIEW_MISMATCHES = "Mismatches only"
+VIEW_NEAR_MATCHES = "Near matches"
+VIEW_ALL = "All fields"
+PAGE_SIZES = [25, 50, 100, 200]
+
+def filter_comparison_df(df, mismatches_only=True, query="", near_matches_only=False):
+    """
+    Filter the comparison DataFrame on the server.
+    Mismatches include near matches ("≈"). Matching is a case-insensitive substring
+    search over every column.
+    """
+    if mismatches_only and 'Comparison' in df.columns:
+        df = df[df['Comparison'] != "✔"]
+    if near_matches_only and 'Comparison' in df.columns:
+        df = df[df['Comparison'] == "≈"]
+    query = query.strip().lower()
+    if query:
+        mask = None
+        for column in df.columns:
+            column_mask = df[column].astype(str).str.lower().str.contains(query, regex=False)
+            mask = column_mask if mask is None else (mask | column_mask)
+        df = df[mask]
+    return df
+
+def sort_comparison_df(df, sort_by=None, ascending=True):
+    """
+    Sort the comparison DataFrame on the server.
+    Values are compared as strings so mixed-type columns sort consistently.
+    """
+    if not sort_by or sort_by not in df.columns:
+        return df
+    return df.sort_values(by=sort_by, ascending=ascending, key=lambda column: column.astype(str).str.lower(), kind='stable')
+
+def page_comparison_df(df, page, page_size):
+    """
+    Return the rows of the requested page (1-based), the page actually shown
+    (clamped to the valid range) and the total number of pages.
+    """
+    total_pages = max(1, math.ceil(len(df) / page_size))
+    page = min(max(1, int(page)), total_pages)
+    start = (page - 1) * page_size
+    return df.iloc[start:start + page_size], page, total_pages
+
+def render_comparison_grid(comparison_df, key="comparison_grid"):
+    """
+    Render the comparison table with server-side filtering, sorting and pagination.
+    Only the visible page is sent to the browser, so the render cost is bounded
+    by the page size rather than by the size of the OCR response.
+    """
+    col_view, col_query, col_sort, col_order, col_size = st.columns([2, 3, 2, 1, 1])
+    with col_view:
+        view = st.radio("View", [VIEW_MISMATCHES, VIEW_NEAR_MATCHES, VIEW_ALL], key=f"{key}_view", horizontal=True,
+                        help="Near matches (≈) are mismatched text fields with a similarity score above the parser's threshold.")
+    with col_query:
+        query = st.text_input("Filter", key=f"{key}_query", placeholder="Search attributes or values")
+    with col_sort:
+        sort_by = st.selectbox("Sort by", list(comparison_df.columns), key=f"{key}_sort")
+    with col_order:
+        ascending = st.selectbox("Order", ["Asc", "Desc"], key=f"{key}_order") == "Asc"
+    with col_size:
+        page_size = st.selectbox("Rows", PAGE_SIZES, key=f"{key}_page_size")
+
+    view_df = filter_comparison_df(comparison_df, mismatches_only=(view == VIEW_MISMATCHES), query=query,
+                                   near_matches_only=(view == VIEW_NEAR_MATCHES))
+    view_df = sort_comparison_df(view_df, sort_by, ascending)
+
+    page = st.number_input("Page", min_value=1, value=1, step=1, key=f"{key}_page")
+    page_df, page, total_pages = page_comparison_df(view_df, page, page_size)
+
+    st.caption(f"Showing {len(page_df)} of {len(view_df)} matching rows ({len(comparison_df)} fields in total) - page {page} of {total_pages}")
+
+    if page_df.empty:
+        st.info("No fields match the current view.")
+        return
+
+    gb = GridOptionsBuilder.from_dataframe(page_df)
+    gb.configure_default_column(sortable=False, filter=False)
+    gb.configure_selection('single')
+    grid_options = gb.build()
+    AgGrid(page_df.reset_index(drop=True), gridOptions=grid_options, height=min(500, 35 * (len(page_df) + 1) + 10), theme='streamlit',
+           enable_enterprise_modules=False, key=f"{key}_aggrid")
@@ -0,0 +1,152 @@
+# hedge_utils.py
+#
+# Hedged OCR requests: when a request has not answered within a high percentile of the
+# latency observed for the same parser and mode, a duplicate is sent and whichever
+# succeeds first is used; the other is cancelled. Hedges are capped to a share of all
+# requests so the extra load stays bounded.
+
+import os
+import time
+import logging
+import threading
+from collections import deque, defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from cancel_utils import CancelToken, run_with_ctx
+from log_utils import log_event
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEDGE_PERCENTILE = float(os.environ.get("OCR_HEDGE_PERCENTILE", "95"))
+# Maximum share of requests that may fire a hedge
+DEFAULT_MAX_HEDGE_RATE = float(os.environ.get("OCR_MAX_HEDGE_RATE", "0.1"))
+# Latencies observed for a parser/mode before it is hedged at all
+MIN_SAMPLES = 20
+LATENCY_WINDOW = 500
+# Never hedge sooner than this, however fast the parser usually is
+MIN_HEDGE_DELAY = 0.5
+
+# Attempts run here so the caller can wait on either of them with a timeout
+_EXECUTOR = ThreadPoolExecutor(max_workers=32, thread_name_prefix="ocr-hedge")
+
+def hedgeable(image_paths):
+    """True if every source can be read by two requests at once (paths and in-memory buffers)."""
+    for image_path in image_paths:
+        source = image_path[1] if isinstance(image_path, tuple) else image_path
+        if not isinstance(source, (str, os.PathLike, bytes, bytearray, memoryview)) and not hasattr(source, 'getbuffer'):
+            return False
+    return True
+
+def _succeeded(result):
+    response, _ = result
+    return response is not None and response.status_code == 200
+
+class HedgePolicy:
+    """
+    Process-wide hedging policy and its statistics.
+    `run(attempt, key)` calls `attempt(cancel_token)` (returning (response, time_taken))
+    and hedges it once the key's `percentile` latency has passed, within the hedge budget.
+    """
+
+    def __init__(self, percentile=DEFAULT_HEDGE_PERCENTILE, max_hedge_rate=DEFAULT_MAX_HEDGE_RATE,
+                 min_samples=MIN_SAMPLES, min_delay=MIN_HEDGE_DELAY):
+        self.percentile = percentile
+        self.max_hedge_rate = max_hedge_rate
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._latencies = defaultdict(lambda: deque(maxlen=LATENCY_WINDOW))
+        self._observed = deque(maxlen=LATENCY_WINDOW)
+        self._requests = 0
+        self._hedged = 0
+        self._wins = 0
+        self._lock = threading.Lock()
+
+    def hedge_delay(self, key):
+        """Seconds to wait before hedging a request for `key`, or None if it is not hedged yet."""
+        with self._lock:
+            latencies = list(self._latencies[key])
+        if len(latencies) < self.min_samples:
+            return None
+        return max(float(np.percentile(latencies, self.percentile)), self.min_delay)
+
+    def _take_hedge(self):
+        with self._lock:
+            if self._hedged + 1 > self.max_hedge_rate * self._requests:
+                return False
+            self._hedged += 1
+            return True
+
+    def _observe(self, key, result, elapsed):
+        with self._lock:
+            self._requests += 1
+            if _succeeded(result):
+                self._latencies[key].append(elapsed)
+                self._observed.append(elapsed)
+
+    def run(self, attempt, key, cancel=None):
+        """
+        Run `attempt`, hedging it if it is slow; returns the winning (response, time_taken).
+        Both copies are cancelled along with `cancel`.
+        """
+        ctx = get_script_run_ctx(suppress_warning=True)
+        start = time.time()
+        delay = self.hedge_delay(key)
+        if delay is not None and cancel is not None and cancel.remaining() is not None and cancel.remaining() <= delay:
+            # Would hit the run's deadline before it could hedge
+            delay = None
+        primary_cancel = cancel.child() if cancel is not None else CancelToken()
+        primary = _EXECUTOR.submit(run_with_ctx, ctx, lambda: attempt(primary_cancel))
+
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._take_hedge():
+            result = primary.result()
+            self._observe(key, result, time.time() - start)
+            return result
+
+        # The primary is slower than `percentile` of recent requests: race a duplicate against it
+        hedge_cancel = cancel.child() if cancel is not None else CancelToken()
+        hedge = _EXECUTOR.submit(run_with_ctx, ctx, lambda: attempt(hedge_cancel))
+        cancels = {primary: primary_cancel, hedge: hedge_cancel}
+        pending = {primary, hedge}
+        winner = None
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if _succeeded(future.result()):
+                    winner = future
+                    break
+        for future in pending:
+            cancels[future].cancel("hedge lost")
+        if winner is None:
+            winner = primary
+        result = winner.result()
+        elapsed = time.time() - start
+        if winner is hedge:
+            with self._lock:
+                self._wins += 1
+        self._observe(key, result, elapsed)
+        if result[0] is not None:
+            # Lets callers count requests that needed a second copy
+            result[0].hedged = True
+        log_event(logger, "ocr_hedge", parser=key[1], extra_accuracy=key[2], delay=round(delay, 3),
+                  winner="hedge" if winner is hedge else "primary", elapsed=round(elapsed, 3))
+        # Report the time the caller actually waited
+        return result[0], elapsed
+
+    def stats(self):
+        """Request, hedge and win counts, plus latency percentiles of the results returned."""
+        with self._lock:
+            observed = list(self._observed)
+            stats = {
+                'requests': self._requests,
+                'hedged': self._hedged,
+                'hedge_wins': self._wins,
+                'hedge_rate': self._hedged / self._requests if self._requests else 0.0,
+                'win_rate': self._wins / self._hedged if self._hedged else 0.0,
+            }
+        for q in (50, 95, 99):
+            stats[f'p{q}'] = float(np.percentile(observed, q)) if observed else None
+        return stats
+
+HEDGE_POLICY = HedgePolicy()
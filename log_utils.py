@@ -0,0 +1,115 @@
+# log_utils.py
+
+import os
+import sys
+import json
+import time
+import queue
+import random
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+DEFAULT_LEVEL = "INFO"
+# Share of field-level DEBUG records that are emitted (0.0 - 1.0)
+DEFAULT_FIELD_SAMPLE_RATE = 0.0
+QUEUE_SIZE = 10000
+
+_listener = None
+_lock = threading.Lock()
+_field_sample_rate = DEFAULT_FIELD_SAMPLE_RATE
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: timestamp, level, logger, message and any event fields."""
+
+    def format(self, record):
+        payload = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        event = getattr(record, 'event', None)
+        if event:
+            payload['event'] = event
+            payload.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+class LazyQueueHandler(QueueHandler):
+    """
+    Enqueue records without formatting them. The stock QueueHandler formats the
+    message on the calling thread; here %-style arguments are only merged by the
+    background listener, so the request thread pays for little more than a put.
+    Records are dropped (not blocked on) if the queue is full.
+    """
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+def configure_logging(level=None, log_file=None, field_sample_rate=None):
+    """
+    Route all logging through a bounded queue to a background thread writing JSON lines.
+    Safe to call more than once; only the first call installs handlers. Handlers already
+    on the root logger (e.g. from a stray logging.basicConfig) are removed, so every record
+    is written once, off the calling thread.
+
+    OCR_LOG_LEVEL              root level (default INFO)
+    OCR_LOG_FILE               write to this file instead of stderr
+    OCR_LOG_FIELD_SAMPLE_RATE  share of field-level DEBUG detail to keep (default 0)
+    """
+    global _listener, _field_sample_rate
+    with _lock:
+        if field_sample_rate is None:
+            field_sample_rate = float(os.environ.get("OCR_LOG_FIELD_SAMPLE_RATE", DEFAULT_FIELD_SAMPLE_RATE))
+        _field_sample_rate = min(max(field_sample_rate, 0.0), 1.0)
+        if _listener is not None:
+            return
+
+        level = level or os.environ.get("OCR_LOG_LEVEL", DEFAULT_LEVEL)
+        log_file = log_file or os.environ.get("OCR_LOG_FILE")
+        output = logging.FileHandler(log_file) if log_file else logging.StreamHandler(sys.stderr)
+        output.setFormatter(JsonFormatter())
+
+        log_queue = queue.Queue(QUEUE_SIZE)
+        root = logging.getLogger()
+        root.setLevel(level.upper() if isinstance(level, str) else level)
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(LazyQueueHandler(log_queue))
+        _listener = QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+def sample_field_detail():
+    """True for the configured share of calls; guards field-level DEBUG logging."""
+    return _field_sample_rate > 0 and (_field_sample_rate >= 1 or random.random() < _field_sample_rate)
+
+def field_logging_enabled(logger):
+    """True if field-level detail may be logged at all (DEBUG enabled and sampling on)."""
+    return _field_sample_rate > 0 and logger.isEnabledFor(logging.DEBUG)
+
+def log_event(logger, event, level=logging.INFO, **fields):
+    """Log a structured event; `fields` become top-level keys of the JSON line."""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={'event': event, 'fields': fields})
+
+class Timer:
+    """Context manager measuring elapsed milliseconds, for event fields."""
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.ms = 0.0
+        return self
+
+    def __exit__(self, *exc):
+        self.ms = (time.perf_counter() - self.start) * 1000
+        return False
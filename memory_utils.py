@@ -0,0 +1,154 @@
+# memory_utils.py
+
+import os
+import sys
+import zlib
+import pickle
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Global budget for compressed results held by all sessions of this server process
+STORE_BUDGET_BYTES = int(float(os.environ.get("OCR_RESULT_STORE_BUDGET_MB", "256")) * 1024 * 1024)
+COMPRESSION_LEVEL = 3
+
+def deep_sizeof(obj, _seen=None):
+    """
+    Approximate the memory held by an object graph, in bytes.
+    DataFrames and NumPy arrays report their buffers; containers are walked recursively
+    and shared objects are only counted once.
+    """
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True, index=True).sum())
+    if isinstance(obj, pd.Series):
+        return int(obj.memory_usage(deep=True, index=True))
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) + (obj.nbytes if obj.base is None else 0)
+    if isinstance(obj, memoryview):
+        return sys.getsizeof(obj) + obj.nbytes
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, _seen) + deep_sizeof(v, _seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, _seen) for item in obj)
+    elif hasattr(obj, 'getbuffer'):
+        size += obj.getbuffer().nbytes
+    return size
+
+def session_footprint(session_state):
+    """Return {key: bytes} for everything held in a Streamlit session state, largest first."""
+    sizes = {}
+    for key in list(session_state.keys()):
+        try:
+            sizes[key] = deep_sizeof(session_state[key])
+        except Exception:
+            sizes[key] = 0
+    return dict(sorted(sizes.items(), key=lambda item: item[1], reverse=True))
+
+class CompactStore:
+    """
+    Process-wide store of compressed results referenced by id.
+
+    Objects are pickled, compressed with zlib and keyed by a content hash, so the
+    same OCR response held by several sessions is stored once. Entries are
+    reference-counted per owner (usually a session id) and, when the compressed
+    total exceeds the budget, the least recently used entries are evicted even if
+    still referenced; `get` then returns None and callers must treat the result
+    as expired.
+    """
+
+    def __init__(self, budget_bytes=STORE_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def put(self, obj, owner=None):
+        """Store an object and return its id."""
+        raw = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+        object_id = hashlib.sha1(raw).hexdigest()
+        with self._lock:
+            entry = self._entries.get(object_id)
+            if entry is None:
+                blob = zlib.compress(raw, COMPRESSION_LEVEL)
+                entry = {'blob': blob, 'raw_size': len(raw), 'owners': {}}
+                self._entries[object_id] = entry
+                self._size += len(blob)
+            self._entries.move_to_end(object_id)
+            entry['owners'][owner] = entry['owners'].get(owner, 0) + 1
+            self._evict()
+        return object_id
+
+    def get(self, object_id):
+        """Return the stored object, or None if it was released or evicted."""
+        with self._lock:
+            entry = self._entries.get(object_id)
+            if entry is None:
+                return None
+            self._entries.move_to_end(object_id)
+            blob = entry['blob']
+        return pickle.loads(zlib.decompress(blob))
+
+    def retain(self, object_id, owner=None):
+        """Add a reference held by owner to a stored object; False if it was evicted."""
+        with self._lock:
+            entry = self._entries.get(object_id)
+            if entry is None:
+                return False
+            entry['owners'][owner] = entry['owners'].get(owner, 0) + 1
+            return True
+
+    def release(self, object_id, owner=None):
+        """Drop one reference held by owner; the entry is freed when nobody references it."""
+        with self._lock:
+            entry = self._entries.get(object_id)
+            if entry is None or owner not in entry['owners']:
+                return
+            entry['owners'][owner] -= 1
+            if entry['owners'][owner] <= 0:
+                del entry['owners'][owner]
+            if not entry['owners']:
+                self._remove(object_id)
+
+    def _remove(self, object_id):
+        entry = self._entries.pop(object_id)
+        self._size -= len(entry['blob'])
+
+    def _evict(self):
+        while self._size > self.budget_bytes and len(self._entries) > 1:
+            object_id, entry = next(iter(self._entries.items()))
+            logger.info("Evicting result %s (%d bytes) to stay within the memory budget.", object_id[:12], len(entry['blob']))
+            self._remove(object_id)
+
+    def usage_by_owner(self):
+        """Return {owner: compressed bytes}; shared entries are split evenly between owners."""
+        usage = {}
+        with self._lock:
+            for entry in self._entries.values():
+                share = len(entry['blob']) / len(entry['owners'])
+                for owner in entry['owners']:
+                    usage[owner] = usage.get(owner, 0) + share
+        return usage
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'compressed_bytes': self._size,
+                'raw_bytes': sum(entry['raw_size'] for entry in self._entries.values()),
+                'budget_bytes': self.budget_bytes,
+            }
+
+RESULT_STORE = CompactStore()
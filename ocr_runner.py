@@ -1,14 +1,51 @@
 import os
-import tempfile
-import shutil
+import json
+import time
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
 import streamlit as st
-from PIL import Image
 from PyPDF2 import PdfReader
-from ocr_utils import send_request, generate_comparison_results, generate_comparison_df, generate_mismatch_df
-from st_aggrid import AgGrid, GridOptionsBuilder
+from ocr_utils import send_request, response_json, generate_comparison_results, generate_comparison_df
+from grid_utils import render_comparison_grid
+from schema_utils import comparison_schema_error, get_parser_comparator
+from phash_utils import DUPLICATE_INDEX, DEFAULT_MAX_DISTANCE, fingerprint_upload
+from memory_utils import RESULT_STORE, session_footprint
+from preview_utils import PREVIEW_CACHE
+from log_utils import log_event
+from analytics_utils import HISTORY
+from hedge_utils import HEDGE_POLICY
+from search_utils import get_parser_index
+from similarity_utils import DEFAULT_SIMILARITY_THRESHOLD
+from stream_utils import source_digest
+from cassette_utils import active_cassette, credential_digest, request_fingerprint
+from state_utils import OCR_CACHE, JOBS
+from cancel_utils import CancelToken, run_cancellable, submit_with_ctx, DEFAULT_RUN_DEADLINE, POLL_INTERVAL
+from routing_utils import decide_route, parser_history_stats, DEFAULT_SHADOW_RATE, ROUTE_BOTH, ROUTE_EXTRA, ROUTE_STANDARD
+from profile_utils import profile_run, render_profile_report
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+logger = logging.getLogger(__name__)
+
+# Owner of the store references held by the near-duplicate index
+DUPLICATE_INDEX_OWNER = 'duplicate_index'
+# Registries larger than this get a search box instead of one radio button per parser
+MAX_RADIO_PARSERS = 20
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+# Previews shown for a multi-document upload, and per row
+MAX_PREVIEWS = 8
+PREVIEW_COLUMNS = 4
+# Documents of a batch whose OCR requests are in flight at the same time
+BATCH_IN_FLIGHT = int(os.environ.get("OCR_BATCH_IN_FLIGHT", "2"))
+# Documents hashed and buffered ahead of those being sent
+STAGE_AHEAD = 2
+
+# Staging (buffering and hashing) of batch documents runs here, ahead of their requests
+_STAGE_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ocr-stage")
 
 # Main OCR parser function
-def run_parser(parsers):
+def run_parser(parsers, allow_profiling=False):
     st.subheader("Run OCR Parser")
     if not parsers:
         st.info("No parsers available. Please add a parser first.")
@@ -54,142 +91,746 @@ def run_parser(parsers):
         </style>
     """, unsafe_allow_html=True)
 
-    # Convert parser selection into horizontal scrollable radio buttons
+    # Convert parser selection into horizontal scrollable radio buttons; large registries
+    # are searched first so only the matching parsers are rendered
     parser_names = list(parsers.keys())
+    if len(parser_names) > MAX_RADIO_PARSERS:
+        query = st.text_input("Search parsers", placeholder="Name, app id or API key prefix", key="run_parser_search")
+        matches = get_parser_index(parsers).search(query)
+        if not matches:
+            st.info("No parsers match your search.")
+            return
+        parser_names = matches[:MAX_RADIO_PARSERS]
+        if len(matches) > MAX_RADIO_PARSERS:
+            st.caption(f"Showing the first {MAX_RADIO_PARSERS} of {len(matches)} matching parsers; refine the search to see others.")
     selected_parser = st.radio("Select Parser", parser_names)
     parser_info = parsers[selected_parser]
 
     st.write(f"**Selected Parser:** {selected_parser}")
     st.write(f"**Extra Accuracy Required:** {'Yes' if parser_info['extra_accuracy'] else 'No'}")
-
-    file_paths = []
-    temp_dirs = []
+    schema_error = comparison_schema_error(parser_info)
+    if schema_error:
+        st.warning(f"This parser's comparison schema is invalid ({schema_error}); field types are inferred from its expected response instead.")
 
     # Add a note to the user about the file size limit
-    st.markdown("**Note:** Please upload an image or PDF file not exceeding **20MB**.")
+    st.markdown("**Note:** Please upload images or PDF files not exceeding **20MB** each.")
 
-    # File uploader with file size limit
+    # File uploader with file size limit; several documents are processed as a pipelined batch
     uploaded_files = st.file_uploader(
         "Choose image or PDF file(s)... (Limit 20MB per file)", 
         type=["jpg", "jpeg", "png", "pdf"], 
-        accept_multiple_files=False
+        accept_multiple_files=True
     )
-    
-    if uploaded_files:
-        if uploaded_files.size > 20 * 1024 * 1024:  # 20 MB limit
-            st.error("File size exceeds the 20 MB limit. Please upload a smaller file.")
-            return
-        try:
-            if uploaded_files.type == "application/pdf":
-                # Handle PDF files
-                temp_dir = tempfile.mkdtemp()
-                temp_dirs.append(temp_dir)
-                pdf_path = os.path.join(temp_dir, uploaded_files.name)
 
-                with open(pdf_path, "wb") as f:
-                    f.write(uploaded_files.getbuffer())
+    documents = []
+    for uploaded_file in uploaded_files or []:
+        if uploaded_file.size > MAX_UPLOAD_BYTES:
+            st.error(f"{uploaded_file.name} exceeds the 20 MB limit and will be skipped.")
+            continue
+        documents.append(uploaded_file)
 
-                # Display PDF filename
-                st.markdown(f"**Uploaded PDF:** {uploaded_files.name}")
-                file_paths.append(pdf_path)
+    # Show cached, bounded-size previews (first page for PDFs) instead of the full-resolution files
+    if documents:
+        preview_columns = st.columns(min(len(documents), PREVIEW_COLUMNS))
+        for position, uploaded_file in enumerate(documents[:MAX_PREVIEWS]):
+            with preview_columns[position % PREVIEW_COLUMNS]:
+                try:
+                    if uploaded_file.type == "application/pdf":
+                        # Display PDF filename
+                        st.markdown(f"**Uploaded PDF:** {uploaded_file.name}")
+                    preview = PREVIEW_CACHE.get_preview(uploaded_file, uploaded_file.name)
+                    if preview is not None:
+                        st.image(preview, caption=uploaded_file.name)
+                except Exception as e:
+                    st.error(f"Error processing file {uploaded_file.name}: {e}")
+        if len(documents) > MAX_PREVIEWS:
+            st.caption(f"... and {len(documents) - MAX_PREVIEWS} more documents.")
 
-            else:
-                # Handle image files
-                image = Image.open(uploaded_files)
-                st.image(image, caption=uploaded_files.name, use_column_width=True)
-                temp_dir = tempfile.mkdtemp()
-                temp_dirs.append(temp_dir)
-                image_path = os.path.join(temp_dir, uploaded_files.name)
-                image.save(image_path)
-                file_paths.append(image_path)
-
-        except Exception as e:
-            st.error(f"Error processing file {uploaded_files.name}: {e}")
+    # Near-duplicate detection settings
+    with st.expander("Near-duplicate detection"):
+        detect_duplicates = st.checkbox("Check for near-duplicates of previously processed documents", value=True)
+        max_distance = st.slider(
+            "Maximum Hamming distance", min_value=0, max_value=20, value=DEFAULT_MAX_DISTANCE,
+            help="Perceptual hashes within this many bits (out of 64) are treated as the same document."
+        )
+        reuse_duplicates = st.checkbox("Reuse previous OCR results for near-duplicates", value=False)
+
+    # History-driven routing settings
+    with st.expander("Routing"):
+        auto_route = st.checkbox(
+            "Send only one variant when the history shows both modes agree", value=True,
+            help="Based on the recorded extra accuracy vs standard comparisons for this parser."
+        )
+        shadow_rate = st.slider(
+            "Shadow sample rate", min_value=0.0, max_value=1.0, value=DEFAULT_SHADOW_RATE, step=0.05,
+            help="Share of routed runs that still send both variants, to keep monitoring agreement."
+        )
+        stats = parser_history_stats(HISTORY, selected_parser)
+        if stats['documents']:
+            st.caption(
+                f"History: {stats['documents']} compared runs, all fields agreed in {stats['agreement']:.1%}; "
+                f"median ⏱ extra accuracy {stats['time_extra']:.2f}s, standard {stats['time_standard']:.2f}s."
+            )
+        else:
+            st.caption("No compared runs recorded for this parser yet.")
+
+        hedge_requests = st.checkbox(
+            f"Hedge slow requests (send a duplicate after the p{HEDGE_POLICY.percentile:g} latency)", value=False,
+            help=f"At most {HEDGE_POLICY.max_hedge_rate:.0%} of requests are hedged; the slower copy is cancelled."
+        )
+        run_deadline = st.number_input(
+            "Run deadline (seconds)", min_value=10, max_value=DEFAULT_RUN_DEADLINE, value=DEFAULT_RUN_DEADLINE,
+            help="Requests still running after this are cancelled."
+        )
+        hedge_stats = HEDGE_POLICY.stats()
+        if hedge_stats['hedged']:
+            st.caption(
+                f"Hedging: {hedge_stats['hedged']} of {hedge_stats['requests']} requests hedged ({hedge_stats['hedge_rate']:.1%}), "
+                f"{hedge_stats['hedge_wins']} won by the hedge; p50 {hedge_stats['p50']:.2f}s, p99 {hedge_stats['p99']:.2f}s."
+            )
+
+    # Internal team view only: wrap the run in cProfile + tracemalloc
+    profile_requested = allow_profiling and st.checkbox("Profile this run (cProfile + tracemalloc)", value=False)
 
     # Run OCR button
     if st.button("Run OCR"):
-        if not file_paths:
+        if not documents:
             st.error("Please provide at least one image or PDF.")
             return
 
-        headers = {
-            'x-api-key': parser_info['api_key'],
+        duplicate_settings = {'detect': detect_duplicates, 'max_distance': max_distance, 'reuse': reuse_duplicates}
+        routing_settings = {
+            'auto': auto_route, 'shadow_rate': shadow_rate,
+            'hedge': HEDGE_POLICY if hedge_requests else None, 'deadline': run_deadline,
         }
+        with profile_run(enabled=profile_requested) as profile:
+            if len(documents) == 1:
+                result = execute_run(selected_parser, parser_info, documents[0], duplicate_settings, routing_settings)
+                render_run_result(result)
+            else:
+                batch = execute_batch(selected_parser, parser_info, documents, duplicate_settings, routing_settings)
+                render_batch_result(batch)
+        if profile.enabled:
+            render_profile_report(profile, file_name=f"{selected_parser}_profile.zip")
+        return
+
+    # Re-render the last run or batch on reruns (e.g. grid interactions)
+    batch = st.session_state.get('ocr_batch')
+    if batch and batch['parser'] == selected_parser:
+        render_batch_result(batch)
+        return
+    stored = st.session_state.get('ocr_result')
+    if stored and stored['parser'] == selected_parser:
+        result = load_run_result(stored)
+        if result is None:
+            st.warning("The previous results were evicted to free server memory. Please run OCR again.")
+            release_run_result(stored, get_session_id())
+            del st.session_state['ocr_result']
+        else:
+            render_run_result(result)
+
+def execute_run(selected_parser, parser_info, uploaded_file, duplicate_settings, routing_settings):
+    """
+    Run the OCR variants chosen by routing for an upload (or reuse a near-duplicate's results),
+    build the comparison, and keep a compact copy of the run in session state. Returns the run result.
+
+    Requests share one cancel token with the run's deadline. It is cancelled when a rerun
+    interrupts the run (new upload, parser switch) or a newer run of the session starts.
+    """
+    request = build_request(parser_info)
+
+    # Look for a near-duplicate (re-scan, re-encode) of a document this parser already processed
+    parser_key = duplicate_key(parser_info)
+    fingerprint = None
+    duplicate = None
+    if duplicate_settings['detect']:
+        fingerprint = fingerprint_upload(uploaded_file, uploaded_file.name)
+        duplicate = find_duplicate(parser_key, fingerprint, duplicate_settings['max_distance'])
+    if duplicate:
+        distance, record = duplicate
+        st.warning(f"This document is a near-duplicate of {duplicate_name(record)}, processed earlier (distance {distance}).")
+
+    reused = None
+    if duplicate and duplicate_settings['reuse']:
+        reused = reuse_duplicate(duplicate)
+        if reused is None:
+            st.info("The earlier results were evicted from memory, so OCR will run again.")
+
+    route = None
+    if reused:
+        variant_extra, variant_no_extra = reused
+        reused_from = duplicate_name(duplicate[1])
+    else:
+        route, send_extra, send_no_extra = plan_route(selected_parser, routing_settings)
+        token = begin_run_token(routing_settings['deadline'])
+        upload_sources = [(uploaded_file.name, uploaded_file)]
+        progress = st.empty()
+
+        def wait_for_variant(extra_accuracy, label):
+            return run_cancellable(
+                lambda: send_variant(upload_sources, request, extra_accuracy, routing_settings['hedge'], token),
+                token, on_tick=lambda elapsed: progress.caption(f"Waiting for the {label} result... {elapsed:.0f}s"),
+            )
+
+        variant_extra = variant_no_extra = None
+        with st.spinner("Processing OCR..."):
+            if send_extra:
+                variant_extra = wait_for_variant(True, "extra accuracy")
+            if send_no_extra and not token.is_set():
+                variant_no_extra = wait_for_variant(False, "standard")
+        progress.empty()
+        end_run_token(token)
+        if token.is_set():
+            st.warning(f"OCR run stopped: {token.reason}.")
+        reused_from = None
+
+    result = record_run(selected_parser, parser_info, uploaded_file.name, fingerprint,
+                        variant_extra, variant_no_extra, reused_from, route)
+
+    # Keep only a compact reference in session state so grid interactions (which trigger reruns)
+    # don't lose the run, and the previous run's data is released
+    replace_stored_runs('ocr_result', store_run_result(result, get_session_id()))
+    return result
+
+def execute_batch(selected_parser, parser_info, uploaded_files, duplicate_settings, routing_settings):
+    """
+    Run several documents as a pipeline and stream their results into a per-document table.
+
+    While up to BATCH_IN_FLIGHT documents have requests in flight, the next STAGE_AHEAD
+    documents are already being buffered, checksummed and fingerprinted on staging threads,
+    so each request starts as soon as a slot frees up. Comparisons, history recording and
+    session storage happen on the script thread as each document completes. Each document
+    gets its own deadline; a rerun or a newer run cancels the whole batch. Progress is
+    recorded in the shared job store (state_utils.JOBS).
+    """
+    request = build_request(parser_info)
+    parser_key = duplicate_key(parser_info)
+    session_id = get_session_id()
+    rows = [new_batch_row(uploaded_file.name) for uploaded_file in uploaded_files]
+    batch = {'parser': selected_parser, 'rows': rows, 'results': [None] * len(uploaded_files)}
+    # Stored up front so documents finished before an interruption are kept
+    replace_stored_runs('ocr_batch', batch)
+
+    batch_token = begin_run_token()
+    job_id = JOBS.start(selected_parser, len(uploaded_files))
+    batch['job_id'] = job_id
+    staged = {}                     # document index -> staging future
+    fetching = {}                   # request future -> (document index, staged document, route)
+    first_with_digest = {}          # content digest -> index of the first document with it
+    copies = defaultdict(list)      # document index -> later identical documents
+    failed = {}                     # finished document index -> whether it failed
+    started_at = {}                 # document index -> when its requests were submitted
+    next_stage = next_send = 0
+    drawn = None                    # table rows as last sent to the browser
+    table = st.empty()
+    progress = st.empty()
+    start = time.monotonic()
+
+    def complete(index, document, variant_extra, variant_no_extra, route=None, reused_from=None):
+        compare_start = time.monotonic()
+        result = record_run(selected_parser, parser_info, document['name'], document['fingerprint'],
+                            variant_extra, variant_no_extra, reused_from, route)
+        batch['results'][index] = store_run_result(result, session_id)
+        rows[index].update(summarize_run(result))
+        variants = [variant for variant in (variant_extra, variant_no_extra) if variant is not None]
+        failed[index] = any(variant['error'] for variant in variants)
+        # Where the document's time went, for the job dashboard
+        stage_seconds = {'staging': document['stage_seconds'], 'comparison': time.monotonic() - compare_start}
+        if not reused_from:
+            stage_seconds['extra accuracy'] = variant_extra['time_taken'] if variant_extra else 0.0
+            stage_seconds['standard'] = variant_no_extra['time_taken'] if variant_no_extra else 0.0
+        started = index in started_at
+        JOBS.document_finished(job_id, failed=failed[index], stage_seconds=stage_seconds, started=started,
+                               latency=time.monotonic() - started_at.pop(index) if started else None,
+                               retries=sum(1 for variant in variants if variant.get('hedged')))
+        for copy_index in copies.pop(index, []):
+            copy_finished(index, copy_index)
+
+    def fail(index, error):
+        rows[index]['Status'] = f"Failed: {error}"
+        failed[index] = True
+        started = index in started_at
+        JOBS.document_finished(job_id, failed=True, started=started,
+                               latency=time.monotonic() - started_at.pop(index) if started else None)
+        for copy_index in copies.pop(index, []):
+            copy_finished(index, copy_index)
+
+    def copy_finished(index, copy_index):
+        rows[copy_index].update({**rows[index], 'Document': rows[copy_index]['Document'],
+                                 'Status': f"Identical to {rows[index]['Document']}"})
+        if batch['results'][index] is not None:
+            batch['results'][copy_index] = retain_run_result(batch['results'][index], session_id)
+        failed[copy_index] = failed[index]
+        JOBS.document_finished(job_id, failed=failed[index], started=False)
+
+    try:
+        while next_send < len(uploaded_files) or fetching:
+            # Stage ahead of the documents being sent, but never more than STAGE_AHEAD at a time
+            while next_stage < len(uploaded_files) and next_stage - next_send < STAGE_AHEAD:
+                staged[next_stage] = _STAGE_EXECUTOR.submit(stage_document, uploaded_files[next_stage], duplicate_settings['detect'])
+                next_stage += 1
+
+            # Start the next staged documents while there are free request slots
+            while next_send in staged and len(fetching) < BATCH_IN_FLIGHT and staged[next_send].done():
+                index = next_send
+                next_send += 1
+                try:
+                    document = staged.pop(index).result()
+                except Exception as e:
+                    fail(index, e)
+                    continue
+
+                if document['digest'] in first_with_digest:
+                    first = first_with_digest[document['digest']]
+                    if first in failed:
+                        copy_finished(first, index)
+                    else:
+                        rows[index]['Status'] = f"Waiting for identical {rows[first]['Document']}"
+                        copies[first].append(index)
+                    continue
+                first_with_digest[document['digest']] = index
+
+                duplicate = find_duplicate(parser_key, document['fingerprint'], duplicate_settings['max_distance'])
+                reused = reuse_duplicate(duplicate) if duplicate and duplicate_settings['reuse'] else None
+                if reused:
+                    complete(index, document, reused[0], reused[1], reused_from=duplicate_name(duplicate[1]))
+                    continue
+
+                route, send_extra, send_no_extra = plan_route(selected_parser, routing_settings)
+                token = CancelToken.with_timeout(routing_settings['deadline'], parent=batch_token)
+                future = submit_with_ctx(fetch_variants, [(document['name'], document['source'])], request,
+                                         send_extra, send_no_extra, routing_settings['hedge'], token)
+                fetching[future] = (index, document, route)
+                started_at[index] = time.monotonic()
+                JOBS.document_started(job_id)
+                rows[index]['Status'] = "Running"
+                if duplicate:
+                    rows[index]['Status'] = f"Running (near-duplicate of {duplicate_name(duplicate[1])})"
+
+            # Redraw the table only when a row changed since it was last sent to the browser
+            snapshot = [tuple(row.values()) for row in rows]
+            if snapshot != drawn:
+                table.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+                drawn = snapshot
+            # Streamlit raises its rerun exception from this update when the user interrupts the batch
+            progress.caption(f"Processed {len(failed)} of {len(uploaded_files)} documents... {time.monotonic() - start:.0f}s")
+
+            # The next staged document only ends the wait if a request slot is free to send it
+            waiting = list(fetching)
+            if next_send in staged and len(fetching) < BATCH_IN_FLIGHT:
+                waiting.append(staged[next_send])
+            if not waiting:
+                continue
+            done, _ = wait(waiting, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future not in fetching:
+                    continue
+                index, document, route = fetching.pop(future)
+                try:
+                    variant_extra, variant_no_extra = future.result()
+                except Exception as e:
+                    fail(index, e)
+                    continue
+                complete(index, document, variant_extra, variant_no_extra, route=route)
+    except BaseException:
+        batch_token.cancel("superseded")
+        JOBS.finish(job_id, status='stopped')
+        raise
+    finally:
+        end_run_token(batch_token)
+    JOBS.finish(job_id, status='stopped' if batch_token.is_set() else 'finished')
+
+    table.empty()
+    progress.empty()
+    if batch_token.is_set():
+        st.warning(f"OCR batch stopped: {batch_token.reason}.")
+    return batch
+
+def stage_document(uploaded_file, detect_duplicates):
+    """
+    Prepare a batch document for its requests (runs on a staging thread): checksum and
+    fingerprint it. The upload itself is sent, not a copy: the digest and the request body
+    read it through its buffer, so the file position is only used while fingerprinting.
+    """
+    start = time.monotonic()
+    document = {
+        'name': uploaded_file.name,
+        'source': uploaded_file,
+        'digest': source_digest(uploaded_file),
+        'fingerprint': fingerprint_upload(uploaded_file, uploaded_file.name) if detect_duplicates else None,
+    }
+    document['stage_seconds'] = time.monotonic() - start
+    return document
 
-        form_data = {
+def new_batch_row(name):
+    return {
+        'Document': name, 'Status': "Queued", 'Route': None, 'Fields': None, 'Mismatches': None,
+        'Near matches': None, '⏱ Extra (s)': None, '⏱ Standard (s)': None,
+    }
+
+def summarize_run(result):
+    """Per-document table columns for a finished run."""
+    extra, no_extra, df = result['extra'], result['no_extra'], result['comparison_df']
+    variants = [variant for variant in (extra, no_extra) if variant is not None]
+    errors = [variant['error'] for variant in variants if variant['error']]
+    if result['reused_from']:
+        status = f"Reused from {result['reused_from']}"
+    elif errors:
+        status = errors[0]
+    elif all(variant.get('cached') for variant in variants):
+        status = "Done (cached)"
+    else:
+        status = "Done"
+    return {
+        'Status': status,
+        'Route': result['route']['route'] if result['route'] else ROUTE_BOTH,
+        'Fields': len(df) if df is not None else None,
+        # Near matches are still mismatches; the next column says how many of them there are
+        'Mismatches': int((df['Comparison'] != "✔").sum()) if df is not None else None,
+        'Near matches': int((df['Comparison'] == "≈").sum()) if df is not None else None,
+        '⏱ Extra (s)': round(extra['time_taken'], 2) if extra and extra['time_taken'] is not None else None,
+        '⏱ Standard (s)': round(no_extra['time_taken'], 2) if no_extra and no_extra['time_taken'] is not None else None,
+    }
+
+def build_request(parser_info):
+    """Headers, form fields and endpoint of a parser's OCR requests (read on the script thread)."""
+    return {
+        'headers': {
+            'x-api-key': parser_info['api_key'],
+        },
+        'form_data': {
             'parserApp': parser_info['parser_app_id'],
             'user_ip': '127.0.0.1',
             'location': 'delhi',
             'user_agent': 'Dummy-device-testing11',
-        }
+        },
+        'endpoint': st.secrets["api"]["endpoint"],
+    }
 
-        API_ENDPOINT = st.secrets["api"]["endpoint"]
+def duplicate_key(parser_info):
+    """Near-duplicate index key: results are only reused for the same parser and API key."""
+    return (parser_info['parser_app_id'], credential_digest({'x-api-key': parser_info['api_key']}))
 
-        with st.spinner("Processing OCR..."):
-            response_extra, time_taken_extra = send_request(file_paths, headers, form_data, True, API_ENDPOINT)
-            response_no_extra, time_taken_no_extra = send_request(file_paths, headers, form_data, False, API_ENDPOINT)
+def duplicate_name(record):
+    """A near-duplicate as shown to this session; file names of other sessions are not shown."""
+    if record.get('session_id') is not None and record['session_id'] == get_session_id():
+        return f"'{record['name']}'"
+    return "a document from another session"
 
-        # Cleanup temporary directories
-        for temp_dir in temp_dirs:
-            try:
-                shutil.rmtree(temp_dir)
-            except Exception as e:
-                st.warning(f"Could not remove temporary directory {temp_dir}: {e}")
+def find_duplicate(parser_key, fingerprint, max_distance):
+    """(distance, record) of a near-duplicate this parser already processed, or None."""
+    if fingerprint is None:
+        return None
+    return DUPLICATE_INDEX.find(parser_key, fingerprint, max_distance)
 
-        if response_extra and response_no_extra:
-            success_extra = response_extra.status_code == 200
-            success_no_extra = response_no_extra.status_code == 200
+def reuse_duplicate(duplicate):
+    """The near-duplicate's stored variants, or None if they have been evicted."""
+    reused = [load_variant(variant) for variant in duplicate[1]['results']]
+    return None if None in reused else reused
 
-            # Display results in two columns
-            col1, col2 = st.columns(2)
+def plan_route(selected_parser, routing_settings):
+    """Return (route, send_extra, send_no_extra); route is None when routing is off."""
+    route = None
+    # Skip the redundant variant for parsers whose modes reliably agree (see routing_utils)
+    if routing_settings['auto']:
+        route = decide_route(HISTORY, selected_parser, shadow_rate=routing_settings['shadow_rate'])
+    send_extra = route is None or route['route'] in (ROUTE_BOTH, ROUTE_EXTRA)
+    send_no_extra = route is None or route['route'] in (ROUTE_BOTH, ROUTE_STANDARD)
+    return route, send_extra, send_no_extra
 
-            if success_extra:
-                try:
-                    response_json_extra = response_extra.json()
-                    with col1:
-                        st.expander(f"Results with Extra Accuracy - ⏱ {time_taken_extra:.2f}s").json(response_json_extra)
-                except json.JSONDecodeError:
-                    with col1:
-                        st.error("Failed to parse JSON response with Extra Accuracy.")
-            else:
-                with col1:
-                    st.error(f"Request with Extra Accuracy failed. Status code: {response_extra.status_code}")
+def begin_run_token(deadline=None):
+    """A new cancel token for the session's run; a run still in flight (e.g. from an interrupted script) is superseded."""
+    token = CancelToken.with_timeout(deadline)
+    previous_token = st.session_state.get('ocr_cancel_token')
+    if previous_token is not None:
+        previous_token.cancel("superseded")
+    st.session_state['ocr_cancel_token'] = token
+    return token
 
-            if success_no_extra:
-                try:
-                    response_json_no_extra = response_no_extra.json()
-                    with col2:
-                        st.expander(f"Results without Extra Accuracy - ⏱ {time_taken_no_extra:.2f}s").json(response_json_no_extra)
-                except json.JSONDecodeError:
-                    with col2:
-                        st.error("Failed to parse JSON response without Extra Accuracy.")
-            else:
-                with col2:
-                    st.error(f"Request without Extra Accuracy failed. Status code: {response_no_extra.status_code}")
-
-            # Generate comparison results
-            if success_extra and success_no_extra:
-                comparison_results = generate_comparison_results(response_json_extra, response_json_no_extra)
-
-                # Display mismatched fields in a table
-                st.subheader("Mismatched Fields")
-                mismatch_df = generate_mismatch_df(response_json_extra, response_json_no_extra, comparison_results)
-                st.dataframe(mismatch_df)
-
-                # Display the comparison table
-                st.subheader("Comparison Table")
-                comparison_table = generate_comparison_df(response_json_extra, response_json_no_extra, comparison_results)
-                gb = GridOptionsBuilder.from_dataframe(comparison_table)
-                gb.configure_pagination(paginationAutoPageSize=True)
-                gb.configure_side_bar()
-                gb.configure_selection('single')
-                grid_options = gb.build()
-                AgGrid(comparison_table, gridOptions=grid_options, height=500, theme='streamlit', enable_enterprise_modules=True)
-
-                # Display the full comparison JSON after the table
-                st.subheader("Comparison JSON")
-                st.expander("Comparison JSON").json(comparison_results)
+def end_run_token(token):
+    if st.session_state.get('ocr_cancel_token') is token:
+        del st.session_state['ocr_cancel_token']
 
-            else:
-                st.error("Comparison failed. One or both requests were unsuccessful.")
+def _request_variant(upload_sources, request, extra_accuracy, hedge, token):
+    response, time_taken = send_request(upload_sources, request['headers'], request['form_data'], extra_accuracy,
+                                        request['endpoint'], stream=True, hedge=hedge, cancel=token)
+    variant = parse_variant(response, time_taken)
+    variant['hedged'] = getattr(response, 'hedged', False)
+    if response is None and token.is_set():
+        variant['error'] = f"Request stopped ({token.reason})."
+    return variant
+
+def send_variant(upload_sources, request, extra_accuracy, hedge, token):
+    """
+    Send one OCR variant and parse its response (safe to call from a worker thread).
+    Results are shared by all replicas through OCR_CACHE, which also keeps an identical
+    request in flight elsewhere from being sent twice.
+    """
+    # While recording/replaying every call must reach the cassette, and replayed
+    # responses must not end up in the shared cache
+    if active_cassette() is not None:
+        return _request_variant(upload_sources, request, extra_accuracy, hedge, token)
+    form_data = dict(request['form_data'])
+    if extra_accuracy:
+        form_data['extra_accuracy'] = 'true'
+    # Keyed by credential too: a result must not be served to a different (or revoked) API key
+    cache_key = f"{request_fingerprint(request['endpoint'], form_data, upload_sources)}:{credential_digest(request['headers'])}"
+    with OCR_CACHE.request(cache_key, cancel=token) as cached:
+        if cached.entry is not None:
+            return {'status_code': 200, 'json': cached.entry['json'], 'time_taken': cached.entry['time_taken'],
+                    'error': None, 'cached': True}
+        variant = _request_variant(upload_sources, request, extra_accuracy, hedge, token)
+        if variant['json'] is not None:
+            cached.put(variant['json'], variant['time_taken'])
+    return variant
+
+def fetch_variants(upload_sources, request, send_extra, send_no_extra, hedge, token):
+    """Send the routed variants of one document in turn; returns (variant_extra, variant_no_extra)."""
+    variant_extra = variant_no_extra = None
+    if send_extra:
+        variant_extra = send_variant(upload_sources, request, True, hedge, token)
+    if send_no_extra and not token.is_set():
+        variant_no_extra = send_variant(upload_sources, request, False, hedge, token)
+    return variant_extra, variant_no_extra
+
+def record_run(selected_parser, parser_info, name, fingerprint, variant_extra, variant_no_extra, reused_from=None, route=None):
+    """
+    Finish a run on the script thread: index it for near-duplicate detection, build the
+    comparison, record it in the comparison history and log it. Returns the run result.
+    """
+    if (fingerprint is not None and not reused_from and variant_extra and variant_no_extra
+            and variant_extra['json'] is not None and variant_no_extra['json'] is not None):
+        DUPLICATE_INDEX.add(duplicate_key(parser_info), fingerprint, name, (
+            compact_variant(variant_extra, DUPLICATE_INDEX_OWNER),
+            compact_variant(variant_no_extra, DUPLICATE_INDEX_OWNER),
+        ), session_id=get_session_id())
+
+    result = build_run_result(selected_parser, parser_info, variant_extra, variant_no_extra, reused_from, route)
+    # Runs served entirely from the shared cache were recorded when they first ran
+    if result['comparison_df'] is not None and not reused_from and not (variant_extra.get('cached') and variant_no_extra.get('cached')):
+        HISTORY.record(selected_parser, result['comparison_df'], variant_extra['time_taken'], variant_no_extra['time_taken'],
+                       source="shadow" if route and route['shadow'] else "runner")
+    log_event(
+        logger, "ocr_run", parser=selected_parser, reused_from=reused_from,
+        route=route['route'] if route else ROUTE_BOTH, shadow=bool(route and route['shadow']),
+        status_extra=variant_extra and variant_extra['status_code'], status_no_extra=variant_no_extra and variant_no_extra['status_code'],
+        time_extra=variant_extra and variant_extra['time_taken'], time_no_extra=variant_no_extra and variant_no_extra['time_taken'],
+        fields=len(result['comparison_results'] or {}),
+        mismatches=sum(1 for value in (result['comparison_results'] or {}).values() if value == "✘"),
+    )
+    return result
+
+def replace_stored_runs(key, value):
+    """
+    Keep a single run ('ocr_result') or a batch ('ocr_batch') in session state and release
+    the store references of the previous one of either kind.
+    """
+    session_id = get_session_id()
+    previous_result = st.session_state.pop('ocr_result', None)
+    previous_batch = st.session_state.pop('ocr_batch', None)
+    st.session_state[key] = value
+    if previous_result:
+        release_run_result(previous_result, session_id)
+    if previous_batch:
+        for stored in previous_batch['results']:
+            if stored is not None:
+                release_run_result(stored, session_id)
+
+def get_session_id():
+    """Id of the current Streamlit session, used as the owner of its stored results."""
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else None
+
+def compact_variant(variant, owner):
+    """Replace a variant's parsed JSON with a reference into the shared compressed store."""
+    if variant is None:
+        return None
+    compact = {key: value for key, value in variant.items() if key != 'json'}
+    compact['json_id'] = RESULT_STORE.put(variant['json'], owner) if variant['json'] is not None else None
+    return compact
+
+def load_variant(compact):
+    """Inverse of compact_variant; returns None if the stored JSON has been evicted."""
+    if compact is None:
+        return None
+    variant = {key: value for key, value in compact.items() if key != 'json_id'}
+    variant['json'] = None
+    if compact['json_id'] is not None:
+        variant['json'] = RESULT_STORE.get(compact['json_id'])
+        if variant['json'] is None:
+            return None
+    return variant
+
+def store_run_result(result, owner):
+    """Compact a run result for session state: large members live in the shared store."""
+    return {
+        'parser': result['parser'],
+        'reused_from': result['reused_from'],
+        'route': result['route'],
+        'extra': compact_variant(result['extra'], owner),
+        'no_extra': compact_variant(result['no_extra'], owner),
+        'comparison_id': RESULT_STORE.put((result['comparison_results'], result['comparison_df']), owner) if result['comparison_df'] is not None else None,
+    }
+
+def load_run_result(stored):
+    """Rebuild a run result from session state; returns None if any part has been evicted."""
+    extra = load_variant(stored['extra'])
+    no_extra = load_variant(stored['no_extra'])
+    comparison = (None, None)
+    if stored['comparison_id'] is not None:
+        comparison = RESULT_STORE.get(stored['comparison_id'])
+    # A variant that was not sent (routing) is None both before and after loading
+    if (extra is None) != (stored['extra'] is None) or (no_extra is None) != (stored['no_extra'] is None) or comparison is None:
+        return None
+    return {
+        'parser': stored['parser'],
+        'reused_from': stored['reused_from'],
+        'route': stored.get('route'),
+        'extra': extra,
+        'no_extra': no_extra,
+        'comparison_results': comparison[0],
+        'comparison_df': comparison[1],
+    }
+
+def retain_run_result(stored, owner):
+    """Another reference to a compact run result (e.g. for an identical document), holding its own store references."""
+    variants = [variant for variant in (stored['extra'], stored['no_extra']) if variant is not None]
+    for object_id in [variant['json_id'] for variant in variants] + [stored['comparison_id']]:
+        if object_id is not None:
+            RESULT_STORE.retain(object_id, owner)
+    return dict(stored)
 
+def release_run_result(stored, owner):
+    """Release the store references held by a compact run result."""
+    variants = [variant for variant in (stored['extra'], stored['no_extra']) if variant is not None]
+    for object_id in [variant['json_id'] for variant in variants] + [stored['comparison_id']]:
+        if object_id is not None:
+            RESULT_STORE.release(object_id, owner)
+
+def parse_variant(response, time_taken):
+    """
+    Reduce an OCR response to what the results view needs: status, parsed JSON and timing.
+    """
+    variant = {'status_code': None, 'json': None, 'time_taken': time_taken, 'error': None, 'cached': False}
+    if response is None:
+        variant['error'] = "Request failed."
+        return variant
+    variant['status_code'] = response.status_code
+    if response.status_code != 200:
+        variant['error'] = f"Request failed. Status code: {response.status_code}"
+        return variant
+    try:
+        variant['json'] = response_json(response)
+    except json.JSONDecodeError:
+        variant['error'] = "Failed to parse JSON response."
+    return variant
+
+def build_run_result(parser_name, parser_info, variant_extra, variant_no_extra, reused_from=None, route=None):
+    """
+    Build the session-state record for one OCR run, including the comparison table.
+    A variant skipped by routing is None and leaves the run without a comparison.
+    """
+    result = {
+        'parser': parser_name,
+        'extra': variant_extra,
+        'no_extra': variant_no_extra,
+        'reused_from': reused_from,
+        'route': route,
+        'comparison_results': None,
+        'comparison_df': None,
+    }
+    if variant_extra is None or variant_no_extra is None:
+        return result
+    json_extra = variant_extra['json']
+    json_no_extra = variant_no_extra['json']
+    if json_extra is not None and json_no_extra is not None:
+        comparator = get_parser_comparator(parser_info)
+        comparison_results = generate_comparison_results(json_extra, json_no_extra, comparator)
+        result['comparison_results'] = comparison_results
+        result['comparison_df'] = generate_comparison_df(
+            json_extra, json_no_extra, comparison_results,
+            similarity_threshold=parser_info.get('similarity_threshold', DEFAULT_SIMILARITY_THRESHOLD), comparator=comparator,
+        )
+    return result
+
+def timing_label(variant):
+    label = f"⏱ {variant['time_taken']:.2f}s"
+    return label + " (cached)" if variant.get('cached') else label
+
+def render_batch_result(batch):
+    """Render a batch: the per-document table, then the full results of a chosen document."""
+    st.subheader("Documents")
+    st.dataframe(pd.DataFrame(batch['rows']), hide_index=True, use_container_width=True)
+    available = [index for index, stored in enumerate(batch['results']) if stored is not None]
+    if not available:
+        return
+    index = st.selectbox("Show results for", available, format_func=lambda index: batch['rows'][index]['Document'],
+                         key="ocr_batch_document")
+    result = load_run_result(batch['results'][index])
+    if result is None:
+        st.warning("The results for this document were evicted to free server memory. Please run OCR again.")
+        return
+    render_run_result(result)
+
+def render_run_result(result):
+    """
+    Render a stored OCR run: both raw responses, then the paginated comparison grid.
+    """
+    extra = result['extra']
+    no_extra = result['no_extra']
+    if result.get('reused_from'):
+        st.info(f"Showing OCR results reused from near-duplicate {result['reused_from']}.")
+    if result.get('route'):
+        st.caption(result['route']['reason'])
+
+    # Routed to a single variant: show it alone, there is nothing to compare
+    if extra is None or no_extra is None:
+        variant, label = (extra, "Extra Accuracy") if no_extra is None else (no_extra, "Standard")
+        if variant['json'] is not None:
+            st.expander(f"Results ({label}) - {timing_label(variant)}", expanded=True).json(variant['json'])
+        else:
+            st.error(f"{label}: {variant['error']}")
+        return
+
+    if extra['status_code'] is None or no_extra['status_code'] is None:
+        return
+
+    # Display results in two columns
+    col1, col2 = st.columns(2)
+
+    with col1:
+        if extra['json'] is not None:
+            st.expander(f"Results with Extra Accuracy - {timing_label(extra)}").json(extra['json'])
+        else:
+            st.error(f"Extra Accuracy: {extra['error']}")
+
+    with col2:
+        if no_extra['json'] is not None:
+            st.expander(f"Results without Extra Accuracy - {timing_label(no_extra)}").json(no_extra['json'])
+        else:
+            st.error(f"Without Extra Accuracy: {no_extra['error']}")
+
+    if result['comparison_df'] is None:
+        st.error("Comparison failed. One or both requests were unsuccessful.")
+        return
+
+    # Display the comparison table, mismatches first; only the visible page is sent to the browser
+    st.subheader("Comparison Table")
+    render_comparison_grid(result['comparison_df'], key=f"comparison_grid_{result['parser']}")
+
+    # Offer the full comparison JSON as a download instead of rendering it inline
+    st.download_button(
+        "Download Comparison JSON",
+        data=json.dumps(result['comparison_results'], ensure_ascii=False, indent=2),
+        file_name=f"{result['parser']}_comparison.json",
+        mime="application/json",
+    )
+
+    # Memory accounting for the shared results store and this session
+    stats = RESULT_STORE.stats()
+    session_bytes = RESULT_STORE.usage_by_owner().get(get_session_id(), 0) + sum(session_footprint(st.session_state).values())
+    st.caption(
+        f"Stored results: {stats['entries']} entries, {stats['compressed_bytes'] / 2**20:.1f} MB compressed "
+        f"({stats['raw_bytes'] / 2**20:.1f} MB raw) of a {stats['budget_bytes'] / 2**20:.0f} MB budget. "
+        f"This session: {session_bytes / 2**10:.0f} KB."
+    )
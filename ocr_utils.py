@@ -7,11 +7,23 @@ import time
 import pandas as pd
 import streamlit as st
 import logging
+from align_utils import align_json
+from schema_utils import DEFAULT_COMPARATOR
+from similarity_utils import score_comparison_df, DEFAULT_SIMILARITY_THRESHOLD
+from stream_utils import MultipartEncoder, read_json_stream, guess_mime_type
+from cancel_utils import RequestCancelled
+from cassette_utils import active_cassette, request_fingerprint, MODE_REPLAY
+from hedge_utils import hedgeable
+from log_utils import configure_logging, field_logging_enabled, sample_field_detail, log_event, Timer
+from compress_utils import ACCEPT_ENCODING
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)  # Set to DEBUG for detailed logs
+# Configure logging (queued JSON lines; see log_utils.configure_logging for settings)
+configure_logging()
 logger = logging.getLogger(__name__)
 
+# Upper bound for a single OCR call (seconds); a run's deadline can only shorten it
+REQUEST_TIMEOUT = 1200
+
 def flatten_json(y, separator='__', prefix=''):
     """
     Recursively flattens a nested JSON object into a flat dictionary.
@@ -42,70 +54,62 @@ def flatten_json(y, separator='__', prefix=''):
     else:
         flat[prefix] = y
 
-    # Log the current state of the flattened JSON
-    if prefix == '':
-        logger.info("Flattened JSON Structure:")
+    # Log a sample of the flattened JSON (field-level detail is off unless sampling is enabled)
+    if prefix == '' and field_logging_enabled(logger):
         for k, v in flat.items():
-            logger.info(f"{k}: {v}")
+            if sample_field_detail():
+                logger.debug("Flattened field %s: %r", k, v)
 
     return flat
 
-def generate_comparison_results(json1, json2):
+def flatten_json_pair(json1, json2):
+    """
+    Flatten two OCR responses for comparison.
+    Arrays of records (line items) are aligned row-by-row first, so a row dropped or
+    inserted by one variant only affects that row instead of every row after it.
+    """
+    aligned1, aligned2 = align_json(json1, json2)
+    return flatten_json(aligned1), flatten_json(aligned2)
+
+def generate_comparison_results(json1, json2, comparator=None):
     """
     Generate comparison results by comparing two flattened JSON objects.
-    Handles both numerical and string comparisons.
+    Each field is compared according to the parser's compiled comparison schema
+    (see schema_utils.get_parser_comparator); without one, numbers are compared
+    numerically, `cheque_date` fields as dates and everything else as text.
     """
-    flat_json1 = flatten_json(json1)
-    flat_json2 = flatten_json(json2)
+    compare = comparator or DEFAULT_COMPARATOR
+    log_fields = field_logging_enabled(logger)
 
-    all_keys = set(flat_json1.keys()).union(set(flat_json2.keys()))
+    with Timer() as timer:
+        flat_json1, flat_json2 = flatten_json_pair(json1, json2)
 
-    comparison_results = {}
-    for key in all_keys:
-        val1 = flat_json1.get(key, "N/A")
-        val2 = flat_json2.get(key, "N/A")
+        all_keys = set(flat_json1.keys()).union(set(flat_json2.keys()))
 
-        # Log the values being compared
-        logger.debug(f"Comparing key: {key}")
-        logger.debug(f"Value with Extra Accuracy: {val1}")
-        logger.debug(f"Value without Extra Accuracy: {val2}")
-
-        # Special handling for specific fields
-        if key.endswith("cheque_date"):
-            # Example: Ensure date formats are consistent
-            try:
-                from dateutil import parser
-                date1 = parser.parse(val1).date()
-                date2 = parser.parse(val2).date()
-                match = (date1 == date2)
-                logger.debug(f"Date comparison: {date1} == {date2} -> {match}")
-            except Exception as e:
-                logger.error(f"Error parsing dates for key {key}: {e}")
-                match = False
-        else:
-            # Handle numerical comparisons
-            try:
-                val1_num = float(val1)
-                val2_num = float(val2)
-                match = (val1_num == val2_num)
-                logger.debug(f"Numerical comparison: {val1_num} == {val2_num} -> {match}")
-            except (ValueError, TypeError):
-                # Fallback to string comparison
-                val1_str = str(val1).strip().lower() if val1 is not None else ""
-                val2_str = str(val2).strip().lower() if val2 is not None else ""
-                match = (val1_str == val2_str)
-                logger.debug(f"String comparison: '{val1_str}' == '{val2_str}' -> {match}")
-
-        comparison_results[key] = "✔" if match else "✘"
+        comparison_results = {}
+        for key in all_keys:
+            val1 = flat_json1.get(key, "N/A")
+            val2 = flat_json2.get(key, "N/A")
+            match = compare(key, val1, val2)
+
+            # Log a sample of the values being compared
+            if log_fields and sample_field_detail():
+                logger.debug("Comparing key %s: %r vs %r -> %s", key, val1, val2, match)
 
+            comparison_results[key] = "✔" if match else "✘"
+
+    log_event(logger, "comparison", level=logging.DEBUG, fields=len(comparison_results),
+              mismatches=sum(1 for value in comparison_results.values() if value == "✘"), duration_ms=round(timer.ms, 1))
     return comparison_results
 
-def generate_comparison_df(json1, json2, comparison_results):
+def generate_comparison_df(json1, json2, comparison_results, similarity_threshold=DEFAULT_SIMILARITY_THRESHOLD, comparator=None):
     """
     Generate a DataFrame comparing two JSON objects.
+    A 'Similarity' column scores mismatched text fields (see similarity_utils); those scoring
+    at least `similarity_threshold` are marked "≈" (pass None to keep strict ✔/✘ only).
+    Pass the comparator used for `comparison_results` so field types come from the parser's schema.
     """
-    flat_json1 = flatten_json(json1)
-    flat_json2 = flatten_json(json2)
+    flat_json1, flat_json2 = flatten_json_pair(json1, json2)
 
     data = []
     all_keys = set(flat_json1.keys()).union(set(flat_json2.keys()))  # Union of keys from both JSONs
@@ -116,14 +120,14 @@ def generate_comparison_df(json1, json2, comparison_results):
         data.append([key, val1, val2, match])
 
     df = pd.DataFrame(data, columns=['Attribute', 'Result with Extra Accuracy', 'Result without Extra Accuracy', 'Comparison'])
-    return df
+    return score_comparison_df(df, 'Attribute', 'Result with Extra Accuracy', 'Result without Extra Accuracy', similarity_threshold, comparator)
 
-def generate_mismatch_df(json1, json2, comparison_results):
+def generate_mismatch_df(json1, json2, comparison_results, similarity_threshold=DEFAULT_SIMILARITY_THRESHOLD, comparator=None):
     """
-    Generate a DataFrame showing only the mismatched fields between the two JSONs.
+    Generate a DataFrame showing only the mismatched fields between the two JSONs,
+    with similarity scores; near matches stay in the table, marked "≈".
     """
-    flat_json1 = flatten_json(json1)
-    flat_json2 = flatten_json(json2)
+    flat_json1, flat_json2 = flatten_json_pair(json1, json2)
 
     data = []
     all_keys = set(flat_json1.keys()).union(set(flat_json2.keys()))
@@ -135,47 +139,172 @@ def generate_mismatch_df(json1, json2, comparison_results):
 
     # Create a DataFrame with only the mismatched fields
     df = pd.DataFrame(data, columns=['Field', 'Result with Extra Accuracy', 'Result without Extra Accuracy', 'Comparison'])
-    return df
+    return score_comparison_df(df, 'Field', 'Result with Extra Accuracy', 'Result without Extra Accuracy', similarity_threshold, comparator)
 
-def send_request(image_paths, headers, form_data, extra_accuracy, API_ENDPOINT):
+def response_json(response):
+    """
+    Return the parsed JSON body of an OCR response.
+    Streamed responses are parsed by send_request while the body is read; others are parsed here.
+    """
+    if hasattr(response, 'json_data'):
+        if response.json_data is None:
+            raise json.JSONDecodeError("Streamed response body is not valid JSON", "", 0)
+        return response.json_data
+    return response.json()
+
+def send_request(image_paths, headers, form_data, extra_accuracy, API_ENDPOINT, stream=False, session=None, hedge=None, cancel=None, errors=None):
     """
     Send OCR request to the API endpoint with the given parameters.
+
+    `image_paths` holds file paths or (filename, source) tuples, where source is bytes or
+    an in-memory upload such as a Streamlit UploadedFile. With `stream=True` the multipart
+    body is encoded chunk by chunk straight from those sources, so peak memory stays close
+    to a single copy of the file, and the response body is read into one buffer and parsed
+    once complete (use `response_json` to get it). Pass a `requests.Session` to reuse its connection pool.
+    Pass a `hedge_utils.HedgePolicy` (streaming only) to send a duplicate request when the
+    first one is slower than usual for this parser and keep whichever finishes first.
+    Pass a `cancel_utils.CancelToken` to bound the request by the run's deadline and abort it
+    (upload or response download) when the run is cancelled; it then returns (None, elapsed).
+    Failures are logged and shown with st.error; pass a list as `errors` to also collect their
+    messages (e.g. to report them where there is no Streamlit page).
     """
     local_headers = headers.copy()
     local_form_data = form_data.copy()
+    # OCR responses are verbose JSON; ask for them compressed (requests decodes them)
+    local_headers.setdefault('Accept-Encoding', ACCEPT_ENCODING)
 
     if extra_accuracy:
         local_form_data['extra_accuracy'] = 'true'
 
+    # Record/replay mode (see cassette_utils.active_cassette)
+    cassette = active_cassette()
+    if cassette is not None:
+        fingerprint = request_fingerprint(API_ENDPOINT, local_form_data, image_paths)
+        if cassette.mode == MODE_REPLAY:
+            response, time_taken = cassette.replay(fingerprint, API_ENDPOINT)
+            if response is None:
+                _request_error(errors, API_ENDPOINT, "No recorded OCR response matches this request (replay mode).")
+            return response, time_taken
+
+    if stream and hedge is not None and hedgeable(image_paths):
+        latency_key = (API_ENDPOINT, local_form_data.get('parserApp'), bool(extra_accuracy))
+        response, time_taken = hedge.run(
+            lambda attempt_cancel: _send_streaming_request(image_paths, local_headers, local_form_data, API_ENDPOINT, session, attempt_cancel, errors),
+            latency_key, cancel,
+        )
+    elif stream:
+        response, time_taken = _send_streaming_request(image_paths, local_headers, local_form_data, API_ENDPOINT, session, cancel, errors)
+    else:
+        response, time_taken = _send_buffered_request(image_paths, local_headers, local_form_data, API_ENDPOINT, session, cancel, errors)
+
+    if cassette is not None and response is not None:
+        cassette.record(fingerprint, response, time_taken)
+    return response, time_taken
+
+def _request_error(errors, endpoint, message):
+    """Report a failed OCR request: logged, shown in the page and added to `errors` if given."""
+    log_event(logger, "ocr_request_failed", level=logging.ERROR, endpoint=endpoint, error=message)
+    st.error(message)
+    if errors is not None:
+        errors.append(message)
+
+def _log_transfer(response):
+    """Log how the response body came over the wire (encoding and compressed size)."""
+    raw = getattr(response, 'raw', None)
+    log_event(logger, "ocr_response", level=logging.DEBUG, status=response.status_code,
+              encoding=response.headers.get('Content-Encoding', 'identity'),
+              wire_bytes=raw.tell() if hasattr(raw, 'tell') else None)
+
+def _send_buffered_request(image_paths, local_headers, local_form_data, API_ENDPOINT, session, cancel=None, errors=None):
+    """
+    Buffered variant of send_request: files are uploaded with requests' own multipart encoding.
+    `cancel` only bounds the timeout here; the body is sent in one piece.
+    """
+    if cancel is not None and cancel.is_set():
+        return None, 0
     # List of files to upload
     files = []
     for image_path in image_paths:
-        _, file_ext = os.path.splitext(image_path.lower())
-        mime_types = {
-            '.jpg': 'image/jpeg',
-            '.jpeg': 'image/jpeg',
-            '.png': 'image/png',
-            '.bmp': 'image/bmp',
-            '.gif': 'image/gif',
-            '.tiff': 'image/tiff',
-            '.pdf': 'application/pdf'
-        }
-        mime_type = mime_types.get(file_ext, 'application/octet-stream')
+        if isinstance(image_path, tuple):
+            file_name, source = image_path
+            # Send the whole upload whatever its read position (as the streaming path does)
+            if hasattr(source, 'getbuffer'):
+                source = source.getbuffer()
+            elif hasattr(source, 'seek'):
+                source.seek(0)
+            files.append(('file', (file_name, source, guess_mime_type(file_name))))
+            continue
+        mime_type = guess_mime_type(image_path)
         try:
             files.append(('file', (os.path.basename(image_path), open(image_path, 'rb'), mime_type)))
         except Exception as e:
-            st.error(f"Error opening file {image_path}: {e}")
+            _request_error(errors, API_ENDPOINT, f"Error opening file {image_path}: {e}")
             return None, 0
 
     try:
         start_time = time.time()
-        response = requests.post(API_ENDPOINT, headers=local_headers, data=local_form_data, files=files if files else None, timeout=1200)
+        timeout = cancel.timeout(REQUEST_TIMEOUT) if cancel is not None else REQUEST_TIMEOUT
+        response = (session or requests).post(API_ENDPOINT, headers=local_headers, data=local_form_data, files=files if files else None, timeout=timeout)
+        time_taken = time.time() - start_time
+        _log_transfer(response)
+        return response, time_taken
+    except requests.exceptions.RequestException as e:
+        if cancel is not None and cancel.is_set():
+            logger.info("OCR request to %s stopped: %s", API_ENDPOINT, cancel.reason)
+            return None, time.time() - start_time
+        _request_error(errors, API_ENDPOINT, f"Error in OCR request: {e}")
+        return None, 0
+    finally:
+        # Cleanup files opened here (in-memory sources belong to the caller)
+        for image_path, (_, file_tuple) in zip(image_paths, files):
+            if not isinstance(image_path, tuple):
+                file_tuple[1].close()
+
+def _send_streaming_request(image_paths, headers, form_data, API_ENDPOINT, session, cancel=None, errors=None):
+    """
+    Streaming variant of send_request: chunked multipart upload and buffered JSON parsing.
+    Cancelling `cancel` (a CancelToken) aborts the upload or the response download; its
+    deadline also bounds the request timeout.
+    """
+    files = []
+    for image_path in image_paths:
+        if isinstance(image_path, tuple):
+            file_name, source = image_path
+        else:
+            file_name, source = os.path.basename(image_path), image_path
+        files.append(('file', file_name, source, guess_mime_type(file_name)))
+
+    try:
+        encoder = MultipartEncoder(form_data, files, cancel=cancel)
+    except Exception as e:
+        _request_error(errors, API_ENDPOINT, f"Error opening files for upload: {e}")
+        return None, 0
+
+    # Per-call copy: concurrent (hedged) calls share the caller's headers
+    headers = dict(headers, **{'Content-Type': encoder.content_type})
+    start_time = time.time()
+    try:
+        if cancel is not None and cancel.is_set():
+            raise RequestCancelled(cancel.reason)
+        timeout = cancel.timeout(REQUEST_TIMEOUT) if cancel is not None else REQUEST_TIMEOUT
+        with (session or requests).post(API_ENDPOINT, headers=headers, data=encoder, timeout=timeout, stream=True) as response:
+            response.json_data = None
+            if response.status_code == 200:
+                try:
+                    response.json_data = read_json_stream(response, cancel=cancel)
+                except ValueError as e:
+                    logger.error("Error parsing streamed OCR response: %s", e)
+                _log_transfer(response)
         time_taken = time.time() - start_time
         return response, time_taken
+    except RequestCancelled:
+        logger.info("OCR request to %s cancelled after %.1fs: %s", API_ENDPOINT, time.time() - start_time, cancel.reason)
+        return None, time.time() - start_time
     except requests.exceptions.RequestException as e:
-        st.error(f"Error in OCR request: {e}")
+        if cancel is not None and cancel.is_set():
+            logger.info("OCR request to %s stopped: %s", API_ENDPOINT, cancel.reason)
+            return None, time.time() - start_time
+        _request_error(errors, API_ENDPOINT, f"Error in OCR request: {e}")
         return None, 0
     finally:
-        # Cleanup files
-        for _, file_tuple in files:
-            file_tuple[1].close()
+        encoder.close()
@@ -1,14 +1,17 @@
 import os
-import base64
 import requests
 import tempfile
 import logging
 import streamlit as st
 from urllib.parse import quote
 import json
+from schema_utils import compile_schema
+from search_utils import get_parser_index, paginate
+from similarity_utils import DEFAULT_SIMILARITY_THRESHOLD
+from state_utils import SHARED_STATE, change_parser, shared_parsers
+from compress_utils import ACCEPT_ENCODING, dump_json, load_json, write_file
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+PARSER_PAGE_SIZES = [10, 25, 50]
 
 LOCAL_PARSERS_FILE = os.path.join(tempfile.gettempdir(), 'parsers.json')
 GITHUB_API_URL = "https://api.github.com/repos/your-repo/parsers.json"  # Replace with your actual URL
@@ -16,8 +19,7 @@ GITHUB_API_URL = "https://api.github.com/repos/your-repo/parsers.json"  # Replac
 def load_parsers():
     if os.path.exists(LOCAL_PARSERS_FILE):
         try:
-            with open(LOCAL_PARSERS_FILE, 'r') as f:
-                st.session_state['parsers'] = json.load(f)
+            st.session_state['parsers'] = load_json(LOCAL_PARSERS_FILE)
             logging.info("Parsers loaded successfully.")
         except json.JSONDecodeError:
             st.error("Error decoding `parsers.json`. The file might be corrupted.")
@@ -26,21 +28,25 @@ def load_parsers():
         except Exception as e:
             st.error(f"Unexpected error loading parsers: {e}")
             st.session_state['parsers'] = {}
-            logging.error(f"Unexpected error loading parsers: {e}")
+            logging.error("Unexpected error loading parsers: %s", e)
     else:
         st.session_state['parsers'] = {}
         logging.info("No existing parsers found. Initialized with empty parsers.")
 
 def download_parsers_from_github():
-    headers = {'Authorization': f'token {st.secrets["github"]["access_token"]}'}
+    headers = {
+        'Authorization': f'token {st.secrets["github"]["access_token"]}',
+        # The raw file rather than a base64 JSON envelope, gzip-encoded in transit
+        'Accept': 'application/vnd.github.raw+json',
+        'Accept-Encoding': ACCEPT_ENCODING
+    }
     try:
         response = requests.get(GITHUB_API_URL, headers=headers, timeout=10)
         response.raise_for_status()
 
-        content = response.json().get('content')
+        content = response.content
         if content:
-            with open(LOCAL_PARSERS_FILE, 'wb') as f:
-                f.write(base64.b64decode(content))
+            write_file(LOCAL_PARSERS_FILE, content)
             load_parsers()  # Refresh the session state with the newly downloaded parsers
             st.success("`parsers.json` downloaded successfully from GitHub.")
         else:
@@ -48,16 +54,51 @@ def download_parsers_from_github():
             logging.error("Downloaded `parsers.json` is empty.")
     except Exception as e:
         st.error(f"Error: {e}")
-        logging.error(f"Error downloading parsers from GitHub: {e}")
+        logging.error("Error downloading parsers from GitHub: %s", e)
 
-def save_parsers():
+def save_parsers(parser_name, parser_info=None):
+    """Save one added (or, with no `parser_info`, deleted) parser."""
     try:
-        with open(LOCAL_PARSERS_FILE, 'w') as f:
-            json.dump(st.session_state['parsers'], f, indent=4)
+        # Applied to the shared registry as a single change, so edits made meanwhile in other
+        # sessions and replicas are kept; they pick this one up through it too
+        parsers, st.session_state['parsers_version'] = change_parser(
+            SHARED_STATE, parser_name, parser_info, base=st.session_state['parsers'])
+        # Updated in place so the session's parser index (keyed by this dict) stays valid
+        st.session_state['parsers'].clear()
+        st.session_state['parsers'].update(parsers)
+        # Stored gzip-compressed; load_parsers reads it either way
+        dump_json(st.session_state['parsers'], LOCAL_PARSERS_FILE, indent=4)
         logging.info("Parsers saved successfully.")
     except Exception as e:
         st.error(f"Error saving parsers: {e}")
-        logging.error(f"Error saving parsers: {e}")
+        logging.error("Error saving parsers: %s", e)
+
+def sync_parsers():
+    """
+    Load the shared registry into session state if another session or replica changed it.
+    Returns True if the session's parsers were replaced.
+    """
+    shared = shared_parsers(SHARED_STATE, st.session_state.get('parsers_version'))
+    if shared is None:
+        return False
+    st.session_state['parsers'], st.session_state['parsers_version'] = shared
+    # Keep the local copy (the one uploaded to GitHub) in step
+    try:
+        dump_json(st.session_state['parsers'], LOCAL_PARSERS_FILE, indent=4)
+    except Exception as e:
+        logging.error("Error writing shared parsers locally: %s", e)
+    return True
+
+def is_valid_comparison_schema(schema_text):
+    """Check that a comparison schema is a JSON object that compiles."""
+    try:
+        schema = json.loads(schema_text)
+        if not isinstance(schema, dict):
+            return False
+        compile_schema(schema)
+        return True
+    except (json.JSONDecodeError, ValueError, TypeError, AttributeError):
+        return False
 
 def add_new_parser():
     st.subheader("Add a New Parser")
@@ -68,6 +109,15 @@ def add_new_parser():
         extra_accuracy = st.checkbox("Require Extra Accuracy")
         expected_response = st.text_area("Expected JSON Response (optional)")
         sample_curl = st.text_area("Sample CURL Request (optional)")
+        comparison_schema = st.text_area(
+            "Comparison Schema (optional)",
+            help='JSON mapping field paths or names to number, date, amount_words or text, e.g. {"items__*__amount": {"type": "number", "tolerance": 0.01}}. Types not listed are inferred from the expected response.'
+        )
+
+        similarity_threshold = st.slider(
+            "Near-match Similarity Threshold", min_value=0.5, max_value=1.0, value=DEFAULT_SIMILARITY_THRESHOLD, step=0.01,
+            help="Mismatched text fields at least this similar (case, punctuation and word order aside) are shown as near matches (≈)."
+        )
 
         submitted = st.form_submit_button("Add Parser")
         if submitted:
@@ -75,15 +125,21 @@ def add_new_parser():
                 st.error("Please fill in all required fields.")
             elif parser_name in st.session_state['parsers']:
                 st.error(f"Parser '{parser_name}' already exists.")
+            elif comparison_schema.strip() and not is_valid_comparison_schema(comparison_schema):
+                st.error("Comparison Schema must be a JSON object mapping fields to number, date, amount_words or text.")
             else:
+                index = get_parser_index(st.session_state['parsers'])
                 st.session_state['parsers'][parser_name] = {
                     'api_key': api_key,
                     'parser_app_id': parser_app_id,
                     'extra_accuracy': extra_accuracy,
                     'expected_response': expected_response,
-                    'sample_curl': sample_curl
+                    'sample_curl': sample_curl,
+                    'comparison_schema': json.loads(comparison_schema) if comparison_schema.strip() else {},
+                    'similarity_threshold': similarity_threshold
                 }
-                save_parsers()
+                index.add(parser_name, st.session_state['parsers'][parser_name])
+                save_parsers(parser_name, st.session_state['parsers'][parser_name])
                 st.success("The parser has been added successfully.")
 
 def list_parsers():
@@ -92,23 +148,33 @@ def list_parsers():
         st.info("No parsers available. Please add a parser first.")
         return
 
-    # Count parser_app_id occurrences for dynamic numbering
-    app_id_count = {}
-    for parser_name, details in st.session_state['parsers'].items():
-        app_id = details['parser_app_id']
-        if app_id in app_id_count:
-            app_id_count[app_id] += 1
-        else:
-            app_id_count[app_id] = 1
+    # Search index (maintained on add / delete) with per-app-id counts for dynamic numbering
+    index = get_parser_index(st.session_state['parsers'])
+
+    col1, col2, col3 = st.columns([3, 1, 1])
+    with col1:
+        query = st.text_input("Search parsers", placeholder="Name, app id or API key prefix", key="parser_search")
+    with col2:
+        page_size = st.selectbox("Per page", PARSER_PAGE_SIZES, key="parser_page_size")
+    with col3:
+        page = st.number_input("Page", min_value=1, value=1, step=1, key="parser_page")
+
+    # Only the current page of matches is rendered
+    matches = index.search(query)
+    page_names, page, total_pages = paginate(matches, page, page_size)
+    if not matches:
+        st.info("No parsers match your search.")
+        return
+    st.caption(f"Showing {len(page_names)} of {len(matches)} matching parsers ({len(index)} in total) - page {page} of {total_pages}")
 
-    # Iterate over the parsers and display details
-    for parser_name, details in st.session_state['parsers'].items():
+    for parser_name in page_names:
+        details = st.session_state['parsers'][parser_name]
         with st.expander(parser_name):
             st.write(f"**API Key:** {details['api_key']}")
             st.write(f"**Parser App ID:** {details['parser_app_id']}")
             st.write(f"**Extra Accuracy:** {'Yes' if details['extra_accuracy'] else 'No'}")
 
-            app_id_num = app_id_count[details['parser_app_id']]  # Get the number associated with parser_app_id
+            app_id_num = index.app_id_count(details['parser_app_id'])  # Get the number associated with parser_app_id
             parser_page_link = f"https://fracto-ocr.streamlit.app/?parser={quote(parser_name)}&client=true&id={app_id_num}"
 
             # Generate and display link button
@@ -118,7 +184,8 @@ def list_parsers():
             # Add Delete button
             if st.button(f"Delete {parser_name}", key=f"delete_{parser_name}"):
                 del st.session_state['parsers'][parser_name]
-                save_parsers()
+                index.remove(parser_name)
+                save_parsers(parser_name)
                 st.success(f"Parser '{parser_name}' has been deleted.")
 
 # Initialize session state
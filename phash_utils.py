@@ -0,0 +1,140 @@
+# phash_utils.py
+
+import io
+import time
+import threading
+import logging
+import numpy as np
+from PIL import Image
+from preview_utils import render_pdf_first_page
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 8
+HIGHFREQ_FACTOR = 4
+DEFAULT_MAX_DISTANCE = 6
+MAX_ENTRIES_PER_PARSER = 5000
+
+def _dct_matrix(n):
+    """Orthonormal DCT-II basis, so dct2(x) = D @ x @ D.T."""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+_DCT = _dct_matrix(HASH_SIZE * HIGHFREQ_FACTOR)
+
+def phash_image(image):
+    """
+    Perceptual hash (pHash) of a PIL image as a 64-bit int.
+    The image is reduced to 32x32 grayscale, transformed with a 2D DCT, and the 8x8
+    lowest frequencies are thresholded at their median, so re-scans and JPEG
+    re-encodes of the same document land within a few bits of each other.
+    """
+    size = HASH_SIZE * HIGHFREQ_FACTOR
+    pixels = np.asarray(image.convert("L").resize((size, size), Image.LANCZOS), dtype=np.float64)
+    low_freq = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE]
+    bits = (low_freq > np.median(low_freq)).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+def fingerprint_upload(source, filename):
+    """
+    Perceptual hash of an uploaded image or PDF (first page).
+    `source` is bytes or a BytesIO such as a Streamlit UploadedFile.
+    Returns None if the file cannot be decoded.
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    try:
+        source.seek(0)
+        if filename.lower().endswith(".pdf"):
+            image = render_pdf_first_page(source)
+        else:
+            image = Image.open(source)
+        return phash_image(image)
+    except Exception as e:
+        logger.warning("Could not fingerprint %s: %s", filename, e)
+        return None
+    finally:
+        source.seek(0)
+
+def hamming_distance(hash1, hash2):
+    return (hash1 ^ hash2).bit_count()
+
+class BKTree:
+    """
+    Burkhard-Keller tree over 64-bit hashes with Hamming distance.
+    Lookups only descend into children whose edge distance is within the search
+    radius of the query's distance to the node (triangle inequality).
+    """
+
+    def __init__(self):
+        self.root = None  # [hash, value, {distance: child}]
+        self.size = 0
+
+    def add(self, hash_value, value):
+        node = [hash_value, value, {}]
+        self.size += 1
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = hamming_distance(hash_value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, hash_value, max_distance):
+        """Return [(distance, value)] for every entry within max_distance, closest first."""
+        matches = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(hash_value, node[0])
+            if distance <= max_distance:
+                matches.append((distance, node[1]))
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+class NearDuplicateIndex:
+    """
+    Per-parser index of processed documents by perceptual hash, shared by all sessions.
+    When a parser exceeds max_entries the oldest half is dropped and its tree rebuilt.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES_PER_PARSER):
+        self.max_entries = max_entries
+        self._entries = {}
+        self._trees = {}
+        self._lock = threading.Lock()
+
+    def find(self, parser_key, hash_value, max_distance=DEFAULT_MAX_DISTANCE):
+        """Return (distance, record) for the closest prior document, or None."""
+        with self._lock:
+            tree = self._trees.get(parser_key)
+            matches = tree.search(hash_value, max_distance) if tree else []
+        return matches[0] if matches else None
+
+    def add(self, parser_key, hash_value, name, results, session_id=None):
+        record = {'hash': hash_value, 'name': name, 'results': results, 'timestamp': time.time(), 'session_id': session_id}
+        with self._lock:
+            entries = self._entries.setdefault(parser_key, [])
+            entries.append(record)
+            if len(entries) > self.max_entries:
+                del entries[:len(entries) // 2]
+                tree = BKTree()
+                for entry in entries:
+                    tree.add(entry['hash'], entry)
+                self._trees[parser_key] = tree
+            else:
+                self._trees.setdefault(parser_key, BKTree()).add(hash_value, record)
+        return record
+
+DUPLICATE_INDEX = NearDuplicateIndex()
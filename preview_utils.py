@@ -0,0 +1,72 @@
+# preview_utils.py
+
+import io
+import threading
+import logging
+import fitz  # PyMuPDF
+from PIL import Image
+from cachetools import LRUCache
+from stream_utils import source_digest
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_MAX_SIZE = (800, 800)
+PREVIEW_JPEG_QUALITY = 80
+PDF_PREVIEW_DPI = 72
+# Total bytes of JPEG thumbnails kept in memory across all sessions
+PREVIEW_CACHE_BYTES = 64 * 1024 * 1024
+
+def render_pdf_first_page(source, dpi=PDF_PREVIEW_DPI):
+    """Render the first page of a PDF (bytes or a BytesIO) as a PIL image."""
+    with fitz.open(stream=source, filetype="pdf") as document:
+        pixmap = document[0].get_pixmap(dpi=dpi)
+        return Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+
+def make_thumbnail(source, filename, max_size=PREVIEW_MAX_SIZE, quality=PREVIEW_JPEG_QUALITY):
+    """
+    Return JPEG bytes of a bounded-size preview for an image or PDF (first page).
+    Large images are decoded with draft mode where possible, so the full-resolution
+    bitmap is never materialized.
+    """
+    source.seek(0)
+    try:
+        if filename.lower().endswith(".pdf"):
+            image = render_pdf_first_page(source)
+        else:
+            image = Image.open(source)
+            image.draft("RGB", max_size)
+        image = image.convert("RGB")
+        image.thumbnail(max_size)
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+        return output.getvalue()
+    finally:
+        source.seek(0)
+
+class PreviewCache:
+    """
+    Thumbnails keyed by file content hash, shared by all sessions.
+    Evicts least recently used thumbnails once their total size exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes=PREVIEW_CACHE_BYTES):
+        self._cache = LRUCache(maxsize=max_bytes, getsizeof=len)
+        self._lock = threading.Lock()
+
+    def get_preview(self, source, filename):
+        """Return cached JPEG preview bytes for an upload, creating them on first use; None if it can't be decoded."""
+        key = source_digest(source)
+        with self._lock:
+            preview = self._cache.get(key)
+        if preview is not None:
+            return preview
+        try:
+            preview = make_thumbnail(source, filename)
+        except Exception as e:
+            logger.warning("Could not create a preview for %s: %s", filename, e)
+            return None
+        with self._lock:
+            self._cache[key] = preview
+        return preview
+
+PREVIEW_CACHE = PreviewCache()
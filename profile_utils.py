@@ -0,0 +1,140 @@
+# profile_utils.py
+
+import io
+import time
+import pstats
+import marshal
+import zipfile
+import cProfile
+import threading
+import tracemalloc
+from contextlib import contextmanager
+import pandas as pd
+import streamlit as st
+
+TOP_FUNCTIONS = 25
+TOP_ALLOCATIONS = 20
+TRACEMALLOC_FRAMES = 10
+
+# Functions called out separately in the report (matched by function name). cProfile only
+# sees the script thread, so the OCR requests (sent from worker threads) are not listed;
+# their time shows in the run's wall time and in the per-variant timings.
+FOCUS_FUNCTIONS = (
+    'flatten_json', 'flatten_json_pair', 'align_json', 'align_records',
+    'generate_comparison_results', 'generate_comparison_df', 'generate_mismatch_df',
+    'build_run_result', 'render_comparison_grid', 'from_dataframe', 'AgGrid',
+)
+
+# tracemalloc is process-wide, so one profiled run at a time
+_PROFILE_LOCK = threading.Lock()
+
+class ProfileReport:
+    """cProfile statistics and tracemalloc snapshot for one profiled run."""
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.profiler = cProfile.Profile() if enabled else None
+        self.snapshot = None
+        self.wall_time = 0.0
+        self.peak_memory = 0
+
+    def stats(self):
+        return pstats.Stats(self.profiler)
+
+    def function_table(self, focus_only=False, limit=TOP_FUNCTIONS):
+        """Top functions by cumulative time as a DataFrame."""
+        rows = []
+        for (filename, line, name), (primitive_calls, calls, total_time, cumulative_time, _) in self.stats().stats.items():
+            if focus_only and name not in FOCUS_FUNCTIONS:
+                continue
+            rows.append({
+                'Function': name,
+                'Location': f"{filename}:{line}",
+                'Calls': calls,
+                'Own time (s)': round(total_time, 4),
+                'Cumulative time (s)': round(cumulative_time, 4),
+            })
+        df = pd.DataFrame(rows, columns=['Function', 'Location', 'Calls', 'Own time (s)', 'Cumulative time (s)'])
+        return df.sort_values('Cumulative time (s)', ascending=False).head(limit).reset_index(drop=True)
+
+    def allocation_table(self, limit=TOP_ALLOCATIONS):
+        """Top allocation sites still alive at the end of the run, as a DataFrame."""
+        rows = []
+        for stat in self.snapshot.statistics('lineno')[:limit]:
+            frame = stat.traceback[0]
+            rows.append({'Site': f"{frame.filename}:{frame.lineno}", 'Size (KB)': round(stat.size / 1024, 1), 'Blocks': stat.count})
+        return pd.DataFrame(rows, columns=['Site', 'Size (KB)', 'Blocks'])
+
+    def text_report(self):
+        """Full plain-text report: all functions by cumulative time and the top allocation tracebacks."""
+        out = io.StringIO()
+        out.write(f"Wall time: {self.wall_time:.3f}s\nPeak traced memory: {self.peak_memory / 2**20:.1f} MB\n\n")
+        out.write("=== cProfile (sorted by cumulative time) ===\n")
+        pstats.Stats(self.profiler, stream=out).sort_stats('cumulative').print_stats()
+        out.write("\n=== tracemalloc: top allocation sites ===\n")
+        for stat in self.snapshot.statistics('traceback')[:50]:
+            out.write(f"\n{stat.size / 1024:.1f} KB in {stat.count} blocks\n")
+            out.write("\n".join(stat.traceback.format()) + "\n")
+        return out.getvalue()
+
+    def archive(self):
+        """Zip with the raw cProfile data (profile.prof, loadable with pstats/snakeviz) and the text report."""
+        buffer = io.BytesIO()
+        profile_stats = self.stats()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('profile.prof', marshal.dumps(profile_stats.stats))
+            archive.writestr('report.txt', self.text_report())
+        return buffer.getvalue()
+
+@contextmanager
+def profile_run(enabled=True):
+    """
+    Profile the enclosed block with cProfile and tracemalloc.
+    Yields a ProfileReport, which is only filled in when `enabled` and no other session's
+    run is being profiled.
+    """
+    if enabled and not _PROFILE_LOCK.acquire(blocking=False):
+        st.warning("Another run is being profiled on this server; this run is not profiled.")
+        enabled = False
+    report = ProfileReport(enabled)
+    if not enabled:
+        yield report
+        return
+    try:
+        with _traced(report):
+            yield report
+    finally:
+        _PROFILE_LOCK.release()
+
+@contextmanager
+def _traced(report):
+    already_tracing = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    report.profiler.enable()
+    try:
+        yield report
+    finally:
+        report.profiler.disable()
+        report.wall_time = time.perf_counter() - start
+        report.peak_memory = tracemalloc.get_traced_memory()[1]
+        report.snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        if not already_tracing:
+            tracemalloc.stop()
+
+def render_profile_report(report, file_name="ocr_profile.zip"):
+    """Show the top functions and allocation sites of a profiled run, with the full report as a download."""
+    st.subheader("Profile")
+    st.write(f"**Wall time:** {report.wall_time:.2f}s  |  **Peak traced memory:** {report.peak_memory / 2**20:.1f} MB")
+    st.markdown("**Comparison and rendering functions**")
+    st.dataframe(report.function_table(focus_only=True), use_container_width=True)
+    st.markdown("**Top functions by cumulative time**")
+    st.dataframe(report.function_table(), use_container_width=True)
+    st.markdown("**Top allocation sites**")
+    st.dataframe(report.allocation_table(), use_container_width=True)
+    st.download_button("Download Full Profile", data=report.archive(), file_name=file_name, mime="application/zip")
@@ -1,6 +1,6 @@
 import streamlit as st
 from github_utils import download_parsers_from_github, upload_parsers_to_github
-from parser_utils import add_new_parser, list_parsers
+from parser_utils import add_new_parser, list_parsers, sync_parsers
 from ocr_runner import run_parser
 from urllib.parse import parse_qs
 
@@ -21,10 +21,15 @@ def main():
     requested_parser = query_params.get("parser", [None])[0]
     client_view = query_params.get("client", [False])[0]
 
-    # Ensure parsers are loaded once when the app starts
+    # Ensure parsers are loaded once when the app starts; a registry already shared by
+    # another session or replica is used instead of downloading it again
     if 'loaded' not in st.session_state:
-        download_parsers_from_github()
+        if not sync_parsers():
+            download_parsers_from_github()
         st.session_state.loaded = True
+    else:
+        # Pick up parsers added or deleted in other sessions and replicas
+        sync_parsers()
 
     # Client View: Display the Run Parser page for a specific parser (password-free)
     if client_view and requested_parser:
@@ -0,0 +1,63 @@
+# routing_utils.py
+#
+# History-driven routing: for parsers whose extra-accuracy and standard results nearly
+# always agree, only one variant is sent; a sample of runs still sends both (shadow runs)
+# so the recorded comparison history keeps tracking drift.
+
+import os
+import random
+import logging
+
+logger = logging.getLogger(__name__)
+
+ROUTE_BOTH = "both"
+ROUTE_EXTRA = "extra"
+ROUTE_STANDARD = "standard"
+
+# Share of single-variant runs that still send both variants to monitor drift
+DEFAULT_SHADOW_RATE = float(os.environ.get("OCR_SHADOW_RATE", "0.1"))
+# Compared runs needed before a parser is routed to a single variant
+MIN_DOCUMENTS = 30
+# Share of recent compared runs in which every field agreed
+MIN_AGREEMENT = 0.98
+# Number of most recent compared runs considered
+HISTORY_WINDOW = 200
+
+def parser_history_stats(history, parser_name, window=HISTORY_WINDOW):
+    """Agreement and median latency per mode over the parser's recent compared runs."""
+    runs = history.recent_runs(parser_name, window)
+    runs = runs[runs['time_extra'].notna() & runs['time_standard'].notna()]
+    if runs.empty:
+        return {'documents': 0, 'agreement': None, 'time_extra': None, 'time_standard': None}
+    return {
+        'documents': len(runs),
+        'agreement': float((runs['mismatches'] == 0).mean()),
+        'time_extra': float(runs['time_extra'].median()),
+        'time_standard': float(runs['time_standard'].median()),
+    }
+
+def decide_route(history, parser_name, shadow_rate=DEFAULT_SHADOW_RATE, min_documents=MIN_DOCUMENTS,
+                 min_agreement=MIN_AGREEMENT, window=HISTORY_WINDOW):
+    """
+    Decide which variants to send for the next run of a parser.
+    Returns {'route', 'shadow', 'reason', 'stats'}: `route` is ROUTE_BOTH, or the single
+    (faster) variant when the recent history shows both modes agree; `shadow` marks a
+    sampled run that sends both variants although the parser is routed to one.
+    """
+    stats = parser_history_stats(history, parser_name, window)
+    if stats['documents'] < min_documents:
+        reason = f"Only {stats['documents']} compared runs recorded (need {min_documents})."
+        return {'route': ROUTE_BOTH, 'shadow': False, 'reason': reason, 'stats': stats}
+    if stats['agreement'] < min_agreement:
+        reason = f"Modes agreed on {stats['agreement']:.1%} of the last {stats['documents']} runs (need {min_agreement:.0%})."
+        return {'route': ROUTE_BOTH, 'shadow': False, 'reason': reason, 'stats': stats}
+
+    route = ROUTE_STANDARD if stats['time_standard'] < stats['time_extra'] else ROUTE_EXTRA
+    if random.random() < shadow_rate:
+        reason = f"Shadow run: both variants sent to monitor agreement ({stats['agreement']:.1%} over {stats['documents']} runs)."
+        return {'route': ROUTE_BOTH, 'shadow': True, 'reason': reason, 'stats': stats}
+    label = "standard" if route == ROUTE_STANDARD else "extra accuracy"
+    reason = (f"Only the {label} variant was sent: the modes agreed on {stats['agreement']:.1%} of the last "
+              f"{stats['documents']} runs and it is faster (median {min(stats['time_extra'], stats['time_standard']):.2f}s).")
+    logger.debug("Routing %s to %s", parser_name, route)
+    return {'route': route, 'shadow': False, 'reason': reason, 'stats': stats}
@@ -0,0 +1,271 @@
+# schema_utils.py
+
+import re
+import json
+import logging
+from functools import lru_cache
+from dateutil import parser as date_parser
+
+logger = logging.getLogger(__name__)
+
+SEPARATOR = '__'
+WILDCARD = '*'
+
+# Values treated as "no value" by every comparison, on both sides
+NULL_EQUIVALENTS = frozenset(["", "n/a", "null"])
+
+FIELD_TYPES = ("number", "date", "amount_words", "text")
+
+# Fields compared specially even when a parser declares no schema
+DEFAULT_SCHEMA = {
+    "cheque_date": "date",
+}
+
+_NUMBER_RE = re.compile(r'^\s*[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?\s*$')
+_GROUPED_NUMBER_RE = re.compile(r'^\s*[-+]?(\d{1,3}(,\d{2,3})+|\d+)(\.\d+)?\s*$')
+_DATE_RE = re.compile(r'^\s*(\d{1,4}[-/.]\d{1,2}[-/.]\d{1,4}|\d{1,2}\s+[A-Za-z]{3,9},?\s+\d{2,4}|[A-Za-z]{3,9}\s+\d{1,2},?\s+\d{2,4})\s*$')
+_AMOUNT_WORDS_FILLER = frozenset(["rupee", "rupees", "rs", "inr", "paise", "only", "and"])
+_NUMBER_WORDS = frozenset("""
+    zero one two three four five six seven eight nine ten eleven twelve thirteen fourteen fifteen
+    sixteen seventeen eighteen nineteen twenty thirty forty fifty sixty seventy eighty ninety
+    hundred thousand lakh lakhs crore crores million billion
+""".split())
+_AMOUNT_WORDS_MIN_SHARE = 0.8
+_LETTER_RE = re.compile(r'[^\W\d_]')
+
+def normalize_text(value):
+    """Normalize a value for text comparison: None becomes '', otherwise stripped and lowercased."""
+    return str(value).strip().lower() if value is not None else ""
+
+def is_null(value):
+    """True if the value is one of the null equivalents ('', 'N/A', 'null', None)."""
+    return normalize_text(value) in NULL_EQUIVALENTS
+
+def fields_equal_text(value1, value2):
+    """Text equality where all null equivalents compare equal to each other."""
+    normalized1 = normalize_text(value1)
+    normalized2 = normalize_text(value2)
+    return (normalized1 in NULL_EQUIVALENTS and normalized2 in NULL_EQUIVALENTS) or normalized1 == normalized2
+
+def _to_number(value, grouped=False):
+    """Return the value as a float, or None if it is not numeric. Never raises."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        if _NUMBER_RE.match(value):
+            return float(value)
+        if grouped and _GROUPED_NUMBER_RE.match(value):
+            return float(value.replace(',', ''))
+    return None
+
+@lru_cache(maxsize=4096)
+def _parse_date(value):
+    try:
+        return date_parser.parse(value).date()
+    except (ValueError, OverflowError):
+        return None
+
+def _amount_words(value):
+    return re.sub(r'[^a-z0-9]+', ' ', normalize_text(value)).split()
+
+def _normalize_amount_words(value):
+    """Drop currency/filler words; digits are kept so 'Rs 500 only' and 'Rs 5000 only' still differ."""
+    return " ".join(word for word in _amount_words(value) if word not in _AMOUNT_WORDS_FILLER)
+
+def _is_amount_words(value):
+    """True when the value is mostly number words, e.g. 'Rupees Five Thousand Only'."""
+    words = _amount_words(value)
+    number_words = sum(word in _NUMBER_WORDS for word in words)
+    filler_words = sum(word in _AMOUNT_WORDS_FILLER for word in words)
+    return number_words > 0 and number_words + filler_words >= _AMOUNT_WORDS_MIN_SHARE * len(words)
+
+def _make_number_comparator(tolerance=0.0):
+    def compare(value1, value2):
+        number1 = _to_number(value1, grouped=True)
+        number2 = _to_number(value2, grouped=True)
+        if number1 is None or number2 is None:
+            return fields_equal_text(value1, value2)
+        return abs(number1 - number2) <= tolerance
+    return compare
+
+def _compare_date(value1, value2):
+    if is_null(value1) or is_null(value2):
+        return fields_equal_text(value1, value2)
+    date1 = _parse_date(str(value1))
+    date2 = _parse_date(str(value2))
+    if date1 is None or date2 is None:
+        return fields_equal_text(value1, value2)
+    return date1 == date2
+
+def _compare_amount_words(value1, value2):
+    return fields_equal_text(value1, value2) or _normalize_amount_words(value1) == _normalize_amount_words(value2)
+
+def _compare_default(value1, value2):
+    """Numeric comparison when both values are numbers, text comparison otherwise."""
+    number1 = _to_number(value1)
+    number2 = _to_number(value2)
+    if number1 is not None and number2 is not None:
+        return number1 == number2
+    return fields_equal_text(value1, value2)
+
+def _field_comparator(spec):
+    """
+    Build (comparison function, field type) for one schema entry ("number" or
+    {"type": "number", "tolerance": 0.5}).
+    """
+    if isinstance(spec, str):
+        spec = {"type": spec}
+    field_type = spec.get("type", "text")
+    if field_type == "number":
+        return _make_number_comparator(float(spec.get("tolerance", 0.0))), field_type
+    if field_type == "date":
+        return _compare_date, field_type
+    if field_type == "amount_words":
+        return _compare_amount_words, field_type
+    if field_type == "text":
+        return fields_equal_text, field_type
+    raise ValueError(f"Unknown field type '{field_type}'. Expected one of: {', '.join(FIELD_TYPES)}")
+
+def generalize_key(key):
+    """Replace list positions / numeric row identifiers in a flattened key with '*'."""
+    return SEPARATOR.join(WILDCARD if segment.isdigit() else segment for segment in key.split(SEPARATOR))
+
+def compile_schema(schema):
+    """
+    Compile a schema into a comparator `compare(key, value1, value2) -> bool`.
+
+    Schema keys are flattened field paths ('items__*__amount'), or bare field names
+    ('cheque_date') that apply wherever that field appears. The field type for each
+    flattened key is resolved once and memoized, so comparing a document is a dict
+    lookup plus a direct call per field. `compare.field_type(key, value1, value2)`
+    returns the type a pair of values is compared as (see below).
+    """
+    exact = {}
+    by_leaf = {}
+    for pattern, spec in (schema or {}).items():
+        entry = _field_comparator(spec)
+        if SEPARATOR in pattern:
+            exact[pattern] = entry
+        else:
+            by_leaf[pattern] = entry
+    resolved = {}
+
+    def resolve(key):
+        entry = exact.get(key) or exact.get(generalize_key(key)) or by_leaf.get(key.rsplit(SEPARATOR, 1)[-1]) or (_compare_default, None)
+        resolved[key] = entry
+        return entry
+
+    def compare(key, value1, value2):
+        if is_null(value1) and is_null(value2):
+            return True
+        comparator, _ = resolved.get(key) or resolve(key)
+        return comparator(value1, value2)
+
+    def field_type(key, value1, value2):
+        """
+        The schema type of a field, or for fields the schema does not cover, "text" when
+        both values are words (not numbers, dates, amounts or bare symbols) and None otherwise.
+        """
+        _, declared = resolved.get(key) or resolve(key)
+        if declared is not None:
+            return declared
+        return "text" if _is_text_value(key, value1) and _is_text_value(key, value2) else None
+
+    compare.field_type = field_type
+    return compare
+
+def _infer_field_type(key, value):
+    """Infer a schema entry from an example value in expected_response."""
+    leaf = key.rsplit(SEPARATOR, 1)[-1].lower()
+    if isinstance(value, bool):
+        return "text"
+    if isinstance(value, (int, float)):
+        return "number"
+    if not isinstance(value, str) or is_null(value):
+        return None
+    if leaf == "date" or leaf.endswith("_date") or _DATE_RE.match(value):
+        return "date"
+    if "words" in leaf or _is_amount_words(value):
+        return "amount_words"
+    if _to_number(value, grouped=True) is not None:
+        return "number"
+    return "text"
+
+def _is_text_value(key, value):
+    return isinstance(value, str) and _infer_field_type(key, value) == "text" and _LETTER_RE.search(value) is not None
+
+def _flatten_schema_example(value, prefix=''):
+    """Flatten an example document, keying every list item with '*'."""
+    flat = {}
+    if isinstance(value, dict):
+        for key, item in value.items():
+            flat.update(_flatten_schema_example(item, f"{prefix}{SEPARATOR}{key}" if prefix else key))
+    elif isinstance(value, list):
+        for item in value:
+            flat.update(_flatten_schema_example(item, f"{prefix}{SEPARATOR}{WILDCARD}" if prefix else WILDCARD))
+    else:
+        flat[prefix] = value
+    return flat
+
+def infer_schema(expected_response):
+    """
+    Infer a schema from a parser's expected_response (a JSON string or an already-parsed object).
+    Fields with no usable example value are left out and fall back to the default comparison.
+    """
+    if isinstance(expected_response, str):
+        if not expected_response.strip():
+            return {}
+        try:
+            expected_response = json.loads(expected_response)
+        except json.JSONDecodeError:
+            logger.warning("expected_response is not valid JSON; no comparison schema inferred.")
+            return {}
+    schema = {}
+    for key, value in _flatten_schema_example(expected_response).items():
+        field_type = _infer_field_type(key, value)
+        if field_type:
+            schema[key] = field_type
+    return schema
+
+@lru_cache(maxsize=256)
+def _compile_parser_schema(expected_response, explicit_schema_json):
+    schema = dict(DEFAULT_SCHEMA)
+    schema.update(infer_schema(expected_response))
+    schema.update(json.loads(explicit_schema_json))
+    return compile_schema(schema)
+
+def _explicit_schema(parser_info):
+    """A parser's `comparison_schema` as a dict; raises ValueError/TypeError if it is malformed."""
+    explicit_schema = parser_info.get('comparison_schema') or {}
+    if isinstance(explicit_schema, str):
+        explicit_schema = json.loads(explicit_schema) if explicit_schema.strip() else {}
+    if not isinstance(explicit_schema, dict):
+        raise TypeError("comparison_schema must be a JSON object")
+    return explicit_schema
+
+def comparison_schema_error(parser_info):
+    """Why a parser's `comparison_schema` cannot be used, or None if it is valid (or absent)."""
+    try:
+        compile_schema(_explicit_schema(parser_info or {}))
+    except (ValueError, TypeError, AttributeError) as e:
+        return str(e) or type(e).__name__
+    return None
+
+def get_parser_comparator(parser_info):
+    """
+    Return the compiled comparator for a parser.
+    Explicit `comparison_schema` entries override types inferred from `expected_response`,
+    which override the defaults. Compiled comparators are cached per schema. A malformed
+    `comparison_schema` (e.g. edited by hand in the GitHub copy) is ignored with a warning.
+    """
+    parser_info = parser_info or {}
+    expected_response = parser_info.get('expected_response') or ""
+    if not isinstance(expected_response, str):
+        expected_response = json.dumps(expected_response, sort_keys=True)
+    try:
+        return _compile_parser_schema(expected_response, json.dumps(_explicit_schema(parser_info), sort_keys=True))
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.warning("Ignoring invalid comparison_schema: %s", e)
+        return _compile_parser_schema(expected_response, "{}")
+
+DEFAULT_COMPARATOR = compile_schema(DEFAULT_SCHEMA)
@@ -0,0 +1,122 @@
+# search_utils.py
+
+import re
+import bisect
+import streamlit as st
+
+# Prefixes longer than this are not indexed; longer query terms are matched on their prefix
+MAX_PREFIX = 24
+# Only this much of an API key is searchable (the rest of the secret is never indexed)
+API_KEY_PREFIX = 8
+
+def _terms(text):
+    """Lower-cased word terms of a name or query ('Kores Cheque-Front' -> ['kores', 'cheque', 'front'])."""
+    return [term for term in re.split(r'[^0-9a-z]+', str(text).lower()) if term]
+
+def _prefixes(term, limit=MAX_PREFIX):
+    return [term[:length] for length in range(1, min(len(term), limit) + 1)]
+
+class ParserIndex:
+    """
+    In-memory search index over the parser registry, updated incrementally on add and remove.
+
+    Every word of a parser name, its app id and the first API_KEY_PREFIX characters of its
+    API key are indexed by prefix, so a search is one dict lookup per query term. Names are
+    also kept sorted, so a page of results is a slice rather than a sort of the registry.
+    """
+
+    def __init__(self, parsers=None):
+        self._prefixes = {}
+        self._keys = {}
+        self._sorted_names = []
+        self._app_id_count = {}
+        for name, details in (parsers or {}).items():
+            self.add(name, details)
+
+    def __len__(self):
+        return len(self._sorted_names)
+
+    def __contains__(self, name):
+        return name in self._keys
+
+    def _index_keys(self, name, details):
+        keys = set()
+        for term in _terms(name):
+            keys.update(_prefixes(term))
+        app_id = str(details.get('parser_app_id', '')).lower()
+        if app_id:
+            keys.update(_prefixes(app_id))
+            keys.update(prefix for term in _terms(app_id) for prefix in _prefixes(term))
+        api_key = str(details.get('api_key', '')).lower()[:API_KEY_PREFIX]
+        if api_key:
+            keys.update(_prefixes(api_key))
+        return keys
+
+    def add(self, name, details):
+        """Index a parser (re-indexes it if it is already present)."""
+        if name in self._keys:
+            self.remove(name)
+        keys = self._index_keys(name, details)
+        for key in keys:
+            self._prefixes.setdefault(key, set()).add(name)
+        self._keys[name] = (keys, details.get('parser_app_id'))
+        bisect.insort(self._sorted_names, name)
+        app_id = details.get('parser_app_id')
+        self._app_id_count[app_id] = self._app_id_count.get(app_id, 0) + 1
+
+    def remove(self, name):
+        """Drop a parser from the index; unknown names are ignored."""
+        entry = self._keys.pop(name, None)
+        if entry is None:
+            return
+        keys, app_id = entry
+        for key in keys:
+            names = self._prefixes.get(key)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del self._prefixes[key]
+        position = bisect.bisect_left(self._sorted_names, name)
+        if position < len(self._sorted_names) and self._sorted_names[position] == name:
+            del self._sorted_names[position]
+        self._app_id_count[app_id] -= 1
+        if not self._app_id_count[app_id]:
+            del self._app_id_count[app_id]
+
+    def app_id_count(self, app_id):
+        """Number of parsers sharing an app id."""
+        return self._app_id_count.get(app_id, 0)
+
+    def search(self, query):
+        """Sorted names of parsers matching every term of the query (all parsers for an empty query)."""
+        query = str(query or '').strip().lower()
+        if not query:
+            return self._sorted_names
+        # The whole query may be an app id or API key prefix containing separators
+        whole = self._prefixes.get(query[:MAX_PREFIX], set())
+        matches = None
+        for term in _terms(query):
+            names = self._prefixes.get(term[:MAX_PREFIX], set())
+            matches = set(names) if matches is None else matches & names
+            if not matches:
+                break
+        return sorted(whole | (matches or set()))
+
+def paginate(names, page, page_size):
+    """Return (page_names, page, total_pages) with the page clamped to the valid range."""
+    total_pages = max((len(names) + page_size - 1) // page_size, 1)
+    page = min(max(int(page), 1), total_pages)
+    start = (page - 1) * page_size
+    return names[start:start + page_size], page, total_pages
+
+def get_parser_index(parsers, key='parser_index'):
+    """
+    The session's index for a parser registry dict. It is rebuilt only when the registry
+    was replaced (e.g. reloaded from GitHub) or changed without going through the index.
+    """
+    cached = st.session_state.get(key)
+    if cached is not None and cached[0] is parsers and len(cached[1]) == len(parsers):
+        return cached[1]
+    index = ParserIndex(parsers)
+    st.session_state[key] = (parsers, index)
+    return index
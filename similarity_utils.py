@@ -0,0 +1,130 @@
+# similarity_utils.py
+
+import os
+import numpy as np
+import pandas as pd
+from schema_utils import is_null, DEFAULT_COMPARATOR
+
+# Mismatched text fields scoring at least this are shown as tolerant matches ("≈")
+DEFAULT_SIMILARITY_THRESHOLD = float(os.environ.get("OCR_SIMILARITY_THRESHOLD", "0.9"))
+# Longer values are scored on their first MAX_SCORE_LENGTH characters
+MAX_SCORE_LENGTH = 256
+# Pairs are scored in batches of similar length to limit padding
+BATCH_SIZE = 4096
+
+def normalize_series(values):
+    """Lower-case, replace punctuation with spaces and collapse whitespace ('Kores India Ltd.' -> 'kores india ltd')."""
+    return (
+        pd.Series(values, dtype=object).astype(str).str.lower()
+        .str.replace(r'[\W_]+', ' ', regex=True).str.strip()
+    )
+
+def token_sort_series(normalized):
+    """Words of each (normalized) value in sorted order, so word order does not affect the score."""
+    return normalized.str.split().map(lambda words: ' '.join(sorted(words)))
+
+def _encode(strings, width):
+    """Code points of each string in a zero-padded (n, width) array, plus the lengths."""
+    codes = np.zeros((len(strings), width), dtype=np.uint32)
+    lengths = np.zeros(len(strings), dtype=np.int64)
+    for row, text in enumerate(strings):
+        text = text[:MAX_SCORE_LENGTH]
+        lengths[row] = len(text)
+        if text:
+            codes[row, :len(text)] = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    return codes, lengths
+
+def _batch_edit_distance(a_strings, b_strings):
+    """
+    Levenshtein distances of a batch of pairs, computed together.
+
+    The DP table is filled one row (character of `a`) at a time for all pairs at once.
+    Within a row, the insertion chain new[j] = min(new[j-1] + 1, ...) is resolved with a
+    running minimum (new[j] - j == cummin(t[k] - k)), so each row is a handful of array
+    operations over (pairs x len(b)) instead of a Python loop over cells.
+    """
+    width_a = max(min(max((len(s) for s in a_strings), default=0), MAX_SCORE_LENGTH), 1)
+    width_b = max(min(max((len(s) for s in b_strings), default=0), MAX_SCORE_LENGTH), 1)
+    a_codes, a_lengths = _encode(a_strings, width_a)
+    b_codes, b_lengths = _encode(b_strings, width_b)
+    n = len(a_strings)
+
+    columns = np.arange(width_b + 1, dtype=np.int64)
+    previous = np.broadcast_to(columns, (n, width_b + 1)).copy()
+    rows = np.arange(n)
+    # Distance for pairs with an empty `a` is len(b)
+    distances = b_lengths.copy()
+    for i in range(width_a):
+        cost = (b_codes != a_codes[:, i:i + 1]).astype(np.int64)
+        t = np.empty_like(previous)
+        t[:, 0] = previous[:, 0] + 1
+        t[:, 1:] = np.minimum(previous[:, 1:] + 1, previous[:, :-1] + cost)
+        current = np.minimum.accumulate(t - columns, axis=1) + columns
+        finished = a_lengths == i + 1
+        if finished.any():
+            distances[finished] = current[rows[finished], b_lengths[finished]]
+        previous = current
+    return distances
+
+def edit_similarity(a_values, b_values, batch_size=BATCH_SIZE):
+    """Normalized edit similarity 1 - distance / max(len) for aligned sequences of strings."""
+    a_values = [str(value)[:MAX_SCORE_LENGTH] for value in a_values]
+    b_values = [str(value)[:MAX_SCORE_LENGTH] for value in b_values]
+    scores = np.ones(len(a_values), dtype=np.float64)
+    if not a_values:
+        return scores
+    # Sort by length so each batch pads to similar widths
+    order = np.argsort([max(len(a), len(b)) for a, b in zip(a_values, b_values)], kind='stable')
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        a_batch = [a_values[k] for k in batch]
+        b_batch = [b_values[k] for k in batch]
+        longest = np.array([max(len(a), len(b)) for a, b in zip(a_batch, b_batch)], dtype=np.float64)
+        distances = _batch_edit_distance(a_batch, b_batch)
+        scores[batch] = np.where(longest > 0, 1.0 - distances / np.maximum(longest, 1.0), 1.0)
+    return scores
+
+def text_similarity(a_values, b_values):
+    """
+    Similarity (0-1) of aligned string pairs: the better of the edit similarity of the
+    normalized values and of their sorted words, so punctuation, case and word order
+    differences score high ('KORES INDIA LTD' vs 'Kores India Ltd.' -> 1.0).
+    """
+    a_normalized = normalize_series(list(a_values))
+    b_normalized = normalize_series(list(b_values))
+    direct = edit_similarity(a_normalized, b_normalized)
+    a_sorted = token_sort_series(a_normalized)
+    b_sorted = token_sort_series(b_normalized)
+    # Only pairs whose words are out of order can gain from the token-sorted score
+    reordered = ((a_sorted != a_normalized) | (b_sorted != b_normalized)).to_numpy()
+    if reordered.any():
+        direct[reordered] = np.maximum(direct[reordered], edit_similarity(a_sorted[reordered], b_sorted[reordered]))
+    return direct
+
+def score_comparison_df(df, key_column, value1_column, value2_column, threshold=DEFAULT_SIMILARITY_THRESHOLD, comparator=None):
+    """
+    Add a 'Similarity' column to a comparison DataFrame and mark tolerant matches.
+    Matching rows score 1.0; mismatched pairs of non-empty strings in fields the parser's
+    comparator (schema_utils.compile_schema) resolves to "text" are scored in one batch;
+    other mismatches (numbers, dates, amounts, nested values) have no score. With a
+    threshold, scored mismatches reaching it get the "≈" comparison marker, unless a value
+    has nothing left after normalization ('.' vs '-').
+    """
+    field_type = (comparator or DEFAULT_COMPARATOR).field_type
+    scores = pd.Series(np.where(df['Comparison'] == "✔", 1.0, np.nan), index=df.index)
+    value1 = df[value1_column]
+    value2 = df[value2_column]
+    text_pairs = pd.Series([
+        comparison == "✘" and isinstance(a, str) and isinstance(b, str) and not is_null(a) and not is_null(b)
+        and field_type(key, a, b) == "text"
+        for key, a, b, comparison in zip(df[key_column], value1, value2, df['Comparison'])
+    ], index=df.index, dtype=bool)
+    if text_pairs.any():
+        scores[text_pairs] = text_similarity(value1[text_pairs], value2[text_pairs])
+    df = df.assign(Similarity=scores.round(3))
+    if threshold is not None and text_pairs.any():
+        empty = pd.Series(False, index=df.index)
+        empty[text_pairs] = (normalize_series(list(value1[text_pairs])).eq('').to_numpy()
+                             | normalize_series(list(value2[text_pairs])).eq('').to_numpy())
+        df.loc[text_pairs & ~empty & (scores >= threshold), 'Comparison'] = "≈"
+    return df
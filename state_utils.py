@@ -0,0 +1,407 @@
+# state_utils.py
+#
+# State shared by every replica of the apps and the gateway: the OCR result cache, the
+# parser registry and batch job status. Backends:
+#
+#   OCR_SHARED_STATE=/shared/ocr_state.sqlite   file-locked SQLite (the default lives in the temp dir)
+#   OCR_SHARED_STATE=memory                     in-process only, for a single replica or development
+#
+# Values are JSON documents stored under (namespace, key) with an optional expiry and the
+# time they were last written, so readers can fetch only what changed since their last look.
+
+import os
+import time
+import json
+import uuid
+import bisect
+import sqlite3
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from filelock import FileLock
+from compress_utils import pack_text, unpack_text
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATE_PATH = os.path.join(tempfile.gettempdir(), 'ocr_shared_state.sqlite')
+# Cached OCR results are served for this long (0 disables the cache)
+OCR_CACHE_TTL = int(os.environ.get("OCR_CACHE_TTL", str(24 * 60 * 60)))
+# A request claimed by a replica that died is taken over after this long
+CLAIM_TTL = 20 * 60
+# How often a replica waiting for another one's identical request checks the cache
+CLAIM_POLL_INTERVAL = 0.25
+JOB_TTL = 7 * 24 * 60 * 60
+# Upper bounds (seconds) of the job latency histogram buckets: 0.1s to about 10 minutes,
+# 25% apart, plus an overflow bucket. Percentiles are read from bucket bounds, so they
+# are kept incrementally without storing every latency.
+LATENCY_BUCKETS = [round(0.1 * 1.25 ** i, 3) for i in range(40)]
+# Expired entries are purged every this many writes
+PURGE_EVERY = 200
+
+def _expiry(ttl):
+    return time.time() + ttl if ttl else None
+
+class MemoryState:
+    """In-process backend with the same interface as SQLiteState (nothing is shared between processes)."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.RLock()
+
+    def _live(self, namespace, key):
+        entry = self._entries.get((namespace, key))
+        if entry is not None and entry[1] is not None and entry[1] <= time.time():
+            del self._entries[(namespace, key)]
+            return None
+        return entry
+
+    def get(self, namespace, key, default=None):
+        with self._lock:
+            entry = self._live(namespace, key)
+        # Round-trip through JSON so callers never share mutable values, as with SQLite
+        return default if entry is None else json.loads(entry[0])
+
+    def set(self, namespace, key, value, ttl=None):
+        with self._lock:
+            self._entries[(namespace, key)] = (json.dumps(value), _expiry(ttl), time.time())
+
+    def add(self, namespace, key, value, ttl=None):
+        """Set the key only if it is absent or expired; True if it was set."""
+        with self._lock:
+            if self._live(namespace, key) is not None:
+                return False
+            self.set(namespace, key, value, ttl)
+            return True
+
+    def update(self, namespace, key, fn, ttl=None):
+        """Atomically replace the value with fn(current value or None); a None result leaves it unchanged."""
+        with self._lock:
+            value = fn(self.get(namespace, key))
+            if value is not None:
+                self.set(namespace, key, value, ttl)
+            return value
+
+    def delete(self, namespace, key, expected=None):
+        """Delete the key (only if it holds `expected`, when given)."""
+        with self._lock:
+            entry = self._live(namespace, key)
+            if entry is not None and (expected is None or json.loads(entry[0]) == expected):
+                del self._entries[(namespace, key)]
+
+    def items(self, namespace, since=None):
+        """{key: value} of a namespace, or only of the keys written after `since`."""
+        with self._lock:
+            keys = [key for (entry_namespace, key), entry in list(self._entries.items())
+                    if entry_namespace == namespace and (since is None or entry[2] > since)]
+            return {key: value for key in keys if (value := self.get(namespace, key)) is not None}
+
+class SQLiteState:
+    """
+    SQLite backend for replicas on one host or a shared volume.
+    Reads go straight to the database (WAL mode); writes, including the read-modify-write
+    of `add` and `update`, are serialized across processes by a lock file next to it.
+    Large values (cached OCR responses, registries) are stored gzip-compressed.
+    """
+
+    def __init__(self, path=DEFAULT_STATE_PATH):
+        self.path = path
+        self._file_lock = FileLock(path + '.lock')
+        self._local = threading.local()
+        self._writes = 0
+        with self._file_lock:
+            conn = self._connect()
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires REAL, updated REAL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            # Databases created before entries kept their write time
+            if 'updated' not in [row[1] for row in conn.execute("PRAGMA table_info(entries)")]:
+                conn.execute("ALTER TABLE entries ADD COLUMN updated REAL")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_updated ON entries (namespace, updated)")
+
+    def _connect(self):
+        # sqlite3 connections can't be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self):
+        with self._file_lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                self._writes += 1
+                if self._writes % PURGE_EVERY == 0:
+                    conn.execute("DELETE FROM entries WHERE expires IS NOT NULL AND expires <= ?", (time.time(),))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _read(conn, namespace, key):
+        row = conn.execute(
+            "SELECT value FROM entries WHERE namespace = ? AND key = ? AND (expires IS NULL OR expires > ?)",
+            (namespace, key, time.time()),
+        ).fetchone()
+        return None if row is None else json.loads(unpack_text(row[0]))
+
+    @staticmethod
+    def _store(conn, namespace, key, value, ttl):
+        conn.execute(
+            "INSERT OR REPLACE INTO entries (namespace, key, value, expires, updated) VALUES (?, ?, ?, ?, ?)",
+            (namespace, key, pack_text(json.dumps(value)), _expiry(ttl), time.time()),
+        )
+
+    def get(self, namespace, key, default=None):
+        value = self._read(self._connect(), namespace, key)
+        return default if value is None else value
+
+    def set(self, namespace, key, value, ttl=None):
+        with self._write() as conn:
+            self._store(conn, namespace, key, value, ttl)
+
+    def add(self, namespace, key, value, ttl=None):
+        """Set the key only if it is absent or expired; True if it was set."""
+        with self._write() as conn:
+            if self._read(conn, namespace, key) is not None:
+                return False
+            self._store(conn, namespace, key, value, ttl)
+            return True
+
+    def update(self, namespace, key, fn, ttl=None):
+        """Atomically replace the value with fn(current value or None); a None result leaves it unchanged."""
+        with self._write() as conn:
+            value = fn(self._read(conn, namespace, key))
+            if value is not None:
+                self._store(conn, namespace, key, value, ttl)
+            return value
+
+    def delete(self, namespace, key, expected=None):
+        """Delete the key (only if it holds `expected`, when given)."""
+        with self._write() as conn:
+            if expected is None or self._read(conn, namespace, key) == expected:
+                conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def items(self, namespace, since=None):
+        """{key: value} of a namespace, or only of the keys written after `since`."""
+        query = "SELECT key, value FROM entries WHERE namespace = ? AND (expires IS NULL OR expires > ?)"
+        parameters = [namespace, time.time()]
+        if since is not None:
+            query += " AND updated > ?"
+            parameters.append(since)
+        rows = self._connect().execute(query, parameters).fetchall()
+        return {key: json.loads(unpack_text(value)) for key, value in rows}
+
+def open_shared_state(spec=None):
+    """Backend for an OCR_SHARED_STATE value: 'memory', or the path of an SQLite file."""
+    spec = spec or DEFAULT_STATE_PATH
+    if spec == 'memory':
+        return MemoryState()
+    try:
+        return SQLiteState(spec)
+    except (sqlite3.Error, OSError) as e:
+        logger.warning("Shared state at %s unavailable (%s); falling back to in-process state.", spec, e)
+        return MemoryState()
+
+class CachedRequest:
+    """One OCR request slot: `entry` is the cached result, or None if this caller must send it."""
+
+    def __init__(self, cache, key, entry, claim):
+        self.cache = cache
+        self.key = key
+        self.entry = entry
+        self.claim = claim
+
+    def put(self, json_data, time_taken):
+        """Cache the successful result for every replica."""
+        if self.cache.ttl <= 0:
+            return
+        self.cache.state.set('ocr_results', self.key, {'json': json_data, 'time_taken': time_taken}, ttl=self.cache.ttl)
+
+class SharedResultCache:
+    """
+    OCR results cached by request fingerprint (see cassette_utils.request_fingerprint).
+
+    A miss claims the request, so an identical request arriving on any replica meanwhile
+    waits for the first one's result instead of calling the OCR endpoint again. A claim
+    is released when its request finishes (successful or not) and expires after CLAIM_TTL.
+    """
+
+    def __init__(self, state, ttl=OCR_CACHE_TTL, claim_ttl=CLAIM_TTL, poll_interval=CLAIM_POLL_INTERVAL):
+        self.state = state
+        self.ttl = ttl
+        self.claim_ttl = claim_ttl
+        self.poll_interval = poll_interval
+
+    def get(self, key):
+        return self.state.get('ocr_results', key)
+
+    @contextmanager
+    def request(self, key, cancel=None):
+        if self.ttl <= 0:
+            yield CachedRequest(self, key, None, None)
+            return
+        claim = uuid.uuid4().hex
+        entry = None
+        while True:
+            entry = self.get(key)
+            if entry is not None:
+                claim = None
+                break
+            if self.state.add('ocr_claims', key, claim, ttl=self.claim_ttl):
+                break
+            # Another request for the same document and mode is in flight; a cancelled
+            # caller stops waiting and goes ahead (its request is stopped straight away)
+            if cancel is not None and cancel.is_set():
+                claim = None
+                break
+            time.sleep(self.poll_interval)
+        try:
+            yield CachedRequest(self, key, entry, claim)
+        finally:
+            if claim is not None:
+                self.state.delete('ocr_claims', key, expected=claim)
+
+def latency_bucket(seconds):
+    """Index of the LATENCY_BUCKETS bucket holding a latency (len(LATENCY_BUCKETS) for overflow)."""
+    return bisect.bisect_left(LATENCY_BUCKETS, seconds)
+
+def latency_percentile(histogram, q):
+    """Upper bound of the bucket holding the q-th percentile (None for an empty histogram)."""
+    total = sum(histogram)
+    if not total:
+        return None
+    rank = q / 100 * total
+    seen = 0
+    for index, count in enumerate(histogram):
+        seen += count
+        if seen >= rank and count:
+            return LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else float('inf')
+    return float('inf')
+
+class JobStore:
+    """
+    Status of batch OCR jobs, visible from every replica.
+
+    Besides counts, a job keeps running aggregates that are updated as each document
+    starts and finishes: documents in flight, hedged (retried) requests, a latency
+    histogram (see LATENCY_BUCKETS) and the total seconds spent per stage. Readers get
+    throughput, percentiles and ETA from these without the per-document history.
+    """
+
+    def __init__(self, state, ttl=JOB_TTL):
+        self.state = state
+        self.ttl = ttl
+
+    def start(self, parser, total):
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        self.state.set('jobs', job_id, {
+            'job_id': job_id, 'parser': parser, 'total': total, 'done': 0, 'failed': 0, 'in_flight': 0,
+            'retries': 0, 'latency_histogram': [0] * (len(LATENCY_BUCKETS) + 1), 'latency_total': 0.0,
+            'stage_seconds': {}, 'status': 'running', 'started': now, 'updated': now,
+        }, ttl=self.ttl)
+        return job_id
+
+    def _apply(self, job_id, change):
+        def apply(job):
+            if job is None:
+                return None
+            change(job)
+            job['updated'] = time.time()
+            return job
+        return self.state.update('jobs', job_id, apply, ttl=self.ttl)
+
+    def document_started(self, job_id):
+        def change(job):
+            job['in_flight'] += 1
+        return self._apply(job_id, change)
+
+    def document_finished(self, job_id, failed=False, latency=None, stage_seconds=None, retries=0, started=True):
+        """
+        Count a finished document. `latency` is its time from start to finish and
+        `stage_seconds` {stage: seconds} where that time went; `started=False` for documents
+        that never went through document_started (identical copies, staging failures).
+        """
+        def change(job):
+            job['failed' if failed else 'done'] += 1
+            if started:
+                job['in_flight'] = max(job['in_flight'] - 1, 0)
+            job['retries'] += retries
+            if latency is not None:
+                job['latency_histogram'][latency_bucket(latency)] += 1
+                job['latency_total'] += latency
+            for stage, seconds in (stage_seconds or {}).items():
+                job['stage_seconds'][stage] = job['stage_seconds'].get(stage, 0.0) + seconds
+        return self._apply(job_id, change)
+
+    def finish(self, job_id, status='finished'):
+        def change(job):
+            job['status'] = status
+            job['in_flight'] = 0
+        return self._apply(job_id, change)
+
+    def get(self, job_id):
+        return self.state.get('jobs', job_id)
+
+    def changed_since(self, since=None):
+        """{job_id: job} of the jobs written after `since` (all jobs when it is None)."""
+        return self.state.items('jobs', since=since)
+
+    def list(self, active_only=False):
+        """Jobs, most recently started first."""
+        jobs = [job for job in self.state.items('jobs').values() if not active_only or job['status'] == 'running']
+        return sorted(jobs, key=lambda job: job['started'], reverse=True)
+
+def _update_registry(state, apply):
+    """
+    Replace the shared registry with apply(current parsers or None) under the state's write
+    lock, so concurrent edits are applied one after the other; returns (parsers, version).
+    """
+    def change(record):
+        parsers = apply(dict(record['parsers']) if record else None)
+        return {'version': (record['version'] if record else 0) + 1, 'parsers': parsers}
+    record = state.update('registry', 'current', change)
+    # Sessions poll this small key; it only moves forward, so it always names the newest registry
+    state.update('registry', 'latest', lambda latest: max(latest or 0, record['version']))
+    return record['parsers'], record['version']
+
+def publish_parsers(parsers, state):
+    """Make a registry the shared one (e.g. after loading it from a file); returns its version."""
+    return _update_registry(state, lambda current: parsers)[1]
+
+def change_parser(state, name, parser_info=None, base=None):
+    """
+    Add or replace one parser (or delete it, when `parser_info` is None) in the shared
+    registry, keeping edits other sessions made meanwhile. `base` seeds the registry if none
+    is shared yet. Returns the resulting (parsers, version).
+    """
+    def apply(parsers):
+        parsers = parsers if parsers is not None else dict(base or {})
+        if parser_info is None:
+            parsers.pop(name, None)
+        else:
+            parsers[name] = parser_info
+        return parsers
+    return _update_registry(state, apply)
+
+def shared_parsers(state, known_version=None):
+    """(parsers, version) of the shared registry, or None if there is none or it is `known_version`."""
+    latest = state.get('registry', 'latest')
+    if latest is None or latest == known_version:
+        return None
+    record = state.get('registry', 'current')
+    return None if record is None else (record['parsers'], record['version'])
+
+# Shared across Streamlit sessions (modules are imported once per server process)
+SHARED_STATE = open_shared_state(os.environ.get("OCR_SHARED_STATE"))
+OCR_CACHE = SharedResultCache(SHARED_STATE)
+JOBS = JobStore(SHARED_STATE)
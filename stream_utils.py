@@ -0,0 +1,169 @@
+# stream_utils.py
+
+import os
+import json
+import uuid
+import hashlib
+import mimetypes
+from cancel_utils import RequestCancelled
+
+CHUNK_SIZE = 64 * 1024
+
+MIME_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.bmp': 'image/bmp',
+    '.gif': 'image/gif',
+    '.tiff': 'image/tiff',
+    '.pdf': 'application/pdf'
+}
+
+def guess_mime_type(filename):
+    """Return the MIME type for an upload based on its extension."""
+    _, file_ext = os.path.splitext(filename.lower())
+    return MIME_TYPES.get(file_ext) or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+def _as_buffer(source):
+    """
+    Return a zero-copy view of an in-memory source (bytes, memoryview, BytesIO/UploadedFile),
+    or None if the source has to be read as a file.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return memoryview(source)
+    if hasattr(source, 'getbuffer'):
+        return source.getbuffer()
+    return None
+
+def source_digest(source):
+    """sha256 of an upload source: a path, bytes, or a (Bytes)IO object."""
+    digest = hashlib.sha256()
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        digest.update(source)
+    elif hasattr(source, 'getbuffer'):
+        digest.update(source.getbuffer())
+    elif isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+    else:
+        position = source.tell()
+        for chunk in iter(lambda: source.read(1024 * 1024), b''):
+            digest.update(chunk)
+        source.seek(position)
+    return digest.hexdigest()
+
+class MultipartEncoder:
+    """
+    A file-like multipart/form-data body that is produced chunk by chunk while it is sent.
+
+    In-memory uploads are read through a memoryview of the upload buffer and files on
+    disk are read in CHUNK_SIZE pieces, so no full copy of the body is ever built.
+    The total length is known up front, so requests sends a Content-Length header
+    rather than using chunked transfer encoding.
+    """
+
+    def __init__(self, fields, files, boundary=None, chunk_size=CHUNK_SIZE, cancel=None):
+        """
+        `fields` is a dict of form fields; `files` is a list of
+        (field_name, filename, source, mime_type) where source is a path, bytes or a BytesIO.
+        If `cancel` (a CancelToken) is set, the next read raises RequestCancelled.
+        """
+        self.boundary = boundary or uuid.uuid4().hex
+        self.chunk_size = chunk_size
+        self.cancel = cancel
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self._parts = []
+        self._opened = []
+
+        for name, value in (fields or {}).items():
+            self._parts.append(self._part_header(name) + f"{value}\r\n".encode('utf-8'))
+        for name, filename, source, mime_type in files or []:
+            self._parts.append(self._part_header(name, filename, mime_type))
+            buffer = _as_buffer(source)
+            if buffer is not None:
+                self._parts.append(buffer)
+            else:
+                file_obj = open(source, 'rb') if isinstance(source, (str, os.PathLike)) else source
+                if file_obj is not source:
+                    self._opened.append(file_obj)
+                self._parts.append(file_obj)
+            self._parts.append(b"\r\n")
+        self._parts.append(f"--{self.boundary}--\r\n".encode('utf-8'))
+
+        self._length = sum(self._part_length(part) for part in self._parts)
+        self._index = 0
+        self._offset = 0
+
+    def _part_header(self, name, filename=None, mime_type=None):
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        header = f"--{self.boundary}\r\nContent-Disposition: {disposition}\r\n"
+        if mime_type:
+            header += f"Content-Type: {mime_type}\r\n"
+        return (header + "\r\n").encode('utf-8')
+
+    @staticmethod
+    def _part_length(part):
+        if isinstance(part, (bytes, memoryview)):
+            return part.nbytes if isinstance(part, memoryview) else len(part)
+        position = part.tell()
+        size = part.seek(0, os.SEEK_END) - position
+        part.seek(position)
+        return size
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        """Read up to `size` bytes of the encoded body (everything that is left if size < 0)."""
+        if self.cancel is not None and self.cancel.is_set():
+            raise RequestCancelled("Upload cancelled.")
+        if size is None or size < 0:
+            size = self._length
+        out = bytearray()
+        while len(out) < size and self._index < len(self._parts):
+            part = self._parts[self._index]
+            wanted = size - len(out)
+            if isinstance(part, (bytes, memoryview)):
+                chunk = part[self._offset:self._offset + wanted]
+                self._offset += len(chunk)
+                done = self._offset >= self._part_length(part)
+            else:
+                chunk = part.read(min(self.chunk_size, wanted))
+                done = not chunk
+            out += chunk
+            if done:
+                self._index += 1
+                self._offset = 0
+        return bytes(out)
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        """Close files this encoder opened from paths (caller-provided file objects are left open)."""
+        for file_obj in self._opened:
+            file_obj.close()
+        self._opened = []
+
+def read_json_stream(response, chunk_size=CHUNK_SIZE, cancel=None):
+    """
+    Parse a streamed (stream=True) JSON response body.
+
+    The body is read incrementally into a single bytearray and parsed from the raw
+    bytes once it is complete (json has no incremental parser). Unlike response.json()
+    this never holds the chunk list, the joined bytes and the decoded text at the same time. Raises RequestCancelled if `cancel` is set
+    while reading.
+    """
+    buffer = bytearray()
+    for chunk in response.iter_content(chunk_size=chunk_size):
+        if cancel is not None and cancel.is_set():
+            raise RequestCancelled("Download cancelled.")
+        buffer += chunk
+    return json.loads(buffer)
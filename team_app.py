@@ -1,7 +1,9 @@
 import streamlit as st
 from github_utils import download_parsers_from_github, upload_parsers_to_github
-from parser_utils import add_new_parser, list_parsers
+from parser_utils import add_new_parser, list_parsers, sync_parsers
 from ocr_runner import run_parser
+from analytics_utils import corpus_analytics
+from dashboard_utils import jobs_dashboard
 from urllib.parse import parse_qs
 
 # Ensure session state is initialized
@@ -17,10 +19,15 @@ def main():
     requested_parser = query_params.get("parser", [None])[0]
     client_view = query_params.get("client", [False])[0]
 
-    # Ensure parsers are loaded once when the app starts
+    # Ensure parsers are loaded once when the app starts; a registry already shared by
+    # another session or replica is used instead of downloading it again
     if 'loaded' not in st.session_state:
-        download_parsers_from_github()
+        if not sync_parsers():
+            download_parsers_from_github()
         st.session_state.loaded = True
+    else:
+        # Pick up parsers added or deleted in other sessions and replicas
+        sync_parsers()
 
     # Add custom CSS for the sidebar radio buttons (styled similarly to the run parser page)
     st.markdown("""
@@ -82,11 +89,13 @@ def main():
             <li>Add OCR parsers</li>
             <li>List existing parsers</li>
             <li>Run parsers on images</li>
+            <li>Analyze comparison history</li>
+            <li>Monitor batch jobs</li>
         </ul>
     """, unsafe_allow_html=True)
 
     # Radio button menu with custom style
-    menu = ["List Parsers", "Run Parser", "Add Parser"]
+    menu = ["List Parsers", "Run Parser", "Add Parser", "Analytics", "Batch Jobs"]
     choice = st.sidebar.radio("Menu", menu)
 
     # Menu options
@@ -95,7 +104,11 @@ def main():
     elif choice == "List Parsers":
         list_parsers()
     elif choice == "Run Parser":
-        run_parser(st.session_state['parsers'])
+        run_parser(st.session_state['parsers'], allow_profiling=True)
+    elif choice == "Analytics":
+        corpus_analytics()
+    elif choice == "Batch Jobs":
+        jobs_dashboard()
 
     st.sidebar.header("GitHub Actions")
     if st.sidebar.button("Download Parsers"):